@@ -0,0 +1,135 @@
+"""
+Compare langgraph's default checkpoint serializer with the zstd one.
+
+Builds realistic consultation threads (questions, tool calls and Tavily-like
+search results) and reports the bytes written per checkpoint and the
+encode/decode latency. With --database-url the threads are also written and
+read back through PostgresSaver, measuring put/get round-trips.
+
+Usage (from the backend directory):
+    python -m benchmarks.checkpoint_serde --turns 10 20 40
+    python -m benchmarks.checkpoint_serde --database-url $DATABASE_URL
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from src.checkpoint_serde import ZstdSerializer
+
+WORDS = (
+    "dor cabeça febre náusea enxaqueca paciente sintomas tratamento crise "
+    "medicamento pressão arterial diagnóstico neurologista exame sangue "
+    "inflamação abdominal vesícula biliar cólica serotonina síndrome "
+    "recomenda-se avaliação clínica histórico familiar hipertensão diabetes"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def build_thread(turns: int, seed: int = 42) -> list:
+    """A conversation where every third answer is backed by a web search."""
+    rng = random.Random(seed)
+    messages = []
+    for turn in range(turns):
+        messages.append(HumanMessage(content=_text(rng, 25)))
+        if turn % 3 == 2:
+            call_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            messages.append(AIMessage(
+                content="",
+                tool_calls=[{
+                    "name": "tavily_search",
+                    "args": {"query": _text(rng, 6)},
+                    "id": call_id,
+                }],
+            ))
+            results = [
+                {
+                    "url": f"https://example.org/artigo/{rng.randint(1, 10**6)}",
+                    "title": _text(rng, 6),
+                    "content": _text(rng, 140),
+                    "score": rng.random(),
+                }
+                for _ in range(5)
+            ]
+            messages.append(ToolMessage(content=str({"results": results}), tool_call_id=call_id))
+        messages.append(AIMessage(content=_text(rng, 90)))
+    return messages
+
+
+def _timed(fn, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def bench_encoding(serializers: dict, turns: list[int], repeat: int):
+    print(f"{'serializer':<10} {'turns':>5} {'bytes':>10} {'ratio':>6} {'dump ms':>8} {'load ms':>8}")
+    for n in turns:
+        value = build_thread(n)
+        baseline = None
+        for name, serde in serializers.items():
+            typed = serde.dumps_typed(value)
+            size = len(typed[1])
+            baseline = baseline or size
+            dump_ms = _timed(lambda: serde.dumps_typed(value), repeat)
+            load_ms = _timed(lambda: serde.loads_typed(typed), repeat)
+            print(f"{name:<10} {n:>5} {size:>10} {baseline / size:>6.2f} {dump_ms:>8.3f} {load_ms:>8.3f}")
+
+
+def bench_database(serializers: dict, turns: list[int], repeat: int, database_url: str):
+    from langgraph.checkpoint.base import empty_checkpoint
+    from langgraph.checkpoint.postgres import PostgresSaver
+
+    print(f"\n{'serializer':<10} {'turns':>5} {'put ms':>8} {'get ms':>8}")
+    with PostgresSaver.from_conn_string(database_url) as checkpointer:
+        checkpointer.setup()
+        for n in turns:
+            messages = build_thread(n)
+            for name, serde in serializers.items():
+                checkpointer.serde = serde
+                thread_id = f"bench-{name}-{n}-{uuid.uuid4().hex}"
+                config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+
+                def put():
+                    checkpoint = empty_checkpoint()
+                    checkpoint["channel_values"] = {"messages": messages}
+                    checkpoint["channel_versions"] = {"messages": checkpoint["id"]}
+                    return checkpointer.put(config, checkpoint, {}, {"messages": checkpoint["id"]})
+
+                put_ms = _timed(put, repeat)
+                get_ms = _timed(lambda: checkpointer.get({"configurable": {"thread_id": thread_id}}), repeat)
+                print(f"{name:<10} {n:>5} {put_ms:>8.3f} {get_ms:>8.3f}")
+
+                with checkpointer._cursor() as cur:
+                    for table in ("checkpoint_writes", "checkpoint_blobs", "checkpoints"):
+                        cur.execute(f"DELETE FROM {table} WHERE thread_id = %s", (thread_id,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, nargs="+", default=[5, 20, 60])
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--level", type=int, default=3, help="zstd compression level")
+    parser.add_argument("--database-url", help="also benchmark PostgresSaver put/get")
+    args = parser.parse_args()
+
+    serializers = {
+        "default": JsonPlusSerializer(),
+        "zstd": ZstdSerializer(level=args.level),
+    }
+    bench_encoding(serializers, args.turns, args.repeat)
+    if args.database_url:
+        bench_database(serializers, args.turns, args.repeat, args.database_url)
+
+
+if __name__ == "__main__":
+    main()
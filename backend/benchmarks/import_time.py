@@ -0,0 +1,82 @@
+"""
+Cold-start cost of the application: importing `src.main` in a fresh
+interpreter, as every worker (and every reload) does.
+
+Three imports are timed, each in new subprocesses:
+- src.main: the app as served, agent routes mounted but the stack not loaded
+- src.main (CRUD only): with MOUNT_AGENT_ROUTES=false
+- src.agent: the agent stack, paid on the first chat turn or in the lifespan
+
+and the median wall time is reported, followed by the modules with the
+largest cumulative import time (`python -X importtime`) for the first one.
+
+Usage (from the backend directory, with the application's environment):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 10 --top 25
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+TARGETS = {
+    "src.main": ("import src.main", {}),
+    "src.main (CRUD only)": ("import src.main", {"MOUNT_AGENT_ROUTES": "false"}),
+    "src.agent": ("import src.agent", {}),
+}
+
+
+def run(code: str, env: dict, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        env={**os.environ, **env},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def measure(code: str, env: dict, repeat: int) -> float:
+    """Median milliseconds of interpreter start plus the import."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(code, env)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def heaviest_imports(code: str, env: dict, top: int) -> list:
+    """(cumulative ms, module) of the slowest imports, from -X importtime."""
+    entries = []
+    for line in run(code, env, "-X", "importtime").stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        entries.append((int(cumulative) / 1000, module.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    baseline = measure("pass", {}, args.repeat)
+    print(f"{'':<22} {'ms':>8} {'import ms':>10}")
+    print(f"{'interpreter':<22} {baseline:>8.0f}")
+    for name, (code, env) in TARGETS.items():
+        milliseconds = measure(code, env, args.repeat)
+        print(f"{name:<22} {milliseconds:>8.0f} {milliseconds - baseline:>10.0f}")
+
+    code, env = TARGETS["src.main"]
+    print("\nSlowest imports under src.main (cumulative ms)")
+    for milliseconds, module in heaviest_imports(code, env, args.top):
+        print(f"{milliseconds:>8.1f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
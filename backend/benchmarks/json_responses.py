@@ -0,0 +1,166 @@
+"""
+Serialization cost of the heavy JSON responses: the patient listing and
+the chat history.
+
+Each payload is rendered three ways:
+- pydantic + json: response_model validation and FastAPI's default JSONResponse
+- pydantic + orjson: the same validation, rendered by ORJSONResponse
+- trusted + orjson: plain dicts from the rows (what the routes now do)
+
+and the median time and peak traced allocations are reported per render.
+
+Usage (from the backend directory, with the application's environment):
+    python -m benchmarks.json_responses
+    python -m benchmarks.json_responses --patients 100 --messages 400 --repeat 50
+"""
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import datetime
+from typing import List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import TypeAdapter
+from src.models import Patient
+from src.routers.medical_agent import history_message
+from src.routers.users import list_item
+from src.schemas.medical_agent import ChatHistoryResponse
+from src.schemas.patient import PatientListItem
+
+WORDS = (
+    "dor cabeça febre náusea enxaqueca paciente sintomas tratamento crise "
+    "medicamento pressão arterial diagnóstico neurologista exame sangue "
+    "inflamação abdominal vesícula biliar cólica serotonina síndrome"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _date(rng: random.Random) -> str:
+    return f"{rng.randint(1990, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+
+def build_patients(count: int, seed: int = 42) -> List[Patient]:
+    """Loaded-looking patients with a few entries in every record section."""
+    rng = random.Random(seed)
+    patients = []
+    for index in range(count):
+        patient = Patient(
+            full_name=f"Paciente {index}",
+            password="$argon2id$v=19$m=65536,t=3,p=4$...",
+            email=f"paciente{index}@example.com",
+            birthdate=datetime(rng.randint(1940, 2005), rng.randint(1, 12), rng.randint(1, 28)),
+            biological_sex=rng.choice(["Male", "Female"]),
+            weight=round(rng.uniform(45, 120), 1),
+            ancestry=rng.choice(["White", "Black", "Latin", "Asian", "Multiracial"]),
+            medical_record={
+                "conditions": [
+                    {"condition_name": _text(rng, 2), "diagnosis_date": _date(rng), "condition_status": "Active"}
+                    for _ in range(rng.randint(1, 5))
+                ],
+                "allergies": [
+                    {"substance": _text(rng, 1), "reaction_type": _text(rng, 4), "discovery_date": _date(rng)}
+                    for _ in range(rng.randint(0, 3))
+                ],
+                "medications": [
+                    {"medication_name": _text(rng, 1), "dosage": "500mg", "frequency": _text(rng, 3),
+                     "treatment_start_date": _date(rng)}
+                    for _ in range(rng.randint(1, 6))
+                ],
+                "injuries": [
+                    {"injury_description": _text(rng, 4), "type": "Sprain", "occurrence_date": _date(rng),
+                     "severity": "Mild"}
+                    for _ in range(rng.randint(0, 2))
+                ],
+                "family_histories": [
+                    {"relationship_to_patient": "Mother", "medical_condition": _text(rng, 2)}
+                    for _ in range(rng.randint(0, 3))
+                ],
+                "free_user_text": _text(rng, 40),
+            },
+        )
+        patient.id = index + 1
+        patient.version = 1
+        patients.append(patient)
+    return patients
+
+
+def build_history(count: int, seed: int = 42) -> List[tuple]:
+    rng = random.Random(seed)
+    return [
+        ("user", _text(rng, 25)) if index % 2 == 0 else ("assistant", _text(rng, 180))
+        for index in range(count)
+    ]
+
+
+def measure(render, repeat: int) -> tuple:
+    """Median milliseconds and peak traced KiB of one render."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render()
+        timings.append(time.perf_counter() - started)
+
+    tracemalloc.start()
+    render()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(timings) * 1000, peak / 1024
+
+
+def listing_renders(patients: List[Patient]) -> dict:
+    adapter = TypeAdapter(List[PatientListItem])
+
+    def validated():
+        items = adapter.validate_python(patients, from_attributes=True)
+        return adapter.dump_python(items, mode="json", exclude_unset=True)
+
+    return {
+        "pydantic + json": lambda: JSONResponse(validated()).body,
+        "pydantic + orjson": lambda: ORJSONResponse(validated()).body,
+        "trusted + orjson": lambda: ORJSONResponse([list_item(patient) for patient in patients]).body,
+    }
+
+
+def history_renders(history: List[tuple]) -> dict:
+    adapter = TypeAdapter(ChatHistoryResponse)
+
+    def validated():
+        response = ChatHistoryResponse(messages=[{"role": role, "content": content} for role, content in history])
+        return adapter.dump_python(response, mode="json")
+
+    return {
+        "pydantic + json": lambda: JSONResponse(validated()).body,
+        "pydantic + orjson": lambda: ORJSONResponse(validated()).body,
+        "trusted + orjson": lambda: ORJSONResponse(
+            {"messages": [history_message(role, content) for role, content in history]}
+        ).body,
+    }
+
+
+def report(title: str, renders: dict, repeat: int):
+    sizes = {len(render()) for render in renders.values()}
+    print(f"\n{title} ({max(sizes) / 1024:.0f} KiB)")
+    print(f"{'':<20} {'ms':>8} {'peak KiB':>10}")
+    for name, render in renders.items():
+        milliseconds, peak = measure(render, repeat)
+        print(f"{name:<20} {milliseconds:>8.2f} {peak:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patients", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    report(f"GET /patients/ ({args.patients} patients)", listing_renders(build_patients(args.patients)), args.repeat)
+    report(f"GET /chat/{{id}} ({args.messages} messages)", history_renders(build_history(args.messages)), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
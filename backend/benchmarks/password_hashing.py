@@ -0,0 +1,82 @@
+"""
+Logins per second per core for several Argon2 cost settings.
+
+For each setting, measures one verification (wall and CPU time, single
+process), then saturates a pool of --processes workers for --seconds and
+reports the aggregate and per-core login throughput. Argon2 lanes may run
+on threads when parallelism > 1, so the CPU time is the number to compare.
+
+Usage (from the backend directory):
+    python -m benchmarks.password_hashing
+    python -m benchmarks.password_hashing --processes 4 --settings 3:65536:4 2:19456:1
+"""
+import argparse
+import multiprocessing
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.passwords import build_context
+
+PASSWORD = "securePassword123!"
+
+
+def _parse_setting(value: str) -> tuple:
+    time_cost, memory_cost, parallelism = (int(part) for part in value.split(':'))
+    return time_cost, memory_cost, parallelism
+
+
+def _verify_many(setting: tuple, hashed: str, seconds: float) -> int:
+    context = build_context(*setting)
+    deadline = time.perf_counter() + seconds
+    count = 0
+    while time.perf_counter() < deadline:
+        context.verify(PASSWORD, hashed)
+        count += 1
+    return count
+
+
+def bench_setting(setting: tuple, repeat: int, processes: int, seconds: float, executor):
+    context = build_context(*setting)
+    hashed = context.hash(PASSWORD)
+
+    wall, cpu = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        context.verify(PASSWORD, hashed)
+        wall.append(time.perf_counter() - wall_start)
+        cpu.append(time.process_time() - cpu_start)
+
+    started = time.perf_counter()
+    futures = [executor.submit(_verify_many, setting, hashed, seconds) for _ in range(processes)]
+    logins = sum(future.result() for future in futures)
+    throughput = logins / (time.perf_counter() - started)
+
+    time_cost, memory_cost, parallelism = setting
+    print(
+        f"{time_cost:>3} {memory_cost:>8} {parallelism:>3} "
+        f"{statistics.median(wall) * 1000:>9.1f} {statistics.median(cpu) * 1000:>9.1f} "
+        f"{throughput:>10.1f} {throughput / processes:>10.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--settings", nargs="+", type=_parse_setting,
+        default=[(3, 65536, 4), (3, 65536, 1), (2, 19456, 1), (1, 47104, 1)],
+        help="time_cost:memory_cost_kib:parallelism",
+    )
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'t':>3} {'m KiB':>8} {'p':>3} {'wall ms':>9} {'cpu ms':>9} {'logins/s':>10} {'per core':>10}")
+    with ProcessPoolExecutor(args.processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        for setting in args.settings:
+            bench_setting(setting, args.repeat, args.processes, args.seconds, executor)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,5 +4,55 @@ echo "Running entrypoint"
 echo "Applying alembic migrations"
 alembic upgrade head
 
-echo "Starting Fastapi Webserver"
-fastapi run src/main.py --port 8080 --reload
+# SERVE_MODE=development: single process restarting on code changes
+if [ "${SERVE_MODE:-production}" = "development" ]; then
+    echo "Starting Fastapi Webserver (development, reload)"
+    exec fastapi run src/main.py --port 8080 --reload
+fi
+
+# production: one worker per CPU by default, as many as the database connection
+# budget allows; keep-alive above the load balancer's idle timeout, and
+# in-flight agent turns get time to finish on SIGTERM (exec, so the signal
+# reaches uvicorn)
+#
+# Every worker may hold, on the primary:
+#   sync engine    DB_POOL_SIZE + DB_MAX_OVERFLOW        5 + 10
+#   async engine   DB_POOL_SIZE + DB_MAX_OVERFLOW        5 + 10
+#   checkpointer   CHECKPOINT_POOL_MAX_SIZE              10 (agent routes only)
+#   LISTEN         revocations, principal cache, profiling   3
+# 43 with the defaults. DB_CONNECTION_BUDGET is what the application may use:
+# Postgres' max_connections (100 by default) minus the superuser reserve,
+# migrations and admin sessions.
+DB_CONNECTION_BUDGET="${DB_CONNECTION_BUDGET:-90}"
+CHECKPOINT_CONNECTIONS="${CHECKPOINT_POOL_MAX_SIZE:-10}"
+if [ "${MOUNT_AGENT_ROUTES:-true}" = "false" ]; then
+    CHECKPOINT_CONNECTIONS=0
+fi
+WORKER_CONNECTIONS=$(( 2 * (${DB_POOL_SIZE:-5} + ${DB_MAX_OVERFLOW:-10}) + CHECKPOINT_CONNECTIONS + 3 ))
+MAX_WORKERS=$(( DB_CONNECTION_BUDGET / WORKER_CONNECTIONS ))
+if [ "${MAX_WORKERS}" -lt 1 ]; then
+    MAX_WORKERS=1
+fi
+
+WEB_CONCURRENCY="${WEB_CONCURRENCY:-$(nproc)}"
+if [ "${WEB_CONCURRENCY}" -gt "${MAX_WORKERS}" ]; then
+    echo "Capping ${WEB_CONCURRENCY} workers to ${MAX_WORKERS}: ${WORKER_CONNECTIONS} connections each, budget ${DB_CONNECTION_BUDGET}"
+    WEB_CONCURRENCY="${MAX_WORKERS}"
+fi
+# read by the workers to size their warm-up (src/lifecycle.py)
+export DB_CONNECTION_BUDGET WEB_CONCURRENCY
+
+# workers share their Prometheus samples through files, stale ones from a
+# previous run would be added to the new counts
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus-multiproc}"
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
+echo "Starting Fastapi Webserver (production, ${WEB_CONCURRENCY} workers)"
+exec uvicorn src.main:app \
+    --host 0.0.0.0 --port 8080 \
+    --workers "${WEB_CONCURRENCY}" \
+    --timeout-keep-alive "${KEEP_ALIVE_TIMEOUT:-75}" \
+    --timeout-graceful-shutdown "${GRACEFUL_SHUTDOWN_TIMEOUT:-60}" \
+    --proxy-headers --forwarded-allow-ips "${FORWARDED_ALLOW_IPS:-127.0.0.1}" \
+    --no-server-header
@@ -0,0 +1,35 @@
+"""create token usage table
+
+Revision ID: 3f1a7c2d9b4e
+Revises: d22b000c6bfa
+Create Date: 2026-10-18 10:12:41.512337
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a7c2d9b4e'
+down_revision: Union[str, Sequence[str], None] = 'd22b000c6bfa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('token_usage',
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('usage_date', sa.Date(), nullable=False),
+    sa.Column('prompt_tokens', sa.Integer(), nullable=False),
+    sa.Column('completion_tokens', sa.Integer(), nullable=False),
+    sa.Column('llm_calls', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('patient_id', 'usage_date')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('token_usage')
@@ -0,0 +1,45 @@
+"""create threads table
+
+Revision ID: 8b5e0d4a61c7
+Revises: 3f1a7c2d9b4e
+Create Date: 2026-10-18 11:03:17.204918
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '8b5e0d4a61c7'
+down_revision: Union[str, Sequence[str], None] = '3f1a7c2d9b4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('threads',
+    sa.Column('id', sa.String(length=32), nullable=False),
+    sa.Column('patient_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('creation_date', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.Column('last_message_date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['patient_id'], ['patients.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_threads_patient_id'), 'threads', ['patient_id'], unique=False)
+
+    # Before this revision every patient had a single checkpoint thread whose
+    # id was the patient id, keep those conversations reachable.
+    op.execute(
+        "INSERT INTO threads (id, patient_id, title, message_count) "
+        "SELECT id::text, id, 'Consulta', 0 FROM patients"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_threads_patient_id'), table_name='threads')
+    op.drop_table('threads')
@@ -0,0 +1,46 @@
+"""add unique lower(email) index on patients
+
+Revision ID: a4e8f1b2c3d5
+Revises: 5c9d2e7f0a13
+Create Date: 2026-10-18 13:02:44.190375
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4e8f1b2c3d5'
+down_revision: Union[str, Sequence[str], None] = '5c9d2e7f0a13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    CREATE INDEX CONCURRENTLY cannot run inside a transaction and does not
+    block writes on patients while it builds. It fails if two patients
+    already share an email ignoring case, those rows must be merged first.
+    """
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_patients_email_lower',
+            'patients',
+            [sa.text('lower(email)')],
+            unique=True,
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_patients_email_lower',
+            table_name='patients',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,48 @@
+"""add GIN jsonb_path_ops index on patients.medical_record
+
+Revision ID: b7c3d9e2f4a6
+Revises: a4e8f1b2c3d5
+Create Date: 2026-10-18 14:10:52.603417
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7c3d9e2f4a6'
+down_revision: Union[str, Sequence[str], None] = 'a4e8f1b2c3d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    jsonb_path_ops indexes only support @>, @? and @@ (and for jsonpath only
+    `accessor == constant` conditions), which covers the equality filters of
+    the medical record query API, and are smaller and faster than the
+    default jsonb_ops. Built concurrently to keep patients writable.
+    """
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_patients_medical_record_gin',
+            'patients',
+            ['medical_record'],
+            postgresql_using='gin',
+            postgresql_ops={'medical_record': 'jsonb_path_ops'},
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_patients_medical_record_gin',
+            table_name='patients',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
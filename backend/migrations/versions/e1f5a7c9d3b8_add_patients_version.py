@@ -0,0 +1,34 @@
+"""add version column to patients for optimistic concurrency
+
+Revision ID: e1f5a7c9d3b8
+Revises: b7c3d9e2f4a6
+Create Date: 2026-10-18 15:02:11.248310
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f5a7c9d3b8'
+down_revision: Union[str, Sequence[str], None] = 'b7c3d9e2f4a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    A constant server default is stored in the catalog, existing rows are
+    not rewritten.
+    """
+    op.add_column(
+        'patients',
+        sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('patients', 'version')
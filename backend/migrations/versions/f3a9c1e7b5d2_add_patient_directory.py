@@ -0,0 +1,42 @@
+"""add patient_directory for sharded patient storage
+
+Revision ID: f3a9c1e7b5d2
+Revises: e1f5a7c9d3b8
+Create Date: 2026-10-18 16:21:37.904152
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a9c1e7b5d2'
+down_revision: Union[str, Sequence[str], None] = 'e1f5a7c9d3b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    Only used when PATIENT_SHARD_MAP is set; `python -m src.sharding init`
+    fills it from the existing patients.
+    """
+    op.execute(sa.schema.CreateSequence(sa.Sequence('patient_id_seq')))
+    op.create_table(
+        'patient_directory',
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column(
+            'patient_id', sa.BigInteger(), nullable=False,
+            server_default=sa.text("nextval('patient_id_seq')"),
+        ),
+        sa.PrimaryKeyConstraint('email'),
+        sa.UniqueConstraint('patient_id'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('patient_directory')
+    op.execute(sa.schema.DropSequence(sa.Sequence('patient_id_seq')))
@@ -0,0 +1,266 @@
+"""
+Pilha do agente médico: clientes do LLM (Gemini) e da busca (Tavily), o grafo
+LangGraph e o seu checkpointer.
+
+Importado só quando usado (primeiro turno de chat ou lifespan), assim os
+workers e testes que só usam as rotas CRUD não carregam langchain/langgraph
+nem precisam das chaves de API.
+"""
+import operator
+import os
+import threading
+from typing import Annotated, Any, Dict, List, Tuple, TypedDict
+
+from langchain_core.messages import (AIMessage, AnyMessage, BaseMessage,
+                                     HumanMessage)
+from langchain_core.runnables import RunnableConfig
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_tavily import TavilySearch
+from langchain_tavily._utilities import TAVILY_API_URL, TavilySearchAPIWrapper
+from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.graph import END, StateGraph
+from langgraph.prebuilt import ToolNode
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
+from src.checkpoint_serde import checkpoint_serde
+from src.http_client import outbound_session, use_outbound_pool_for_google
+from src.metrics import AGENT_TURN_DURATION, observe_llm_response
+from src.profiling import timed
+from src.usage import usage_writer
+
+# Conexões do checkpointer por processo, compartilhadas por todos os turnos
+CHECKPOINT_POOL_MIN_SIZE = int(os.environ.get('CHECKPOINT_POOL_MIN_SIZE', '1'))
+CHECKPOINT_POOL_MAX_SIZE = int(os.environ.get('CHECKPOINT_POOL_MAX_SIZE', '10'))
+
+# 'rest' faz o Gemini usar o pool HTTP compartilhado, 'grpc' usa o canal HTTP/2 próprio
+GOOGLE_GENAI_TRANSPORT = os.environ.get('GOOGLE_GENAI_TRANSPORT', 'rest')
+
+_graph_lock = threading.Lock()
+_clients = None
+_checkpointer = None
+_agent_graph = None
+
+class AgentState(TypedDict):
+    messages: Annotated[list[AnyMessage], operator.add]
+    patient_record: dict
+    question_count: int
+
+
+class PooledTavilySearchAPIWrapper(TavilySearchAPIWrapper):
+    """
+    Buscas do Tavily pelo pool HTTP compartilhado: o wrapper padrão chama
+    `requests.post` e abre uma conexão nova a cada busca. Entra pelo campo
+    `api_wrapper` do TavilySearch.
+    """
+
+    def raw_results(self, query: str, **params: Any) -> Dict[str, Any]:
+        params = {name: value for name, value in {'query': query, **params}.items() if value is not None}
+        response = outbound_session.post(
+            f"{self.api_base_url or TAVILY_API_URL}/search",
+            json=params,
+            headers={
+                'Authorization': f'Bearer {self.tavily_api_key.get_secret_value()}',
+                'Content-Type': 'application/json',
+                'X-Client-Source': 'langchain-tavily',
+            },
+        )
+        if response.status_code != 200:
+            detail = response.json().get('detail', {})
+            error_message = detail.get('error') if isinstance(detail, dict) else 'Unknown error'
+            raise ValueError(f"Error {response.status_code}: {error_message}")
+        return response.json()
+
+
+class AgentClients:
+    """Clientes dos provedores, criados uma vez por processo (exigem as chaves de API)."""
+
+    def __init__(self):
+        self.search_tool = TavilySearch(max_results=5, api_wrapper=PooledTavilySearchAPIWrapper())
+        self.tools = [self.search_tool]
+
+        self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0, transport=GOOGLE_GENAI_TRANSPORT)
+        use_outbound_pool_for_google(self.llm)
+        self.llm_with_tools = self.llm.bind_tools(self.tools)
+        self.tool_node = ToolNode(self.tools)
+
+
+def get_clients() -> AgentClients:
+    global _clients
+    with _graph_lock:
+        if _clients is None:
+            _clients = AgentClients()
+        return _clients
+
+
+AGENT_PROMPT = """
+Você é um assistente médico virtual altamente inteligente e cauteloso. Sua função é ajudar pacientes a entenderem seus sintomas através de uma conversa contínua.
+
+**NUNCA** forneça um diagnóstico definitivo. Sua tarefa é fazer perguntas para esclarecer os sintomas, sugerir possibilidades e, eventualmente, direcionar o paciente para o especialista correto.
+
+**REGRAS CRÍTICAS:**
+1.  **Conversa Contínua:** Mantenha um diálogo com o paciente. Faça uma pergunta por vez para coletar informações.
+2.  **Contexto:** Foque nas últimas 20 mensagens para manter o contexto da conversa atual.
+3.  **Lógica de Palpite:** A cada 3 perguntas que você fizer:
+    - busque na internet com a ferramenta search_tool para possuir mais embasamento
+    - Após isso, analise bem as últimas conversas realizadas, a busca na internet e no final você deve fornecer um "palpite" ou uma "hipótese preliminar" com base nas informações coletadas até o momento. Deixe claro que é apenas uma possibilidade. Após dar o palpite, você PODE e DEVE continuar fazendo mais perguntas se necessário.
+4.  **Evite Redundância:** Antes de fazer uma nova pergunta, revise o histórico da conversa. **NÃO FAÇA** perguntas cujas respostas já foram fornecidas.
+5.  **Use a Busca:** Se os sintomas ou a combinação com o histórico do paciente não forem claros, use a ferramenta de busca (`search_tool`) para pesquisar informações médicas relevantes.
+
+**FICHA MÉDICA DO PACIENTE:**
+{patient_record}
+"""
+
+def agent_analyst_node(state: AgentState, config: RunnableConfig):
+    """
+    Analisa o estado atual, decide se dá um palpite, faz uma pergunta ou usa uma ferramenta.
+    """
+    question_count = state.get('question_count', 0)
+    context_messages = state['messages'][-20:]
+
+    system_prompt = AGENT_PROMPT.format(patient_record=str(state.get('patient_record', {})))
+    
+    # Adiciona uma instrução especial se for hora de dar um palpite.
+    if question_count > 0 and question_count % 3 == 0:
+        hunch_instruction = (
+            "INSTRUÇÃO ESPECIAL: Você já fez 3 perguntas. Com base no histórico da conversa, "
+            "forneça um palpite preliminar sobre as possíveis causas dos sintomas. "
+            "Use frases como 'Uma possibilidade poderia ser...', 'Com base no que você disse, talvez devêssemos considerar...'. "
+            "Você pode fazer outra pergunta na mesma resposta se achar necessário para continuar a investigação."
+            "No final de seu palpite, diga quais os profissionais da saúde são mais adequados a serem buscados, como por exemplo um médico cardiologista."
+        )
+        messages_with_prompt = [HumanMessage(content=system_prompt), HumanMessage(content=hunch_instruction)] + context_messages
+    else:
+        messages_with_prompt = [HumanMessage(content=system_prompt)] + context_messages
+    
+    ai_response = get_clients().llm_with_tools.invoke(messages_with_prompt)
+    observe_llm_response(ai_response)
+
+    # Contabiliza os tokens consumidos pelo paciente (escrita em lote, fora da requisição)
+    usage = ai_response.usage_metadata
+    if usage:
+        usage_writer.record(
+            config["configurable"]["patient_id"],
+            usage.get("input_tokens", 0),
+            usage.get("output_tokens", 0),
+        )
+    
+    new_question_count = question_count
+    if not ai_response.tool_calls:
+        new_question_count += 1
+        
+    return {"messages": [ai_response], "question_count": new_question_count}
+
+def should_continue_edge(state: AgentState) -> str:
+    """
+    Decide o próximo passo: usar uma ferramenta ou terminar o turno.
+    """
+    last_message = state['messages'][-1]
+    # Se a última mensagem contém uma chamada de ferramenta, vá para o nó de ação.
+    if last_message.tool_calls:
+        return "continue_to_tool"
+
+    # Caso contrário, é uma resposta direta ao usuário, então o turno termina.
+    return "end_turn"
+
+def get_checkpointer() -> PostgresSaver:
+    """
+    Checkpointer do processo, sobre um pool de conexões (antes cada requisição
+    abria e fechava a sua própria conexão).
+    """
+    global _checkpointer
+    with _graph_lock:
+        if _checkpointer is None:
+            pool = ConnectionPool(
+                os.environ["DATABASE_URL"],
+                min_size=CHECKPOINT_POOL_MIN_SIZE,
+                max_size=CHECKPOINT_POOL_MAX_SIZE,
+                kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+                open=True,
+            )
+            _checkpointer = PostgresSaver(pool, serde=checkpoint_serde)
+        return _checkpointer
+
+def get_agent_graph():
+    """
+    Grafo do agente compilado uma única vez por processo; `invoke` pode ser
+    chamado por várias requisições ao mesmo tempo.
+    """
+    global _agent_graph
+    clients = get_clients()
+    checkpointer = get_checkpointer()
+    with _graph_lock:
+        if _agent_graph is None:
+            graph_builder = StateGraph(AgentState)
+            graph_builder.add_node("agent_analyst", agent_analyst_node)
+            graph_builder.add_node("action_tool", clients.tool_node)
+
+            graph_builder.set_entry_point("agent_analyst")
+
+            graph_builder.add_conditional_edges(
+                "agent_analyst",
+                should_continue_edge,
+                {
+                    "continue_to_tool": "action_tool",
+                    "end_turn": END
+                }
+            )
+            graph_builder.add_edge("action_tool", "agent_analyst")
+            _agent_graph = graph_builder.compile(checkpointer=checkpointer)
+        return _agent_graph
+
+def close_agent_graph():
+    """Fecha o pool do checkpointer (encerramento do worker)."""
+    global _checkpointer, _agent_graph
+    with _graph_lock:
+        if _checkpointer is not None:
+            _checkpointer.conn.close()
+        _checkpointer = _agent_graph = None
+
+def run_turn(thread_id: str, patient_id: int, message: str, patient_record: dict) -> str:
+    """
+    Executa um turno do agente na thread e retorna o texto da resposta final.
+    """
+    config = {
+        "configurable": {
+            "thread_id": thread_id,
+            "patient_id": patient_id,
+        }
+    }
+    
+    graph_input = {
+        "messages": [HumanMessage(content=message)],
+        "patient_record": patient_record,
+    }
+
+    graph = get_agent_graph()
+    with timed('agent'), AGENT_TURN_DURATION.time():
+        final_state = graph.invoke(graph_input, config)
+    last_message = final_state["messages"][-1]
+
+    content = ""
+    if isinstance(last_message, AIMessage):
+        content = last_message.content
+    return content
+
+def load_history(thread_id: str) -> List[Tuple[str, object]]:
+    """
+    (papel, conteúdo) das mensagens do usuário e das respostas do assistente
+    no último checkpoint da thread.
+    """
+    checkpointer = get_checkpointer()
+    with timed('agent'):
+        thread_state = checkpointer.get({"configurable": {"thread_id": thread_id}})
+    history = []
+    if thread_state and 'channel_values' in thread_state and 'messages' in thread_state['channel_values']:
+        raw_messages = thread_state['channel_values']['messages']
+        for msg in raw_messages:
+            if isinstance(msg, dict):
+               msg_obj = BaseMessage(**msg)
+            else:
+               msg_obj = msg
+               
+            if isinstance(msg_obj, HumanMessage):
+                history.append(("user", msg_obj.content))
+            elif isinstance(msg_obj, AIMessage) and msg_obj.content:
+                history.append(("assistant", msg_obj.content))
+    return history
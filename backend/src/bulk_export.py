@@ -0,0 +1,220 @@
+"""
+Streaming patient export as NDJSON, CSV or Parquet.
+
+Patients are read through a server-side cursor (`yield_per`) and every batch
+is encoded and handed out as soon as it is read, so memory stays flat
+whatever the number of rows. Password hashes are never exported.
+
+With `flatten`, `medical_record` is split into one column per section
+(`medical_record.conditions`, ...), lists encoded as JSON text in CSV.
+
+With sharded patients (PATIENT_SHARD_MAP) every shard is read through its
+own cursor and the streams are merged back into id order.
+
+CLI usage (from the backend directory):
+    python -m src.bulk_export --format csv --flatten -o patients.csv
+    python -m src.bulk_export --format ndjson | gzip > patients.ndjson.gz
+"""
+import argparse
+import csv
+import heapq
+import io
+import itertools
+import json
+import os
+import sys
+from contextlib import ExitStack, contextmanager
+from datetime import date
+from operator import itemgetter
+from typing import Iterator, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from src.models import Patient
+from src.schemas.patient import MedicalRecordSchema
+from src.sharding import ShardMap, shard_engines
+
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+PATIENT_COLUMNS = ('id', 'full_name', 'email', 'birthdate', 'biological_sex', 'weight', 'ancestry')
+RECORD_COLUMNS = tuple(f'medical_record.{name}' for name in MedicalRecordSchema.model_fields)
+
+
+def export_columns(flatten: bool) -> tuple:
+    return PATIENT_COLUMNS + (RECORD_COLUMNS if flatten else ('medical_record',))
+
+
+def iter_patient_batches(
+    session: Session, flatten: bool = False, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[dict]]:
+    """Yields lists of at most `batch_size` patient dicts, in id order."""
+    columns = [getattr(Patient, name) for name in PATIENT_COLUMNS] + [Patient.medical_record]
+    result = session.execute(
+        select(*columns).order_by(Patient.id).execution_options(yield_per=batch_size)
+    )
+    for partition in result.partitions():
+        batch = []
+        for row in partition:
+            patient = dict(row._mapping)
+            patient['birthdate'] = patient['birthdate'].date() # a date in the API schema
+            if flatten:
+                record = patient.pop('medical_record') or {}
+                for column in RECORD_COLUMNS:
+                    patient[column] = record.get(column.removeprefix('medical_record.'))
+            batch.append(patient)
+        yield batch
+
+
+def iter_merged_batches(
+    sessions: List[Session], flatten: bool = False, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[List[dict]]:
+    """`iter_patient_batches` over several databases (the shards), merged in id order."""
+    if len(sessions) == 1:
+        yield from iter_patient_batches(sessions[0], flatten, batch_size)
+        return
+    patients = heapq.merge(
+        *(itertools.chain.from_iterable(iter_patient_batches(session, flatten, batch_size))
+          for session in sessions),
+        key=itemgetter('id'),
+    )
+    while batch := list(itertools.islice(patients, batch_size)):
+        yield batch
+
+
+@contextmanager
+def patient_sessions(session_factory, shard_map: Optional[ShardMap] = None) -> Iterator[List[Session]]:
+    """Sessions reading every patient: one from `session_factory`, or one per shard."""
+    if shard_map is None:
+        with session_factory() as session:
+            yield [session]
+        return
+    engines = shard_engines(shard_map, poolclass=NullPool)
+    try:
+        with ExitStack() as stack:
+            yield [stack.enter_context(Session(engine)) for engine in engines.values()]
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+
+
+def _ndjson_chunks(batches) -> Iterator[bytes]:
+    for batch in batches:
+        yield ''.join(json.dumps(patient, default=date.isoformat, ensure_ascii=False) + '\n' for patient in batch).encode()
+
+
+def _csv_cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _csv_chunks(batches, flatten: bool) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(flatten))
+    for batch in batches:
+        writer.writerows([_csv_cell(patient[column]) for column in export_columns(flatten)] for patient in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting Parquet output until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _parquet_chunks(batches, flatten: bool) -> Iterator[bytes]:
+    # imported here: pyarrow is heavy and only the Parquet export needs it
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ('id', pa.int64()),
+            ('full_name', pa.string()),
+            ('email', pa.string()),
+            ('birthdate', pa.date32()),
+            ('biological_sex', pa.string()),
+            ('weight', pa.float64()),
+            ('ancestry', pa.string()),
+        ]
+        + [
+            (column, pa.string())
+            for column in (RECORD_COLUMNS if flatten else ('medical_record',))
+        ]
+    )
+    json_columns = [name for name in schema.names if name.startswith('medical_record')]
+
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for batch in batches:
+            for patient in batch:
+                for column in json_columns:
+                    if not isinstance(patient[column], str):
+                        patient[column] = json.dumps(patient[column], ensure_ascii=False)
+            # one row group per batch
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_patients(sessions: List[Session], format: str = 'ndjson', flatten: bool = False,
+                    batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Encoded export, one chunk of bytes per batch of patients."""
+    batches = iter_merged_batches(sessions, flatten, batch_size)
+    if format == 'ndjson':
+        return _ndjson_chunks(batches)
+    if format == 'csv':
+        return _csv_chunks(batches, flatten)
+    if format == 'parquet':
+        return _parquet_chunks(batches, flatten)
+    raise ValueError(f"Unknown export format: {format}")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='ndjson')
+    parser.add_argument('--flatten', action='store_true', help="one column per medical record section")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    parser.add_argument('-o', '--output', help="output file, stdout by default")
+    args = parser.parse_args(argv)
+
+    from src.database import SessionLocal, patient_shard_map
+
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    with output, patient_sessions(SessionLocal, patient_shard_map) as sessions:
+        for chunk in export_patients(sessions, args.format, args.flatten, args.batch_size):
+            output.write(chunk)
+
+
+if __name__ == '__main__':
+    main()
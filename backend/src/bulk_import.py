@@ -0,0 +1,290 @@
+"""
+Bulk patient import from NDJSON (one PatientCreate JSON object per line).
+
+Rows are validated in chunks, passwords are hashed in a process pool and
+every chunk is loaded with a single COPY into a temporary staging table,
+then merged into `patients` with INSERT ... ON CONFLICT DO NOTHING. Rows
+that fail validation or collide with an existing email end up in the
+per-line error report instead of aborting the import.
+
+With sharded patients (PATIENT_SHARD_MAP) the emails are claimed in the
+main database's `patient_directory` first, which hands out the ids, and
+every shard gets its rows through its own COPY and merge.
+
+CLI usage (from the backend directory):
+    python -m src.bulk_import patients.ndjson
+    cat patients.ndjson | python -m src.bulk_import -
+"""
+import argparse
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+from src.models import Patient, PatientDirectory
+from src.passwords import get_password_hash
+from src.schemas.patient import PatientCreate
+from src.sharding import ShardMap, shard_engines
+
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '1000'))
+# 0 hashes in the calling process
+IMPORT_HASH_WORKERS = int(os.environ.get('IMPORT_HASH_WORKERS', str(os.cpu_count() or 1)))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+
+EMAIL_EXISTS = "A patient with this email already exists."
+
+STAGING_COLUMNS = (
+    'line', 'full_name', 'password', 'email', 'birthdate',
+    'biological_sex', 'weight', 'ancestry', 'medical_record', 'id',
+)
+PATIENT_COLUMNS = ', '.join(STAGING_COLUMNS[1:-1])
+
+CREATE_STAGING = """
+CREATE TEMP TABLE patients_import_staging (
+    line integer NOT NULL,
+    full_name text NOT NULL,
+    password text NOT NULL,
+    email text NOT NULL,
+    birthdate timestamp NOT NULL,
+    biological_sex text NOT NULL,
+    weight double precision NOT NULL,
+    ancestry text NOT NULL,
+    medical_record jsonb NOT NULL,
+    id bigint -- claimed in the directory, sharded imports only
+) ON COMMIT DROP
+"""
+
+MERGE_STAGING = f"""
+WITH inserted AS (
+    INSERT INTO patients ({PATIENT_COLUMNS})
+    SELECT {PATIENT_COLUMNS} FROM patients_import_staging ORDER BY line
+    ON CONFLICT (lower(email)) DO NOTHING
+    RETURNING lower(email) AS email
+)
+SELECT line FROM patients_import_staging
+WHERE lower(email) NOT IN (SELECT email FROM inserted)
+ORDER BY line
+"""
+
+# the directory already refused the emails taken, a conflict here aborts the chunk
+MERGE_SHARD_STAGING = f"""
+INSERT INTO patients (id, {PATIENT_COLUMNS})
+SELECT id, {PATIENT_COLUMNS} FROM patients_import_staging ORDER BY line
+"""
+
+
+class PatientImporter:
+    """
+    Imports chunks of NDJSON lines through the given session (the main
+    database's), onto the shards of `shard_map` when given. Use it as a
+    context manager so the hashing pool is shut down at the end.
+    """
+
+    def __init__(self, session: Session, hash_workers: int = IMPORT_HASH_WORKERS,
+                 shard_map: Optional[ShardMap] = None):
+        self.session = session
+        self.hash_workers = hash_workers
+        self.shard_map = shard_map
+        self.received = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self._seen_emails = set()
+        self._pool = None
+        self._shard_engines = {}
+
+    def __enter__(self):
+        if self.shard_map is not None:
+            self._shard_engines = shard_engines(self.shard_map, poolclass=NullPool)
+        if self.hash_workers > 0:
+            # spawn: forking a process that runs threads (the web server) is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.hash_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._pool is not None:
+            self._pool.shutdown()
+        for engine in self._shard_engines.values():
+            engine.dispose()
+
+    def _error(self, line: int, errors: List[str]):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def _validate(self, lines: Iterable[Tuple[int, str]]) -> List[Tuple[int, PatientCreate]]:
+        valid = []
+        for line_no, raw in lines:
+            if not raw.strip():
+                continue
+            self.received += 1
+            try:
+                patient = PatientCreate.model_validate_json(raw)
+            except ValidationError as e:
+                self._error(line_no, [
+                    f"{'.'.join(str(part) for part in err['loc']) or 'body'}: {err['msg']}"
+                    for err in e.errors()
+                ])
+                continue
+
+            email = patient.email.lower()
+            if email in self._seen_emails:
+                self._error(line_no, [EMAIL_EXISTS])
+                continue
+            self._seen_emails.add(email)
+            valid.append((line_no, patient))
+        return valid
+
+    def _hash_passwords(self, passwords: List[str]) -> List[str]:
+        if self._pool is None:
+            return [get_password_hash(password) for password in passwords]
+        chunksize = max(1, len(passwords) // (self.hash_workers * 4))
+        return list(self._pool.map(get_password_hash, passwords, chunksize=chunksize))
+
+    def import_chunk(self, lines: Iterable[Tuple[int, str]]):
+        """Validates, hashes, COPYs and merges one chunk of (line number, text)."""
+        valid = self._validate(lines)
+        if not valid:
+            return
+
+        hashes = self._hash_passwords([patient.password for _, patient in valid])
+        rows = [
+            (
+                line_no,
+                patient.full_name,
+                password,
+                patient.email,
+                patient.birthdate.isoformat(),
+                patient.biological_sex.value,
+                patient.weight,
+                patient.ancestry.value,
+                json.dumps(patient.medical_record.model_dump(mode='json')),
+                None,
+            )
+            for (line_no, patient), password in zip(valid, hashes)
+        ]
+
+        if self.shard_map is None:
+            conflicts = self._merge(rows)
+        else:
+            conflicts = self._merge_sharded(rows)
+
+        for line_no in conflicts:
+            self._error(line_no, [EMAIL_EXISTS])
+        self.imported += len(valid) - len(conflicts)
+
+    @staticmethod
+    def _stage(connection, rows: List[tuple]):
+        """COPYs the rows into a new staging table, returning the psycopg2 cursor."""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.driver_connection.cursor()
+        cursor.execute(CREATE_STAGING)
+        cursor.copy_expert(
+            f"COPY patients_import_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        return cursor
+
+    def _merge(self, rows: List[tuple]) -> List[int]:
+        """Merges into the main database's patients, returning the lines whose email exists."""
+        try:
+            cursor = self._stage(self.session.connection(), rows)
+            cursor.execute(MERGE_STAGING)
+            conflicts = [row[0] for row in cursor.fetchall()]
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return conflicts
+
+    def _merge_sharded(self, rows: List[tuple]) -> List[int]:
+        """
+        Claims the emails in the directory, then merges every shard's rows
+        under the claimed ids. The directory commits last: if anything fails,
+        the rows already committed on a shard are deleted again.
+        """
+        table = Patient.__table__
+        committed = []
+        try:
+            claimed = dict(self.session.execute(
+                insert(PatientDirectory)
+                .values([{'email': row[3].lower()} for row in rows])
+                .on_conflict_do_nothing(index_elements=[PatientDirectory.email])
+                .returning(PatientDirectory.email, PatientDirectory.patient_id)
+            ).all())
+
+            by_shard = defaultdict(list)
+            for row in rows:
+                patient_id = claimed.get(row[3].lower())
+                if patient_id is not None:
+                    by_shard[self.shard_map.shard_for_id(patient_id)].append(row[:-1] + (patient_id,))
+
+            for shard_id, shard_rows in by_shard.items():
+                with self._shard_engines[shard_id].begin() as connection:
+                    self._stage(connection, shard_rows).execute(MERGE_SHARD_STAGING)
+                committed.append((shard_id, [row[-1] for row in shard_rows]))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            for shard_id, patient_ids in committed:
+                with self._shard_engines[shard_id].begin() as connection:
+                    connection.execute(table.delete().where(table.c.id.in_(patient_ids)))
+            raise
+
+        return [row[0] for row in rows if row[3].lower() not in claimed]
+
+    def import_lines(self, lines: Iterable[str], chunk_size: int = IMPORT_CHUNK_SIZE):
+        chunk = []
+        for line_no, raw in enumerate(lines, start=1):
+            chunk.append((line_no, raw))
+            if len(chunk) >= chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+
+    def report(self) -> dict:
+        return {
+            'received': self.received,
+            'imported': self.imported,
+            'failed': self.failed,
+            'errors': self.errors,
+        }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help="NDJSON file, '-' for stdin")
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument('--hash-workers', type=int, default=IMPORT_HASH_WORKERS)
+    args = parser.parse_args(argv)
+
+    from src.database import SessionLocal, patient_shard_map
+
+    source = sys.stdin if args.path == '-' else open(args.path, encoding='utf-8')
+    with source, SessionLocal() as session, \
+            PatientImporter(session, args.hash_workers, patient_shard_map) as importer:
+        importer.import_lines(source, args.chunk_size)
+        report = importer.report()
+
+    json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+    sys.stdout.write('\n')
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
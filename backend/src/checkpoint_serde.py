@@ -0,0 +1,81 @@
+import os
+import threading
+from typing import Any
+
+import zstandard
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# 'zstd' compresses checkpoint blobs, 'default' keeps langgraph's plain encoding
+CHECKPOINT_SERIALIZER = os.environ.get('CHECKPOINT_SERIALIZER', 'zstd')
+CHECKPOINT_ZSTD_LEVEL = int(os.environ.get('CHECKPOINT_ZSTD_LEVEL', '3'))
+# blobs smaller than this are stored uncompressed, zstd framing would not pay off
+CHECKPOINT_ZSTD_MIN_BYTES = int(os.environ.get('CHECKPOINT_ZSTD_MIN_BYTES', '256'))
+
+ZSTD_SUFFIX = '+zstd'
+
+
+class ZstdSerializer(SerializerProtocol):
+    """
+    Checkpoint serializer that encodes values with the wrapped serializer
+    (msgpack for the JsonPlusSerializer) and compresses the result with zstd.
+
+    Compressed blobs are tagged as `<type>+zstd`, every other type is handed to
+    the wrapped serializer untouched, so rows written before this serializer
+    was enabled are still readable.
+    """
+
+    def __init__(
+        self,
+        serde: SerializerProtocol | None = None,
+        level: int = CHECKPOINT_ZSTD_LEVEL,
+        min_bytes: int = CHECKPOINT_ZSTD_MIN_BYTES,
+    ):
+        self.serde = serde or JsonPlusSerializer()
+        self.level = level
+        self.min_bytes = min_bytes
+        # zstd contexts must not be shared between threads
+        self._local = threading.local()
+
+    def _compressor(self) -> zstandard.ZstdCompressor:
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+        return compressor
+
+    def _decompressor(self) -> zstandard.ZstdDecompressor:
+        decompressor = getattr(self._local, 'decompressor', None)
+        if decompressor is None:
+            decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+        return decompressor
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.serde.dumps(obj)
+
+    def loads(self, data: bytes) -> Any:
+        return self.serde.loads(data)
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < self.min_bytes:
+            return type_, data
+        return type_ + ZSTD_SUFFIX, self._compressor().compress(data)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, data_ = data
+        if type_.endswith(ZSTD_SUFFIX):
+            type_ = type_[: -len(ZSTD_SUFFIX)]
+            data_ = self._decompressor().decompress(data_)
+        return self.serde.loads_typed((type_, data_))
+
+
+def get_checkpoint_serde() -> SerializerProtocol:
+    """Builds the serializer selected by CHECKPOINT_SERIALIZER."""
+    if CHECKPOINT_SERIALIZER == 'default':
+        return JsonPlusSerializer()
+    if CHECKPOINT_SERIALIZER == 'zstd':
+        return ZstdSerializer()
+    raise ValueError(f"Unknown CHECKPOINT_SERIALIZER: {CHECKPOINT_SERIALIZER!r}")
+
+
+checkpoint_serde = get_checkpoint_serde()
@@ -1,7 +1,20 @@
+import asyncio
+import itertools
+import logging
 import os
+import time
+from typing import Optional
 
-from sqlalchemy import create_engine
+from fastapi import Depends, Request, Response
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
 from sqlalchemy.orm import sessionmaker
+from src.sharding import ShardMap, is_sharded, sharded_sessionmaker
+
+logger = logging.getLogger(__name__)
 
 db_user = os.environ.get('POSTGRES_USER', 'postgres')
 db_password = os.environ.get('POSTGRES_PASSWORD', 'changeme')
@@ -9,11 +22,140 @@ db_host = os.environ.get('DB_HOST', 'postgres')
 db_port = os.environ.get('DB_PORT', '5432')
 db_name = 'medical_analysis'
 
+def _async_url(url: str) -> str:
+    return make_url(url).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
 DATABASE_URL = os.environ["DATABASE_URL"]
+# asyncpg flavour of the same database, used by the async request handlers
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+
+# streaming replicas serving read-only routes, comma separated
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+# a replica is probed again this often, and skipped for this long after a failure
+REPLICA_HEALTH_INTERVAL = float(os.environ.get('REPLICA_HEALTH_INTERVAL', '10'))
+REPLICA_HEALTH_TIMEOUT = float(os.environ.get('REPLICA_HEALTH_TIMEOUT', '1'))
+# shard map file (see src/sharding.py), patients stay in the main database when unset
+PATIENT_SHARD_MAP = os.environ.get('PATIENT_SHARD_MAP')
+# after a write, the client's reads go to the primary until a replica replays it (at most this long)
+READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', '5'))
+READ_AFTER_COOKIE = 'read_after_lsn'
+READ_AFTER_HEADER = 'X-Read-After-LSN'
+
+# connection pool settings, shared by the sync and async engines (per worker).
+# A worker holds at most 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections to the
+# primary, plus CHECKPOINT_POOL_MAX_SIZE for the agent and 3 LISTEN connections:
+# 15 + 15 + 10 + 3 = 43 with the defaults. entrypoint.sh caps the workers so
+# that fits DB_CONNECTION_BUDGET.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_SHARD_POOL_SIZE = int(os.environ.get('DB_SHARD_POOL_SIZE', str(DB_POOL_SIZE)))
+
+pool_options = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+}
 
-engine = create_engine(DATABASE_URL)
+# the sync engine serves Alembic, the agent checkpoint routes and background writers
+engine = create_engine(DATABASE_URL, **pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **pool_options)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+patient_shard_map = ShardMap.load(PATIENT_SHARD_MAP) if PATIENT_SHARD_MAP else None
+if patient_shard_map is not None:
+    # async sessions route patients to their shard, other tables to the main database
+    AsyncSessionLocal = sharded_sessionmaker(
+        async_engine,
+        patient_shard_map,
+        **{**pool_options, 'pool_size': DB_SHARD_POOL_SIZE},
+    )
+
+class ReplicaRouter:
+    """
+    Picks replica engines round-robin, skipping the ones whose last health
+    check (a `SELECT 1` at most every REPLICA_HEALTH_INTERVAL) failed.
+    """
+
+    def __init__(self, engines: list):
+        self.engines = engines
+        self._turn = itertools.count()
+        self._checked_at = {}
+        self._healthy = {}
+
+    async def _check(self, engine: AsyncEngine) -> bool:
+        try:
+            async with asyncio.timeout(REPLICA_HEALTH_TIMEOUT):
+                async with engine.connect() as connection:
+                    await connection.execute(text('SELECT 1'))
+            return True
+        except Exception:
+            logger.warning("Replica %s failed its health check", engine.url.host, exc_info=True)
+            return False
+
+    def mark_down(self, engine: AsyncEngine):
+        self._healthy[engine] = False
+        self._checked_at[engine] = time.monotonic()
+
+    async def check_all(self):
+        """Health checks every replica now, opening a pooled connection to each healthy one."""
+        for engine in self.engines:
+            self._checked_at[engine] = time.monotonic()
+            self._healthy[engine] = await self._check(engine)
+
+    async def has_replayed(self, engine: AsyncEngine, lsn: str) -> bool:
+        """Whether the replica replayed the WAL up to `lsn` (False when it cannot tell)."""
+        try:
+            async with engine.connect() as connection:
+                return bool(await connection.scalar(
+                    text('SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)'), {'lsn': lsn},
+                ))
+        except DBAPIError:
+            # a malformed value from the client, or the replica went away
+            return False
+
+    async def pick(self) -> Optional[AsyncEngine]:
+        """The next healthy replica, None when there is none."""
+        for _ in range(len(self.engines)):
+            engine = self.engines[next(self._turn) % len(self.engines)]
+            if time.monotonic() - self._checked_at.get(engine, float('-inf')) >= REPLICA_HEALTH_INTERVAL:
+                self._checked_at[engine] = time.monotonic()
+                self._healthy[engine] = await self._check(engine)
+            if self._healthy[engine]:
+                return engine
+        return None
+
+replica_router = ReplicaRouter([
+    create_async_engine(_async_url(url), **pool_options) for url in DATABASE_REPLICA_URLS
+])
+
+async def remember_write(session: AsyncSession, response: Response):
+    """
+    Hands the client the primary's WAL position after its write, as a
+    short-lived cookie and a header: requests carrying it back read from a
+    replica only once the replica has replayed up to it. Call it after the
+    commit. Every worker can check it, nothing is kept server side.
+    """
+    if not replica_router.engines or is_sharded(session):
+        return
+    lsn = await session.scalar(text('SELECT pg_current_wal_lsn()::text'))
+    response.set_cookie(
+        READ_AFTER_COOKIE, lsn, max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite='lax',
+    )
+    response.headers[READ_AFTER_HEADER] = lsn
+
+def _read_after(request: Request) -> Optional[str]:
+    return request.headers.get(READ_AFTER_HEADER) or request.cookies.get(READ_AFTER_COOKIE)
+
 def get_db():
     """
     This is the dependency that will be injected into your path operation functions.
@@ -25,3 +167,53 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_session_factory():
+    """
+    The sync session factory, for routes whose work outlives the request's
+    dependencies (streamed responses open their own session).
+    """
+    return SessionLocal
+
+def get_shard_map() -> Optional[ShardMap]:
+    """The patient shard map, None when patients stay in the main database."""
+    return patient_shard_map
+
+async def get_async_db():
+    """
+    Async counterpart of `get_db`, yielding an AsyncSession (asyncpg) so the
+    route runs on the event loop instead of occupying a threadpool worker.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db(request: Request, primary: AsyncSession = Depends(get_async_db)):
+    """
+    Session for read-only routes, bound to a healthy replica (round-robin).
+    Without replicas (or with sharded patients) it is the request's primary
+    session itself, sessions only take a connection on first use.
+
+    Replicas lag slightly behind: routes must not write through it, and
+    lookups that may concern a row written a moment ago fall back to the
+    primary (see `is_replica`). A client that just wrote reads from the
+    primary until the replica replayed its write (see `remember_write`).
+    """
+    # replicas mirror the main database, sharded patients are not there
+    engine = None if is_sharded(primary) else await replica_router.pick()
+    read_after = _read_after(request)
+    if engine is not None and read_after and not await replica_router.has_replayed(engine, read_after):
+        engine = None
+    if engine is None:
+        yield primary
+        return
+
+    async with AsyncSessionLocal(bind=engine, info={'replica': True}) as db:
+        try:
+            yield db
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                replica_router.mark_down(engine)
+            raise
+
+def is_replica(session: AsyncSession) -> bool:
+    return session.info.get('replica', False)
@@ -0,0 +1,66 @@
+import hashlib
+from http import HTTPStatus
+from typing import Iterable, Optional
+
+from fastapi import HTTPException, Response
+
+# patient data: clients may keep it, but must revalidate every time
+CACHE_CONTROL = 'private, no-cache'
+
+# Every tag is weak (W/): GZipMiddleware compresses the body without touching
+# the ETag, and a strong tag promises byte-identical representations.
+
+
+def version_etag(version: int) -> str:
+    return f'W/"{version}"'
+
+
+def patient_etag(patient_id: int, version: int) -> str:
+    """For routes whose URL does not name the patient (`/patients/me`)."""
+    return f'W/"{patient_id}.{version}"'
+
+
+def digest_etag(parts: Iterable) -> str:
+    """An ETag over everything the representation is derived from."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(f'{part}\n'.encode())
+    return f'W/"{digest.hexdigest()[:32]}"'
+
+
+def parse_if_match(if_match: Optional[str]) -> Optional[int]:
+    """
+    The row version an `If-Match` header expects, None when the header is
+    absent or `*` (any version). The weak tags of `version_etag` are
+    accepted: they name the row version, whatever the encoding.
+    """
+    if if_match is None or if_match.strip() == '*':
+        return None
+    try:
+        return int(if_match.strip().removeprefix('W/').strip('"'))
+    except ValueError:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST, detail="Invalid If-Match header"
+        )
+
+
+def matches_if_none_match(if_none_match: Optional[str], etag: str) -> bool:
+    """`If-None-Match` uses the weak comparison: W/ prefixes are ignored."""
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in if_none_match.split(','))
+
+
+def set_validators(response: Response, etag: str):
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = CACHE_CONTROL
+
+
+def not_modified(etag: str, **headers) -> Response:
+    """The 304 answer, sent before the representation is loaded or serialized."""
+    response = Response(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    set_validators(response, etag)
+    return response
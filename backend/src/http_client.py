@@ -0,0 +1,175 @@
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# hosts kept in the pool and keep-alive connections kept per host
+OUTBOUND_POOL_CONNECTIONS = int(os.environ.get('OUTBOUND_POOL_CONNECTIONS', '10'))
+OUTBOUND_POOL_MAXSIZE = int(os.environ.get('OUTBOUND_POOL_MAXSIZE', '20'))
+# concurrent in-flight requests allowed per host, extra callers wait for a slot
+OUTBOUND_MAX_PER_HOST = int(os.environ.get('OUTBOUND_MAX_PER_HOST', '16'))
+OUTBOUND_DNS_TTL = float(os.environ.get('OUTBOUND_DNS_TTL', '300'))
+OUTBOUND_TIMEOUT = float(os.environ.get('OUTBOUND_TIMEOUT', '60'))
+
+
+class ConnectionMetrics:
+    """Thread-safe counters describing the outbound connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: defaultdict(float))
+
+    def incr(self, host: str, name: str, value: float = 1):
+        with self._lock:
+            self._counters[host][name] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {host: dict(counters) for host, counters in self._counters.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class DNSCache:
+    """Caches resolved addresses per host for `ttl` seconds."""
+
+    def __init__(self, ttl: float = OUTBOUND_DNS_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def resolve(self, host: str, port: int) -> str:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry and entry[1] > now:
+            metrics.incr(host, 'dns_cache_hits')
+            return entry[0]
+
+        metrics.incr(host, 'dns_lookups')
+        address = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._entries[(host, port)] = (address, now + self.ttl)
+        return address
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+metrics = ConnectionMetrics()
+dns_cache = DNSCache()
+
+
+def _cached_dns_connection(connection_cls):
+    class CachedDNSConnection(connection_cls):
+        def _new_conn(self):
+            # only the TCP connect uses the cached address, `host` (Host
+            # header, SNI, certificate checks) is restored right after
+            hostname = self._dns_host
+            try:
+                self._dns_host = dns_cache.resolve(hostname, self.port)
+            except OSError:
+                pass
+            try:
+                return super()._new_conn()
+            finally:
+                self._dns_host = hostname
+
+    return CachedDNSConnection
+
+
+def _counting_pool(pool_cls):
+    class CountingPool(pool_cls):
+        ConnectionCls = _cached_dns_connection(pool_cls.ConnectionCls)
+
+        def _new_conn(self):
+            metrics.incr(self.host, 'connections_opened')
+            return super()._new_conn()
+
+    return CountingPool
+
+
+_POOL_CLASSES = {
+    'http': _counting_pool(HTTPConnectionPool),
+    'https': _counting_pool(HTTPSConnectionPool),
+}
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    requests adapter keeping keep-alive connections per host, with a cap on
+    concurrent requests per host, cached DNS resolution and connection metrics.
+    """
+
+    def __init__(self, max_per_host: int = OUTBOUND_MAX_PER_HOST, **kwargs):
+        self.max_per_host = max_per_host
+        self._slots = {}
+        self._slots_lock = threading.Lock()
+        kwargs.setdefault('pool_connections', OUTBOUND_POOL_CONNECTIONS)
+        kwargs.setdefault('pool_maxsize', OUTBOUND_POOL_MAXSIZE)
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _POOL_CLASSES
+
+    def _host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self._slots_lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                slot = self._slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return slot
+
+    def send(self, request, **kwargs):
+        host = urlsplit(request.url).hostname or ''
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = OUTBOUND_TIMEOUT
+
+        slot = self._host_slot(host)
+        started = time.perf_counter()
+        slot.acquire()
+        metrics.incr(host, 'slot_wait_seconds', time.perf_counter() - started)
+        metrics.incr(host, 'requests')
+        try:
+            return super().send(request, **kwargs)
+        except requests.exceptions.RequestException:
+            metrics.incr(host, 'errors')
+            raise
+        finally:
+            slot.release()
+
+
+def mount_outbound_adapter(session: requests.Session) -> requests.Session:
+    """Routes a (possibly third-party) session through the shared pool."""
+    session.mount('https://', outbound_adapter)
+    session.mount('http://', outbound_adapter)
+    return session
+
+
+outbound_adapter = PooledHTTPAdapter()
+outbound_session = mount_outbound_adapter(requests.Session())
+
+
+def use_outbound_pool_for_google(llm):
+    """
+    Mounts the outbound pool on the REST session of a ChatGoogleGenerativeAI.
+    The gRPC transport manages its own HTTP/2 channel and is left untouched.
+    """
+    transport = getattr(llm.client, '_transport', None)
+    session = getattr(transport, '_session', None)
+    if isinstance(session, requests.Session):
+        mount_outbound_adapter(session)
+
+
+def connection_metrics() -> dict:
+    """Per-host counters; connections reused = requests - connections_opened."""
+    return metrics.snapshot()
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import time
+from datetime import timedelta
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import HTTPException
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from src.models import IdempotencyKey
+
+# how long a completed response is replayed for retries
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 60 * 60)))
+# an in-progress key older than this is considered abandoned (worker died mid-turn)
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '300'))
+# how long a retry waits for the in-flight request before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '120'))
+IDEMPOTENCY_POLL_SECONDS = 0.5
+
+
+def request_fingerprint(thread_id: str, message: str) -> str:
+    return hashlib.sha256(f'{thread_id}\0{message}'.encode()).hexdigest()
+
+
+def begin_request(session: Session, thread_id: str, key: str, fingerprint: str) -> Optional[dict]:
+    """
+    Claim the idempotency key for the current request.
+
+    Returns None when the caller owns the key and must run the turn, or the
+    stored response when a previous request with the same key completed. A
+    request that is still in flight is waited for.
+    """
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+
+    while True:
+        stmt = insert(IdempotencyKey).values(
+            thread_id=thread_id,
+            key=key,
+            request_hash=fingerprint,
+            status='in_progress',
+            expires_at=func.now() + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS),
+        )
+        # take over keys whose response or lock already expired
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IdempotencyKey.thread_id, IdempotencyKey.key],
+            set_={
+                'request_hash': stmt.excluded.request_hash,
+                'status': stmt.excluded.status,
+                'expires_at': stmt.excluded.expires_at,
+                'response': None,
+            },
+            where=IdempotencyKey.expires_at < func.now(),
+        ).returning(IdempotencyKey.key)
+
+        claimed = session.execute(stmt).first()
+        session.commit()
+        if claimed:
+            return None
+
+        existing = session.get(IdempotencyKey, (thread_id, key), populate_existing=True)
+        if existing is None:
+            # the in-flight request failed and released the key, try again
+            continue
+
+        if existing.request_hash != fingerprint:
+            raise HTTPException(
+                status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                detail="Idempotency-Key was already used with a different request",
+            )
+
+        if existing.status == 'completed':
+            return existing.response
+
+        if time.monotonic() >= deadline:
+            raise HTTPException(
+                status_code=HTTPStatus.CONFLICT,
+                detail="A request with this Idempotency-Key is still in progress",
+            )
+        session.rollback()
+        time.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+
+def complete_request(session: Session, thread_id: str, key: str, response: dict):
+    """Store the response so retries with the same key replay it."""
+    session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.thread_id == thread_id, IdempotencyKey.key == key)
+        .values(
+            status='completed',
+            response=response,
+            expires_at=func.now() + timedelta(seconds=IDEMPOTENCY_TTL_SECONDS),
+        )
+    )
+    session.commit()
+
+
+def release_request(session: Session, thread_id: str, key: str):
+    """Forget a key whose request failed, so a retry can run the turn again."""
+    session.rollback()
+    session.execute(
+        delete(IdempotencyKey)
+        .where(IdempotencyKey.thread_id == thread_id, IdempotencyKey.key == key)
+    )
+    session.commit()
@@ -0,0 +1,106 @@
+"""
+Worker startup and shutdown, run by the FastAPI lifespan in `src.main`.
+
+Startup opens what the first requests would otherwise pay for: database
+pool connections, the agent checkpointer pool and compiled graph (when the
+agent routes are mounted), and keep-alive connections to the LLM and search
+providers. The worker only
+reports ready (and uvicorn only accepts connections) once it is done.
+"""
+import asyncio
+import logging
+import os
+import sys
+
+from sqlalchemy import text
+from src import database, metrics
+from src.http_client import outbound_session
+from src.usage import usage_writer
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WARMUP = os.environ.get('STARTUP_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+# Postgres connections every worker together may hold, and the workers (both set by entrypoint.sh)
+DB_CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', '90'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+# revocation list, principal cache and profiling switch
+LISTEN_CONNECTIONS = 3
+
+
+def _budget_warmup_connections() -> int:
+    """
+    Connections per engine left in this worker's share of the budget once
+    its LISTEN connections and the checkpointer's first one are counted,
+    split between the sync and async engines.
+    """
+    share = DB_CONNECTION_BUDGET // max(WEB_CONCURRENCY, 1)
+    return max((share - LISTEN_CONNECTIONS - 1) // 2, 0)
+
+
+# pool connections opened per engine, at most the pool size and the worker's share of the budget
+WARMUP_DB_CONNECTIONS = int(os.environ.get(
+    'WARMUP_DB_CONNECTIONS', str(min(database.DB_POOL_SIZE, _budget_warmup_connections()))
+))
+PROVIDER_URLS = (
+    'https://generativelanguage.googleapis.com/',
+    'https://api.tavily.com/',
+)
+PROVIDER_WARMUP_TIMEOUT = float(os.environ.get('PROVIDER_WARMUP_TIMEOUT', '5'))
+
+
+async def _warm_async_engine(engine, connections: int):
+    async def touch():
+        async with engine.connect() as connection:
+            await connection.execute(text('SELECT 1'))
+
+    # held at the same time, so the pool ends up with `connections` idle ones
+    await asyncio.gather(*(touch() for _ in range(connections)))
+
+
+def _warm_engine(engine, connections: int):
+    opened = [engine.connect() for _ in range(connections)]
+    for connection in opened:
+        connection.execute(text('SELECT 1'))
+        connection.close()
+
+
+def _warm_providers():
+    """TLS handshakes ahead of time, failures only cost the first request its latency."""
+    for url in PROVIDER_URLS:
+        try:
+            outbound_session.head(url, timeout=PROVIDER_WARMUP_TIMEOUT)
+        except Exception as e:
+            logger.warning('Could not pre-connect to %s: %s', url, e)
+
+
+def _warm_agent():
+    # the first import of the agent stack is most of its cost
+    from src import agent
+
+    agent.get_agent_graph()
+
+
+async def warm_up(agent: bool = True):
+    """`agent=False` for CRUD-only workers, which never load the agent stack."""
+    connections = min(WARMUP_DB_CONNECTIONS, database.DB_POOL_SIZE)
+    tasks = [
+        _warm_async_engine(database.async_engine, connections),
+        asyncio.to_thread(_warm_engine, database.engine, connections),
+        database.replica_router.check_all(),
+    ]
+    if agent:
+        tasks += [asyncio.to_thread(_warm_agent), asyncio.to_thread(_warm_providers)]
+    await asyncio.gather(*tasks)
+    logger.info('Worker warmed up')
+
+
+async def shut_down():
+    """Flushes buffered writes and closes the pools once requests have drained."""
+    await asyncio.to_thread(usage_writer.stop)
+    if 'src.agent' in sys.modules:
+        await asyncio.to_thread(sys.modules['src.agent'].close_agent_graph)
+    await database.async_engine.dispose()
+    for engine in database.replica_router.engines:
+        await engine.dispose()
+    database.engine.dispose()
+    metrics.mark_worker_dead()
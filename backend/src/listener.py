@@ -0,0 +1,85 @@
+import logging
+import select
+import threading
+
+import psycopg2
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+LISTEN_RECONNECT_SECONDS = 5
+
+
+class NotifyListener:
+    """
+    Background thread LISTENing on a Postgres channel for this worker.
+
+    Subclasses get `on_listen` once every (re)connection is listening,
+    `on_notify` with each payload and `on_disconnect` when the connection
+    drops. `listening` is only set in between, state kept in sync through
+    the channel must not be trusted without it.
+    """
+
+    channel: str
+    thread_name = 'notify-listener'
+
+    def __init__(self, database_url: str):
+        self.database_url = database_url
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def listening(self) -> bool:
+        return self._listening.is_set()
+
+    def on_listen(self, connection):
+        pass
+
+    def on_notify(self, payload: str):
+        pass
+
+    def on_disconnect(self):
+        pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._listen, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _listen(self):
+        dsn = make_url(self.database_url).set(drivername='postgresql').render_as_string(hide_password=False)
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = psycopg2.connect(dsn)
+                connection.autocommit = True
+                connection.cursor().execute(f'LISTEN {self.channel}')
+                self.on_listen(connection)
+                self._listening.set()
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], 1.0)[0]:
+                        connection.poll()
+                        for notify in connection.notifies:
+                            self.on_notify(notify.payload)
+                        connection.notifies.clear()
+            except Exception:
+                logger.warning('Listener on %s disconnected', self.channel, exc_info=True)
+            finally:
+                self._listening.clear()
+                self.on_disconnect()
+                if connection is not None:
+                    connection.close()
+            self._stopped.wait(LISTEN_RECONNECT_SECONDS)
@@ -1,12 +1,54 @@
-from fastapi import FastAPI
-from src.routers import auth, medical_agent, users
+import os
+from contextlib import asynccontextmanager
 
-app = FastAPI()
+from fastapi import FastAPI, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST
+from src import lifecycle, metrics, profiling
+from src.routers import (admin, auth, bulk, medical_agent, threads, usage,
+                         users)
 
+# responses below this many bytes are not worth the CPU
+GZIP_MINIMUM_SIZE = int(os.environ.get('GZIP_MINIMUM_SIZE', '1024'))
+GZIP_COMPRESS_LEVEL = int(os.environ.get('GZIP_COMPRESS_LEVEL', '5'))
+# 'false' serves only the CRUD routes (patients, auth, threads...): the agent
+# stack is never imported and no LLM/search keys are needed
+MOUNT_AGENT_ROUTES = os.environ.get('MOUNT_AGENT_ROUTES', 'true').lower() in ('1', 'true', 'yes')
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # requests are only accepted once this returns
+    if lifecycle.STARTUP_WARMUP:
+        await lifecycle.warm_up(agent=MOUNT_AGENT_ROUTES)
+    yield
+    await lifecycle.shut_down()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+
+app.include_router(bulk.router) # before users, /patients/{patient_id} would shadow its paths
 app.include_router(users.router)
 app.include_router(auth.router)
-app.include_router(medical_agent.router)
+if MOUNT_AGENT_ROUTES:
+    app.include_router(medical_agent.router)
+app.include_router(usage.router)
+app.include_router(threads.router)
+app.include_router(admin.router)
 
 @app.get("/")
 async def root():
     return {"message": "Access one for the described routes"}
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    """
+    Prometheus metrics of every worker (see src/metrics.py), for the scraper
+    on the internal network: keep it off the public proxy.
+    """
+    return Response(metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+metrics.instrument(app)
+# last: times every route above and wraps the other middlewares
+profiling.instrument(app)
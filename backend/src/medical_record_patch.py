@@ -0,0 +1,52 @@
+from typing import List, Tuple
+
+from sqlalchemy import Text, func, literal
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from src.models import Patient
+from src.schemas.patient import RecordOperation
+
+
+def _path(*segments: str):
+    return literal(list(segments), ARRAY(Text))
+
+
+def _exists(record, *segments: str):
+    return record.op('#>', return_type=JSONB)(_path(*segments)).is_not(None)
+
+
+def compile_record_patch(operations: List[RecordOperation]) -> Tuple[object, list]:
+    """
+    Compiles the operations, applied in order, to a single expression over
+    `patients.medical_record` built from jsonb_set, jsonb_insert and `#-`, so
+    the record is edited inside the UPDATE instead of being sent whole.
+
+    Also returns the conditions the UPDATE must check: every index an
+    operation points to has to exist when it is applied, otherwise no row is
+    updated.
+    """
+    record = Patient.medical_record
+    conditions = []
+
+    for operation in operations:
+        segments = operation.segments
+        value = literal(operation.value, JSONB)
+
+        if segments == ['free_user_text']:
+            record = func.jsonb_set(record, _path(*segments), value, True, type_=JSONB)
+            continue
+
+        section, index = segments[0], segments[1]
+        if operation.op == 'add' and index == '-':
+            record = func.jsonb_insert(record, _path(section, '-1'), value, True, type_=JSONB)
+        elif operation.op == 'add':
+            if int(index) > 0:
+                conditions.append(_exists(record, section, str(int(index) - 1)))
+            record = func.jsonb_insert(record, _path(section, index), value, False, type_=JSONB)
+        elif operation.op == 'remove':
+            conditions.append(_exists(record, section, index))
+            record = record.op('#-', return_type=JSONB)(_path(section, index))
+        else:
+            conditions.append(_exists(record, section, index))
+            record = func.jsonb_set(record, _path(*segments), value, True, type_=JSONB)
+
+    return record, conditions
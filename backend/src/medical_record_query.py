@@ -0,0 +1,43 @@
+import json
+import re
+from typing import List
+
+from sqlalchemy import cast
+from sqlalchemy.dialects.postgresql import JSONPATH
+from src.models import Patient
+from src.schemas.patient import RecordFilter
+
+JSONPATH_COMPARISONS = {'gte': '>=', 'lte': '<='}
+
+
+def _jsonpath_string(value: str) -> str:
+    # jsonpath string literals share JSON's quoting and escaping rules
+    return json.dumps(value, ensure_ascii=False)
+
+
+def compile_record_filter(record_filter: RecordFilter):
+    """
+    Compiles one filter to a `medical_record` predicate: `@>` for equality,
+    `@?` otherwise. Only equality is answered by the GIN jsonb_path_ops index,
+    which indexes (path, value) pairs and cannot look up a regex or a range:
+    `contains`, `gte` and `lte` are checked on the rows the equality filters
+    selected, or on every row when a query has none.
+    Section and field names are validated against the schema before getting
+    here, values only ever appear as quoted literals.
+    """
+    section, field, value = record_filter.section, record_filter.field, record_filter.value
+
+    if record_filter.op == 'eq':
+        return Patient.medical_record.contains({section: [{field: value}]})
+
+    if record_filter.op == 'contains':
+        predicate = f'@.{field} like_regex {_jsonpath_string(re.escape(value))} flag "i"'
+    else:
+        predicate = f'@.{field} {JSONPATH_COMPARISONS[record_filter.op]} {_jsonpath_string(value)}'
+
+    path = f'$.{section}[*] ? ({predicate})'
+    return Patient.medical_record.op('@?')(cast(path, JSONPATH))
+
+
+def compile_record_filters(record_filters: List[RecordFilter]) -> list:
+    return [compile_record_filter(record_filter) for record_filter in record_filters]
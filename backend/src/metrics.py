@@ -0,0 +1,171 @@
+"""
+Prometheus metrics, served at /metrics.
+
+With several workers every process writes its samples to files under
+PROMETHEUS_MULTIPROC_DIR (set, and emptied, by the entrypoint before the
+workers start) and a scrape of any worker aggregates them all. Without it,
+as in development, the scrape reports the process it reaches.
+
+The directory has to be in the environment before prometheus_client is
+first imported: the entrypoint exports it, nothing here reads it late.
+"""
+import os
+import time
+
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+from src import database
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'Time to serve a request, by route template and status',
+    ['method', 'route', 'status'],
+)
+
+# pool gauges are summed over the live workers
+DB_POOL_SIZE = Gauge(
+    'db_pool_size', 'Connections kept open by the pools', ['pool'], multiprocess_mode='livesum',
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Connections currently in use', ['pool'], multiprocess_mode='livesum',
+)
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow', 'Connections open beyond the pool size', ['pool'], multiprocess_mode='livesum',
+)
+DB_POOL_ACQUIRE = Histogram(
+    'db_pool_acquire_seconds',
+    'Time to get a connection from the pool, waiting and pre-ping included',
+    ['pool'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+AGENT_TURN_DURATION = Histogram(
+    'agent_turn_duration_seconds',
+    'Time of an agent turn, LLM and tool calls included',
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+AGENT_LLM_CALLS = Counter('agent_llm_calls', 'LLM calls made by the agent')
+AGENT_TOOL_CALLS = Counter('agent_tool_calls', 'Tool calls requested by the LLM', ['tool'])
+AGENT_TOKENS = Counter('agent_tokens', 'LLM tokens consumed by the agent', ['kind'])
+
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds',
+    'Argon2 time of a hash or verification, in the process that ran it',
+    ['function'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+PASSWORD_HASH_QUEUE = Histogram(
+    'password_hash_queue_seconds',
+    'Time a hashing job waited for a free hashing process',
+    ['function'],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+
+def observe_password_hash(function: str, seconds: float, queued: float):
+    PASSWORD_HASH_DURATION.labels(function).observe(seconds)
+    PASSWORD_HASH_QUEUE.labels(function).observe(max(queued, 0.0))
+
+
+def observe_llm_response(ai_response):
+    AGENT_LLM_CALLS.inc()
+    for tool_call in ai_response.tool_calls:
+        AGENT_TOOL_CALLS.labels(tool_call['name']).inc()
+    usage = ai_response.usage_metadata
+    if usage:
+        AGENT_TOKENS.labels('input').inc(usage.get('input_tokens', 0))
+        AGENT_TOKENS.labels('output').inc(usage.get('output_tokens', 0))
+
+
+def instrument_engine(engine, name: str):
+    """
+    Pool gauges follow checkouts and checkins, the acquire time wraps the
+    engine's `raw_connection`, which outlives `dispose()` (the pool does not).
+    """
+    def on_checkout(*args):
+        DB_POOL_CHECKED_OUT.labels(name).inc()
+        DB_POOL_OVERFLOW.labels(name).set(max(engine.pool.overflow(), 0))
+
+    def on_checkin(*args):
+        pool = engine.pool
+        DB_POOL_CHECKED_OUT.labels(name).dec()
+        # the connection is not back yet: into a full pool, it is closed and the overflow shrinks
+        overflow = pool.overflow() - (pool.checkedin() >= pool.size())
+        DB_POOL_OVERFLOW.labels(name).set(max(overflow, 0))
+
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection():
+        started = time.perf_counter()
+        try:
+            return raw_connection()
+        finally:
+            DB_POOL_ACQUIRE.labels(name).observe(time.perf_counter() - started)
+
+    event.listen(engine, 'checkout', on_checkout)
+    event.listen(engine, 'checkin', on_checkin)
+    engine.raw_connection = timed_raw_connection
+    DB_POOL_SIZE.labels(name).set(engine.pool.size())
+    DB_POOL_CHECKED_OUT.labels(name).set(engine.pool.checkedout())
+    DB_POOL_OVERFLOW.labels(name).set(max(engine.pool.overflow(), 0))
+
+
+def instrument_database():
+    instrument_engine(database.engine, 'primary')
+    instrument_engine(database.async_engine.sync_engine, 'primary_async')
+    for index, engine in enumerate(database.replica_router.engines):
+        instrument_engine(engine.sync_engine, f'replica_{index}')
+
+
+class MetricsMiddleware:
+    """Observes the duration of every request under its route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # set by the router once a route matched, raw paths would explode the label set
+            route = scope.get('route')
+            REQUEST_DURATION.labels(
+                scope['method'], route.path if route is not None else 'unmatched', str(status),
+            ).observe(time.perf_counter() - started)
+
+
+def instrument(app):
+    """Times the requests of `app` and follows the database pools of this worker."""
+    instrument_database()
+    app.add_middleware(MetricsMiddleware)
+
+
+def render() -> bytes:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+def mark_worker_dead():
+    """Drops this worker's pool gauges from the aggregate (shutdown)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,7 +1,9 @@
+import uuid
 from datetime import date, datetime
 from typing import List, Optional
 
-from sqlalchemy import CheckConstraint, func
+from sqlalchemy import (BigInteger, CheckConstraint, ForeignKey, Index,
+                        Sequence, String, func, literal_column, text)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import Mapped, mapped_column, registry
 
@@ -19,6 +21,19 @@ class Patient:
             "ancestry IN ('White', 'Black', 'Latin','Asian','Multiracial')",
             name="ancestry_sex_field_check"
         ),
+        # login and token lookups are case-insensitive and must not scan the table
+        Index(
+            'ix_patients_email_lower',
+            func.lower(literal_column('email')),
+            unique=True,
+        ),
+        # medical record queries (@> and @? operators)
+        Index(
+            'ix_patients_medical_record_gin',
+            'medical_record',
+            postgresql_using='gin',
+            postgresql_ops={'medical_record': 'jsonb_path_ops'},
+        ),
     )
     id: Mapped[int] = mapped_column(primary_key=True, init=False)
     full_name: Mapped[str]
@@ -29,6 +44,86 @@ class Patient:
     weight: Mapped[float]
     ancestry: Mapped[str]
     medical_record: Mapped[dict] = mapped_column(JSONB)
+    # bumped by every update, checked against If-Match by PATCH
+    version: Mapped[int] = mapped_column(init=False, server_default=text('1'))
+    creation_date: Mapped[datetime] = mapped_column(
+        init=False, server_default=func.now()
+    )
+
+@table_registry.mapped_as_dataclass
+class TokenUsage:
+    """Daily LLM token consumption of a patient, aggregated by the usage writer."""
+    __tablename__ = 'token_usage'
+
+    patient_id: Mapped[int] = mapped_column(
+        ForeignKey('patients.id', ondelete='CASCADE'), primary_key=True
+    )
+    usage_date: Mapped[date] = mapped_column(primary_key=True)
+    prompt_tokens: Mapped[int] = mapped_column(default=0)
+    completion_tokens: Mapped[int] = mapped_column(default=0)
+    llm_calls: Mapped[int] = mapped_column(default=0)
+
+
+@table_registry.mapped_as_dataclass
+class ConversationThread:
+    """A consultation of a patient with the agent, checkpointed under its own id."""
+    __tablename__ = 'threads'
+
+    id: Mapped[str] = mapped_column(
+        String(32), primary_key=True, init=False,
+        insert_default=lambda: uuid.uuid4().hex,
+    )
+    patient_id: Mapped[int] = mapped_column(
+        ForeignKey('patients.id', ondelete='CASCADE'), index=True
+    )
+    title: Mapped[str] = mapped_column(default='Nova consulta')
+    message_count: Mapped[int] = mapped_column(default=0)
     creation_date: Mapped[datetime] = mapped_column(
         init=False, server_default=func.now()
     )
+    last_message_date: Mapped[Optional[datetime]] = mapped_column(
+        init=False, default=None
+    )
+
+
+@table_registry.mapped_as_dataclass
+class IdempotencyKey:
+    """Outcome of a chat turn, keyed by the client's Idempotency-Key header."""
+    __tablename__ = 'idempotency_keys'
+
+    thread_id: Mapped[str] = mapped_column(
+        String(32), ForeignKey('threads.id', ondelete='CASCADE'), primary_key=True
+    )
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    request_hash: Mapped[str] = mapped_column(String(64))
+    expires_at: Mapped[datetime] = mapped_column(index=True)
+    status: Mapped[str] = mapped_column(default='in_progress')
+    response: Mapped[Optional[dict]] = mapped_column(JSONB, default=None)
+
+
+patient_id_seq = Sequence('patient_id_seq')
+
+@table_registry.mapped_as_dataclass
+class PatientDirectory:
+    """
+    Email -> patient id index of sharded deployments, kept in the main
+    database: logins find the patient's shard without asking every shard.
+    Its sequence hands out patient ids unique across shards.
+    """
+    __tablename__ = 'patient_directory'
+
+    email: Mapped[str] = mapped_column(primary_key=True) # lowercased
+    patient_id: Mapped[int] = mapped_column(
+        BigInteger, patient_id_seq, init=False, unique=True,
+        server_default=patient_id_seq.next_value(),
+    )
+
+
+@table_registry.mapped_as_dataclass
+class RevokedToken:
+    """A token (access or refresh) revoked before its expiry, by its `jti` claim."""
+    __tablename__ = 'revoked_tokens'
+
+    jti: Mapped[str] = mapped_column(String(32), primary_key=True)
+    # past it the token is rejected anyway and the row can go
+    expires_at: Mapped[datetime] = mapped_column(index=True)
@@ -0,0 +1,30 @@
+import base64
+import binascii
+import json
+from http import HTTPStatus
+
+from fastapi import HTTPException, Request, Response
+
+
+def encode_cursor(last_id: int) -> str:
+    """Opaque keyset cursor pointing after the row with `last_id`."""
+    payload = json.dumps({'after': last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded))['after']
+        if not isinstance(after, int):
+            raise ValueError(after)
+        return after
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor")
+
+
+def set_next_cursor(request: Request, response: Response, last_id: int):
+    """Expose the next page as `X-Next-Cursor` and an RFC 8288 `Link` header."""
+    cursor = encode_cursor(last_id)
+    response.headers['X-Next-Cursor'] = cursor
+    response.headers['Link'] = f'<{request.url.include_query_params(cursor=cursor)}>; rel="next"'
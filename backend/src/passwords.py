@@ -0,0 +1,118 @@
+"""
+Argon2 password hashing, run in a dedicated process pool.
+
+Kept free of application imports: the pool workers (spawned, not forked)
+import only this module.
+"""
+import asyncio
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Optional, Tuple
+
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+
+# cost of new hashes; stored hashes with other parameters are upgraded at login
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '65536')) # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', '4'))
+# processes per web worker, 0 hashes in the event loop's threadpool instead
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+# hashing jobs queued or running per web worker, beyond that logins get a 503
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '64'))
+
+
+def build_context(time_cost: int = ARGON2_TIME_COST, memory_cost: int = ARGON2_MEMORY_COST,
+                  parallelism: int = ARGON2_PARALLELISM) -> PasswordHash:
+    return PasswordHash((
+        Argon2Hasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism),
+    ))
+
+
+pwd_context = build_context()
+
+
+def get_password_hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verifies, returning a new hash when the stored one uses outdated parameters."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _timed(fn, *args):
+    """Runs `fn` in whichever process the pool picked, returning (result, seconds)."""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+class HashingPool:
+    """Runs the functions above in worker processes, with a cap on pending jobs."""
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    async def run(self, fn, *args):
+        # imported here to keep the worker processes free of fastapi and the app
+        from fastapi import HTTPException
+        from src.metrics import observe_password_hash
+
+        if not self._pending.acquire(blocking=False):
+            raise HTTPException(
+                status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                detail="Too many concurrent logins, retry shortly",
+                headers={'Retry-After': '1'},
+            )
+        try:
+            submitted = time.perf_counter()
+            result, seconds = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _timed, fn, *args
+            )
+            observe_password_hash(fn.__name__, seconds, time.perf_counter() - submitted - seconds)
+            return result
+        finally:
+            self._pending.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+hashing_pool = HashingPool()
+atexit.register(hashing_pool.shutdown)
+
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """`verify_and_update` in the pool: (valid, new hash or None)."""
+    return await hashing_pool.run(verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,118 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import DATABASE_URL
+from src.listener import NotifyListener
+
+# 0 disables the cache
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '60'))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+PRINCIPAL_CACHE_CHANNEL = 'principal_invalidation'
+
+
+class PrincipalCache(NotifyListener):
+    """
+    TTL + LRU cache of authenticated patients, keyed by (kind, token subject).
+
+    Entries are dropped when the patient is updated or deleted: locally right
+    away and in the other workers through a Postgres NOTIFY sent in the
+    writing transaction. Hits are only served while this worker is listening
+    for those notifications, so a lost connection cannot serve stale data for
+    longer than it takes to notice.
+    """
+
+    channel = PRINCIPAL_CACHE_CHANNEL
+    thread_name = 'principal-cache-listener'
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_SIZE,
+                 database_url: str = DATABASE_URL):
+        super().__init__(database_url)
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidation, a lookup that started before one is not cached
+        self._generation = 0
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, kind: str, subject: str):
+        """The cached value, or None on a miss (then call `put` with `generation()` taken first)."""
+        if not self.enabled:
+            return None
+        self.start()
+        key = (kind, subject.lower())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= now or not self._listening.is_set():
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[0]
+
+    def put(self, kind: str, subject: str, value, generation: int):
+        if not self.enabled or not self._listening.is_set():
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[(kind, subject.lower())] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end((kind, subject.lower()))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, subject: str):
+        subject = subject.lower()
+        with self._lock:
+            self._generation += 1
+            self._counters['invalidations'] += 1
+            for key in [key for key in self._entries if key[1] == subject]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    async def publish_invalidation(self, session: AsyncSession, subject: str):
+        """
+        Drops the subject here and, once `session` commits, in every other
+        worker (NOTIFY is transactional, a rolled back write notifies nobody).
+        """
+        self.invalidate(subject)
+        await session.execute(
+            text('SELECT pg_notify(:channel, :subject)'),
+            {'channel': PRINCIPAL_CACHE_CHANNEL, 'subject': subject.lower()},
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, 'size': len(self._entries), 'listening': self._listening.is_set()}
+
+    # anything cached while not listening may have missed an invalidation
+    def on_listen(self, connection):
+        self.clear()
+
+    def on_notify(self, payload: str):
+        self.invalidate(payload)
+
+    def on_disconnect(self):
+        self.clear()
+
+
+principal_cache = PrincipalCache()
+atexit.register(principal_cache.stop)
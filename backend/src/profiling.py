@@ -0,0 +1,368 @@
+"""
+Per-request timings, returned in a `Server-Timing` header, and sampling
+profiles of selected requests.
+
+Every request gets its database, handler, serialization and agent time:
+- db: cursor executions on any SQLAlchemy engine, with the query count
+- handler: the endpoint function itself (database and agent time included)
+- serialize: from the endpoint's return to the response being ready
+  (response model validation and JSON rendering)
+- agent: agent turns and history loads, see `timed`
+- app: the whole request, middlewares included
+
+A sampled request also gets a profile: the stacks of the threads running it,
+taken every PROFILE_INTERVAL seconds and written to PROFILE_DIR in the folded
+format read by flamegraph.pl, inferno or speedscope. A request is sampled
+with probability `sample_rate` (PROFILE_SAMPLE_RATE, changed for every worker
+through the admin routes) or when it carries `X-Profile: 1` along with the
+admin token. Nothing runs for the others besides a random draw. Only the
+newest PROFILE_KEEP profiles are kept.
+"""
+import asyncio
+import atexit
+import functools
+import inspect
+import os
+import random
+import re
+import secrets
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from contextlib import contextmanager
+from typing import List, Optional
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.routing import request_response
+from src import security
+from src.database import DATABASE_URL
+from src.listener import NotifyListener
+
+# 'false' leaves the app uninstrumented: no Server-Timing and no profiles
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+# fraction of requests profiled by each worker until changed through /admin/profiling
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', '0.005'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'profiles'))
+# older profiles are deleted as new ones are saved
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '200'))
+PROFILING_CHANNEL = 'profiling_switch'
+PROFILE_HEADER = b'x-profile'
+ADMIN_TOKEN_HEADER = b'x-admin-token'
+
+PROFILE_NAME = re.compile(r'^\d+-[\w.-]+\.folded$')
+
+_current_timings: ContextVar[Optional['RequestTimings']] = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Durations of one request, in seconds, added from any thread serving it."""
+
+    __slots__ = ('started', 'durations', 'queries', 'endpoint_finished', 'profile')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.queries = 0
+        self.endpoint_finished = None
+        self.profile: Optional[SamplingProfile] = None
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        self.durations['app'] = time.perf_counter() - self.started
+        metrics = []
+        for name, seconds in self.durations.items():
+            metric = f'{name};dur={seconds * 1000:.1f}'
+            if name == 'db':
+                metric += f';desc="{self.queries} queries"'
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+
+@contextmanager
+def timed(name: str):
+    """Adds the block's duration to the current request's `name` timing."""
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_timings.get() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current_timings.get()
+    started = conn.info.get('query_started')
+    if timings is not None and started:
+        timings.add('db', time.perf_counter() - started.pop())
+        timings.queries += 1
+
+
+@functools.lru_cache(maxsize=4096)
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    if 'site-packages' + os.sep in filename:
+        filename = filename.rsplit('site-packages' + os.sep, 1)[1]
+    elif filename.startswith(os.getcwd() + os.sep):
+        filename = os.path.relpath(filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def _request_stack(frame, root, thread_label: str) -> Optional[str]:
+    """The folded stack from `root` down to `frame`, None if `root` is not on it."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        if frame is root:
+            labels.append(thread_label)
+            return ';'.join(reversed(labels))
+        frame = frame.f_back
+    return None
+
+
+class SamplingProfile:
+    """
+    Samples the stacks of the threads serving one request from a background
+    thread. The event loop thread is shared with other requests, so only its
+    samples below this request's middleware frame are kept; threadpool
+    threads are added by the endpoint while they run it.
+    """
+
+    def __init__(self, name: str, interval: Optional[float] = None):
+        self.name = name
+        self.interval = interval or PROFILE_INTERVAL
+        self.samples = Counter()
+        # thread id -> (frame the request's stacks start from, label of the thread)
+        self._roots = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add_thread(self, root, label: str):
+        self._roots[threading.get_ident()] = (root, label)
+
+    def remove_thread(self):
+        self._roots.pop(threading.get_ident(), None)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, (root, label) in list(self._roots.items()):
+                stack = _request_stack(frames.get(ident), root, label)
+                if stack:
+                    self.samples[stack] += 1
+
+    def folded(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+    def save(self, directory: Optional[str] = None) -> str:
+        """Writes the profile, then deletes all but the newest PROFILE_KEEP."""
+        directory = directory or PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.name)
+        with open(path, 'w') as profile_file:
+            profile_file.write(self.folded())
+        for name in list_profiles(directory, limit=None)[PROFILE_KEEP:]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass # removed by another worker meanwhile
+        return path
+
+    def finish(self):
+        """Stops sampling and saves (blocking: run it off the event loop)."""
+        self.stop()
+        self.save()
+
+
+def profile_name(method: str, path: str) -> str:
+    slug = re.sub(r'[^\w.-]+', '_', path.strip('/')) or 'root'
+    return f'{time.time_ns() // 1_000_000}-{os.getpid()}-{method.lower()}-{slug[:60]}.folded'
+
+
+def list_profiles(directory: Optional[str] = None, limit: Optional[int] = 100) -> List[str]:
+    """Profile file names, newest first (all of them with `limit=None`)."""
+    directory = directory or PROFILE_DIR
+    try:
+        names = [name for name in os.listdir(directory) if PROFILE_NAME.match(name)]
+    except FileNotFoundError:
+        return []
+    return sorted(names, key=lambda name: int(name.split('-', 1)[0]), reverse=True)[:limit]
+
+
+def profile_path(name: str, directory: Optional[str] = None) -> Optional[str]:
+    if not PROFILE_NAME.match(name):
+        return None
+    path = os.path.join(directory or PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingSwitch(NotifyListener):
+    """
+    The sample rate of this worker. Changes are sent to every worker with a
+    NOTIFY, a worker starting afterwards begins at PROFILE_SAMPLE_RATE again.
+    """
+
+    channel = PROFILING_CHANNEL
+    thread_name = 'profiling-listener'
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, database_url: str = DATABASE_URL):
+        super().__init__(database_url)
+        self.sample_rate = sample_rate
+
+    def set_sample_rate(self, session: Session, sample_rate: float):
+        """Sent once `session` commits, applied to this worker right away."""
+        session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': PROFILING_CHANNEL, 'payload': repr(float(sample_rate))},
+        )
+        self.sample_rate = sample_rate
+
+    def on_notify(self, payload: str):
+        self.sample_rate = float(payload)
+
+    def should_profile(self, scope) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if not security.ADMIN_API_TOKEN:
+            return False
+        headers = dict(scope['headers'])
+        admin_token = headers.get(ADMIN_TOKEN_HEADER)
+        return (
+            headers.get(PROFILE_HEADER) == b'1'
+            and admin_token is not None
+            and secrets.compare_digest(admin_token, security.ADMIN_API_TOKEN.encode())
+        )
+
+    def stats(self) -> dict:
+        return {'sample_rate': self.sample_rate, 'listening': self.listening}
+
+
+profiling_switch = ProfilingSwitch()
+atexit.register(profiling_switch.stop)
+
+
+class ProfilingMiddleware:
+    """Times every request and samples the selected ones (outermost middleware)."""
+
+    def __init__(self, app, switch: ProfilingSwitch = profiling_switch):
+        self.app = app
+        self.switch = switch
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        self.switch.start()
+        timings = RequestTimings()
+        profile = None
+        if self.switch.should_profile(scope):
+            profile = timings.profile = SamplingProfile(profile_name(scope['method'], scope['path']))
+            profile.add_thread(sys._getframe(), 'event loop')
+
+        async def send_with_timings(message):
+            if message['type'] == 'http.response.start':
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', timings.server_timing())
+                if profile is not None:
+                    headers['X-Profile-Id'] = profile.name
+            await send(message)
+
+        token = _current_timings.set(timings)
+        if profile is not None:
+            profile.start()
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _current_timings.reset(token)
+            if profile is not None:
+                # joining the sampler and writing the file would block the event loop
+                await asyncio.to_thread(profile.finish)
+
+
+def _timed_endpoint(call):
+    """The endpoint wrapped to time itself, running in whichever thread FastAPI picks."""
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def timed_call(**values):
+            timings = _current_timings.get()
+            if timings is None:
+                return await call(**values)
+            started = time.perf_counter()
+            try:
+                return await call(**values)
+            finally:
+                timings.endpoint_finished = time.perf_counter()
+                timings.add('handler', timings.endpoint_finished - started)
+        return timed_call
+
+    @functools.wraps(call)
+    def timed_call(**values):
+        timings = _current_timings.get()
+        if timings is None:
+            return call(**values)
+        profile = timings.profile
+        if profile is not None:
+            profile.add_thread(sys._getframe(), 'threadpool')
+        started = time.perf_counter()
+        try:
+            return call(**values)
+        finally:
+            timings.endpoint_finished = time.perf_counter()
+            timings.add('handler', timings.endpoint_finished - started)
+            if profile is not None:
+                profile.remove_thread()
+    return timed_call
+
+
+def _timed_route_handler(handler):
+    async def timed_handler(request):
+        response = await handler(request)
+        timings = _current_timings.get()
+        if timings is not None and timings.endpoint_finished is not None:
+            timings.add('serialize', time.perf_counter() - timings.endpoint_finished)
+        return response
+    return timed_handler
+
+
+def instrument(app):
+    """
+    Adds the timings to `app`: wraps the endpoints of the routes included so
+    far, hooks the SQLAlchemy engines and installs the middleware. Call it
+    after every router is included and every other middleware is added.
+    """
+    if not SERVER_TIMING:
+        return
+    for route in app.routes:
+        if isinstance(route, APIRoute):
+            route.dependant.call = _timed_endpoint(route.dependant.call)
+            route.app = request_response(_timed_route_handler(route.get_route_handler()))
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,111 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import DATABASE_URL
+from src.listener import NotifyListener
+from src.models import RevokedToken
+
+REVOCATION_CHANNEL = 'token_revocation'
+PURGE_INTERVAL_SECONDS = 60
+
+
+def _utc(timestamp: float) -> datetime:
+    # revoked_tokens.expires_at is a naive UTC timestamp
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+
+
+class RevocationList(NotifyListener):
+    """
+    Revoked token ids (`jti` claims) with their expiry, stored in
+    `revoked_tokens` and mirrored in memory by every worker.
+
+    The mirror is loaded when the listener connects and then follows the
+    NOTIFY sent by every revocation, so a check is a set lookup. While the
+    listener is down it cannot be trusted and checks query Postgres instead.
+    """
+
+    channel = REVOCATION_CHANNEL
+    thread_name = 'revocation-listener'
+
+    def __init__(self, database_url: str = DATABASE_URL):
+        super().__init__(database_url)
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def _add(self, jti: str, expires: float):
+        with self._lock:
+            self._revoked[jti] = expires
+            now = time.time()
+            if now >= self._next_purge:
+                self._next_purge = now + PURGE_INTERVAL_SECONDS
+                self._revoked = {key: value for key, value in self._revoked.items() if value > now}
+
+    async def is_revoked(self, session: AsyncSession, jti: str) -> bool:
+        """`session` is only used while the in-memory copy is out of sync (use the primary)."""
+        self.start()
+        if self.listening:
+            return jti in self._revoked
+        return await session.scalar(
+            select(RevokedToken.jti).where(RevokedToken.jti == jti)
+        ) is not None
+
+    async def revoke(self, session: AsyncSession, jti: str, expires: float) -> bool:
+        """
+        Records the revocation in `session`; the other workers hear of it
+        once the transaction commits (NOTIFY is transactional).
+
+        False when the token was already revoked, by a transaction committed
+        meanwhile included: a concurrent revocation of the same jti waits for
+        the first one to commit, then finds its row.
+        """
+        inserted = await session.scalar(
+            insert(RevokedToken)
+            .values(jti=jti, expires_at=_utc(expires))
+            .on_conflict_do_nothing(index_elements=[RevokedToken.jti])
+            .returning(RevokedToken.jti)
+        )
+        if inserted is None:
+            return False
+        # expired rows are of no use to anyone, drop them on the way
+        await session.execute(
+            delete(RevokedToken).where(RevokedToken.expires_at < _utc(time.time()))
+        )
+        await session.execute(
+            text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': REVOCATION_CHANNEL, 'payload': f'{jti}:{expires}'},
+        )
+        self._add(jti, expires)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._revoked), 'listening': self.listening}
+
+    def on_listen(self, connection):
+        # LISTEN is already active: revocations committed from here on are notified
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT jti, expires_at FROM revoked_tokens WHERE expires_at > %s',
+                (_utc(time.time()),),
+            )
+            revoked = {
+                jti: expires_at.replace(tzinfo=timezone.utc).timestamp()
+                for jti, expires_at in cursor
+            }
+        # revocations are never undone, merging keeps any made meanwhile
+        with self._lock:
+            self._revoked.update(revoked)
+
+    def on_notify(self, payload: str):
+        jti, _, expires = payload.partition(':')
+        self._add(jti, float(expires))
+
+
+revocation_list = RevocationList()
+atexit.register(revocation_list.stop)
@@ -0,0 +1,63 @@
+from http import HTTPStatus
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy.orm import Session
+from src.database import get_db
+from src.http_client import connection_metrics
+from src.principal_cache import principal_cache
+from src.profiling import list_profiles, profile_path, profiling_switch
+from src.revocation import revocation_list
+from src.schemas.admin import ProfilingSettings, ProfilingStatus
+from src.security import require_admin_token
+
+DbSession = Annotated[Session, Depends(get_db)]
+
+router = APIRouter(prefix='/admin', tags=['admin'], dependencies=[Depends(require_admin_token)])
+
+@router.get('/stats')
+def get_stats():
+    """
+    In-process counters of this worker: principal cache hits and misses,
+    revoked tokens held in memory, outbound connection reuse per host.
+    Requires the `X-Admin-Token` header.
+    """
+    return {
+        'principal_cache': principal_cache.stats(),
+        'revocation_list': revocation_list.stats(),
+        'profiling': profiling_switch.stats(),
+        'outbound_http': connection_metrics(),
+    }
+
+def profiling_status() -> ProfilingStatus:
+    return ProfilingStatus(**profiling_switch.stats(), profiles=list_profiles())
+
+@router.get('/profiling', response_model=ProfilingStatus)
+def get_profiling():
+    """
+    The sample rate of this worker and the latest saved profiles. Single
+    requests are profiled with the `X-Profile: 1` header next to the admin token.
+    """
+    return profiling_status()
+
+@router.put('/profiling', response_model=ProfilingStatus)
+def set_profiling(settings: ProfilingSettings, db: DbSession):
+    """
+    Profiles this fraction of the requests on every worker (0 stops it).
+    Workers started later use PROFILE_SAMPLE_RATE.
+    """
+    profiling_switch.set_sample_rate(db, settings.sample_rate)
+    db.commit()
+    return profiling_status()
+
+@router.get('/profiles/{name}')
+def get_profile(name: str):
+    """
+    A saved profile, in the folded stack format (`flamegraph.pl`, `inferno-flamegraph`,
+    speedscope).
+    """
+    path = profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type='text/plain', filename=name)
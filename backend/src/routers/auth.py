@@ -1,30 +1,91 @@
+import hmac
 from http import HTTPStatus
 from typing import Annotated
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from src.database import get_db
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import get_async_db
 from src.models import Patient
-from src.schemas.auth import Token
-from src.security import create_access_token, verify_password
+from src.passwords import check_password
+from src.revocation import revocation_list
+from src.schemas.auth import LogoutRequest, RefreshRequest, Token
+from src.security import (REFRESH, credentials_claim, credentials_exception,
+                          decode_token, decode_valid_token, issue_tokens,
+                          oauth2_scheme)
+from src.sharding import patient_email_filter
 
 router = APIRouter(prefix='/auth', tags=['auth'])
 
 OAuth2Form = Annotated[OAuth2PasswordRequestForm, Depends()]
-DbSession = Annotated[Session, Depends(get_db)]
+DbSession = Annotated[AsyncSession, Depends(get_async_db)]
+BearerToken = Annotated[str, Depends(oauth2_scheme)]
 
 @router.post('/token', response_model=Token)
-def login_for_access_token(form_data: OAuth2Form, session: DbSession):
-    patient = session.scalar(select(Patient).where(Patient.email == form_data.username))
+async def login_for_access_token(form_data: OAuth2Form, session: DbSession):
+    patient = await session.scalar(
+        select(Patient).where(*await patient_email_filter(session, form_data.username))
+    )
 
-    if not patient or not verify_password(form_data.password, patient.password):
+    # argon2 is CPU bound, it runs in the hashing process pool
+    valid, new_hash = await check_password(form_data.password, patient.password) if patient else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED,
             detail='Incorrect email or password',
         )
 
-    access_token = create_access_token(data={'sub': patient.email})
+    if new_hash:
+        # hashed with outdated cost parameters, upgrade it now that the password is known
+        await session.execute(
+            update(Patient).where(Patient.id == patient.id).values(password=new_hash)
+        )
+        await session.commit()
+
+        await session.refresh(patient)
+
+    return issue_tokens(patient)
+
+
+@router.post('/refresh', response_model=Token)
+async def refresh_access_token(body: RefreshRequest, session: DbSession):
+    """
+    Trades a refresh token for a new token pair. The patient is reloaded, so
+    the new access token carries its current id, email and record version,
+    and a token issued before a password change is refused.
+    The refresh token is single use: it is revoked by the exchange, and of
+    concurrent exchanges only the one whose revocation lands gets tokens.
+    """
+    claims = await decode_valid_token(body.refresh_token, session, token_type=REFRESH)
+    patient = await session.get(Patient, claims.get('pid')) if isinstance(claims.get('pid'), int) else None
+    # an email or password change retires the tokens issued before it
+    if (
+        patient is None
+        or patient.email.lower() != claims['sub'].lower()
+        or not hmac.compare_digest(claims.get('cred', ''), credentials_claim(patient))
+    ):
+        raise credentials_exception()
+
+    if not claims.get('jti') or not await revocation_list.revoke(session, claims['jti'], claims['exp']):
+        raise credentials_exception()
+    await session.commit()
+    return issue_tokens(patient)
+
+
+@router.post('/logout', status_code=HTTPStatus.NO_CONTENT)
+async def logout(token: BearerToken, session: DbSession, body: LogoutRequest = None):
+    """
+    Revokes the access token, and the refresh token when given, in every
+    worker. Further requests with them get a 401.
+    """
+    revoked = [await decode_valid_token(token, session)]
+    if body is not None and body.refresh_token:
+        revoked.append(decode_token(body.refresh_token, token_type=REFRESH))
+        if revoked[-1]['sub'].lower() != revoked[0]['sub'].lower():
+            raise credentials_exception()
 
-    return {'access_token': access_token, 'token_type': 'bearer'}
+    for claims in revoked:
+        if claims.get('jti'):
+            await revocation_list.revoke(session, claims['jti'], claims['exp'])
+    await session.commit()
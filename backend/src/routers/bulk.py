@@ -0,0 +1,74 @@
+from typing import Annotated, Literal, Optional
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, sessionmaker
+from src import bulk_export, bulk_import
+from src.database import get_db, get_session_factory, get_shard_map
+from src.schemas.patient import ImportReport
+from src.security import require_admin_token
+from src.sharding import ShardMap
+
+router = APIRouter(tags=['bulk'], dependencies=[Depends(require_admin_token)])
+
+DbSession = Annotated[Session, Depends(get_db)] # COPY needs the psycopg2 (sync) connection
+SessionFactory = Annotated[sessionmaker, Depends(get_session_factory)]
+PatientShardMap = Annotated[Optional[ShardMap], Depends(get_shard_map)] # None unless patients are sharded
+
+async def _numbered_lines(request: Request):
+    """Yields (line number, text) from the streamed body, one line at a time."""
+    line_no = 0
+    pending = b''
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            line_no += 1
+            yield line_no, line.decode('utf-8', errors='replace')
+    if pending:
+        yield line_no + 1, pending.decode('utf-8', errors='replace')
+
+@router.post("/patients/import", response_model=ImportReport, status_code=200)
+async def import_patients(request: Request, db: DbSession, shard_map: PatientShardMap):
+    """
+    Create patients from an NDJSON body (`application/x-ndjson`), one
+    PatientCreate object per line. Requires the `X-Admin-Token` header.
+
+    The body is read as a stream and imported in chunks of IMPORT_CHUNK_SIZE
+    lines, each chunk committed on its own. Invalid lines and emails that
+    already exist are reported by line number and do not stop the import.
+    """
+    with bulk_import.PatientImporter(db, bulk_import.IMPORT_HASH_WORKERS, shard_map) as importer:
+        chunk = []
+        async for numbered_line in _numbered_lines(request):
+            chunk.append(numbered_line)
+            if len(chunk) >= bulk_import.IMPORT_CHUNK_SIZE:
+                await run_in_threadpool(importer.import_chunk, chunk)
+                chunk = []
+        if chunk:
+            await run_in_threadpool(importer.import_chunk, chunk)
+
+    return importer.report()
+
+def _export_stream(session_factory: sessionmaker, format: str, flatten: bool, shard_map: Optional[ShardMap]):
+    # the sessions are owned by the stream: dependencies are closed before the body is sent
+    with bulk_export.patient_sessions(session_factory, shard_map) as sessions:
+        yield from bulk_export.export_patients(sessions, format, flatten, bulk_export.EXPORT_BATCH_SIZE)
+
+@router.get("/patients/export", response_class=StreamingResponse, status_code=200)
+def export_patients(session_factory: SessionFactory, shard_map: PatientShardMap,
+                    format: Literal['ndjson', 'csv', 'parquet'] = 'ndjson', flatten: bool = False):
+    """
+    Stream every patient (without password hashes) as NDJSON, CSV or Parquet.
+    Requires the `X-Admin-Token` header.
+
+    Rows are read with a server-side cursor and sent batch by batch, so the
+    export runs in constant memory. `flatten` splits `medical_record` into
+    one column per section.
+    """
+    return StreamingResponse(
+        _export_stream(session_factory, format, flatten, shard_map),
+        media_type=bulk_export.EXPORT_FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename="patients.{format}"'},
+    )
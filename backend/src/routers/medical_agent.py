@@ -1,183 +1,160 @@
-import operator
 import os
-import uuid
 from http import HTTPStatus
-from typing import Annotated, Dict, List, TypedDict
-
-from fastapi import APIRouter, Depends, HTTPException
-from langchain_core.messages import (AIMessage, AnyMessage, BaseMessage,
-                                     HumanMessage)
-from langchain_core.pydantic_v1 import BaseModel as PydanticV1BaseModel
-from langchain_core.pydantic_v1 import Field as PydanticV1Field
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_tavily import TavilySearch
-from langgraph.checkpoint.postgres import PostgresSaver
-from langgraph.graph import END, StateGraph
-from langgraph.prebuilt import ToolNode
-from pydantic import BaseModel
-from src.models import Patient
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import func, text, update
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.orm import Session
+from src.database import get_db
+from src.etags import matches_if_none_match, not_modified, set_validators
+from src.idempotency import (begin_request, complete_request, release_request,
+                             request_fingerprint)
+from src.models import ConversationThread
+from src.routers.threads import get_patient_thread
 from src.schemas.medical_agent import (ChatHistoryResponse, ChatMessage,
                                        ChatRequest)
-from src.security import get_current_user
+from src.security import Principal, get_token_principal
+from src.usage import quota_exceeded
 
-CurrentPatient = Annotated[Patient, Depends(get_current_user)]
+CurrentPrincipal = Annotated[Principal, Depends(get_token_principal)]
+DbSession = Annotated[Session, Depends(get_db)]
+IdempotencyKeyHeader = Annotated[
+    Optional[str], Header(alias="Idempotency-Key", min_length=1, max_length=255)
+]
 
 router = APIRouter()
 
-search_tool = TavilySearch(max_results=5)
-tools = [search_tool]
+# Número máximo de mensagens (usuário + assistente) por consulta, mantém o checkpoint pequeno
+MAX_THREAD_MESSAGES = int(os.environ.get('MAX_THREAD_MESSAGES', '200'))
 
-llm = ChatGoogleGenerativeAI(model="gemini-2.5-pro", temperature=0)
-llm_with_tools = llm.bind_tools(tools)
-tool_node = ToolNode(tools)
+def run_agent_turn(db: Session, thread: ConversationThread, request: ChatRequest, patient_id: int) -> ChatMessage:
+    """
+    Executa um turno do agente na thread e retorna a resposta final.
+    """
+    if thread.message_count >= MAX_THREAD_MESSAGES:
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT,
+            detail="Thread message limit reached, open a new consultation",
+        )
 
-class AgentState(TypedDict):
-    messages: Annotated[list[AnyMessage], operator.add]
-    patient_record: dict
-    question_count: int
+    if quota_exceeded(db, patient_id):
+        raise HTTPException(
+            status_code=HTTPStatus.TOO_MANY_REQUESTS,
+            detail="Daily token quota exceeded",
+        )
 
+    db_url = os.getenv("DATABASE_URL")
+    if not db_url:
+        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
 
-AGENT_PROMPT = """
-Você é um assistente médico virtual altamente inteligente e cauteloso. Sua função é ajudar pacientes a entenderem seus sintomas através de uma conversa contínua.
+    # carregado no primeiro turno (ou no lifespan), não na importação
+    from src import agent
 
-**NUNCA** forneça um diagnóstico definitivo. Sua tarefa é fazer perguntas para esclarecer os sintomas, sugerir possibilidades e, eventualmente, direcionar o paciente para o especialista correto.
+    content = agent.run_turn(thread.id, patient_id, request.message, request.patient_record)
 
-**REGRAS CRÍTICAS:**
-1.  **Conversa Contínua:** Mantenha um diálogo com o paciente. Faça uma pergunta por vez para coletar informações.
-2.  **Contexto:** Foque nas últimas 20 mensagens para manter o contexto da conversa atual.
-3.  **Lógica de Palpite:** A cada 3 perguntas que você fizer:
-    - busque na internet com a ferramenta search_tool para possuir mais embasamento
-    - Após isso, analise bem as últimas conversas realizadas, a busca na internet e no final você deve fornecer um "palpite" ou uma "hipótese preliminar" com base nas informações coletadas até o momento. Deixe claro que é apenas uma possibilidade. Após dar o palpite, você PODE e DEVE continuar fazendo mais perguntas se necessário.
-4.  **Evite Redundância:** Antes de fazer uma nova pergunta, revise o histórico da conversa. **NÃO FAÇA** perguntas cujas respostas já foram fornecidas.
-5.  **Use a Busca:** Se os sintomas ou a combinação com o histórico do paciente não forem claros, use a ferramenta de busca (`search_tool`) para pesquisar informações médicas relevantes.
+    db.execute(
+        update(ConversationThread)
+        .where(ConversationThread.id == thread.id)
+        .values(
+            message_count=ConversationThread.message_count + 2,
+            last_message_date=func.now(),
+        )
+    )
+    db.commit()
 
-**FICHA MÉDICA DO PACIENTE:**
-{patient_record}
-"""
+    return ChatMessage(role="assistant", content=content)
 
-def agent_analyst_node(state: AgentState):
-    """
-    Analisa o estado atual, decide se dá um palpite, faz uma pergunta ou usa uma ferramenta.
-    """
-    question_count = state.get('question_count', 0)
-    context_messages = state['messages'][-20:]
-
-    system_prompt = AGENT_PROMPT.format(patient_record=str(state.get('patient_record', {})))
-    
-    # Adiciona uma instrução especial se for hora de dar um palpite.
-    if question_count > 0 and question_count % 3 == 0:
-        hunch_instruction = (
-            "INSTRUÇÃO ESPECIAL: Você já fez 3 perguntas. Com base no histórico da conversa, "
-            "forneça um palpite preliminar sobre as possíveis causas dos sintomas. "
-            "Use frases como 'Uma possibilidade poderia ser...', 'Com base no que você disse, talvez devêssemos considerar...'. "
-            "Você pode fazer outra pergunta na mesma resposta se achar necessário para continuar a investigação."
-            "No final de seu palpite, diga quais os profissionais da saúde são mais adequados a serem buscados, como por exemplo um médico cardiologista."
-        )
-        messages_with_prompt = [HumanMessage(content=system_prompt), HumanMessage(content=hunch_instruction)] + context_messages
-    else:
-        messages_with_prompt = [HumanMessage(content=system_prompt)] + context_messages
-    
-    ai_response = llm_with_tools.invoke(messages_with_prompt)
-    
-    new_question_count = question_count
-    if not ai_response.tool_calls:
-        new_question_count += 1
-        
-    return {"messages": [ai_response], "question_count": new_question_count}
-
-def should_continue_edge(state: AgentState) -> str:
+@router.post("/chat/", response_model=ChatMessage)
+def chat_endpoint(
+    request: ChatRequest,
+    current_patient: CurrentPrincipal,
+    db: DbSession,
+    idempotency_key: IdempotencyKeyHeader = None,
+):
     """
-    Decide o próximo passo: usar uma ferramenta ou terminar o turno.
+    Recebe uma mensagem do usuário e retorna a resposta do agente.
+
+    Com o header `Idempotency-Key`, novas tentativas da mesma requisição recebem
+    a resposta já gerada (ou aguardam a que está em andamento) em vez de
+    executar o agente novamente.
     """
-    last_message = state['messages'][-1]
-    # Se a última mensagem contém uma chamada de ferramenta, vá para o nó de ação.
-    if last_message.tool_calls:
-        return "continue_to_tool"
+    thread = get_patient_thread(db, request.thread_id, current_patient.id)
 
-    # Caso contrário, é uma resposta direta ao usuário, então o turno termina.
-    return "end_turn"
+    if idempotency_key is None:
+        return run_agent_turn(db, thread, request, current_patient.id)
 
-@router.post("/chat/", response_model=ChatMessage)
-def chat_endpoint(request: ChatRequest, current_patient: CurrentPatient):
+    fingerprint = request_fingerprint(thread.id, request.message)
+    stored_response = begin_request(db, thread.id, idempotency_key, fingerprint)
+    if stored_response is not None:
+        return ChatMessage(**stored_response)
+
+    try:
+        response = run_agent_turn(db, thread, request, current_patient.id)
+    except Exception:
+        release_request(db, thread.id, idempotency_key)
+        raise
+
+    complete_request(db, thread.id, idempotency_key, response.model_dump())
+    return response
+
+def history_message(role: str, content) -> dict:
     """
-    Recebe uma mensagem do usuário e retorna a resposta do agente.
+    Mensagem do histórico como dict. Conteúdo texto dispensa o pydantic; os
+    demais formatos passam pela validação de ChatMessage.
     """
-    if current_patient.id != int(request.thread_id):
-        raise HTTPException(
-            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
-        )
+    if isinstance(content, str):
+        return {"role": role, "content": content}
+    return ChatMessage(role=role, content=content).model_dump()
 
-    config = {"configurable": {"thread_id": request.thread_id}}
-    
-    graph_input = {
-        "messages": [HumanMessage(content=request.message)],
-        "patient_record": request.patient_record,
-    }
-    
-    db_url = os.getenv("DATABASE_URL")
-    if not db_url:
-        raise HTTPException(status_code=500, detail="DATABASE_URL is not set")
-        
-    with PostgresSaver.from_conn_string(db_url) as checkpointer:
-        graph_builder = StateGraph(AgentState)
-        graph_builder.add_node("agent_analyst", agent_analyst_node)
-        graph_builder.add_node("action_tool", tool_node)
-        
-        graph_builder.set_entry_point("agent_analyst")
-        
-        graph_builder.add_conditional_edges(
-            "agent_analyst", 
-            should_continue_edge, 
-            {
-                "continue_to_tool": "action_tool", 
-                "end_turn": END
-            }
-        )
-        graph_builder.add_edge("action_tool", "agent_analyst")
-        graph = graph_builder.compile(checkpointer=checkpointer)
-        final_state = graph.invoke(graph_input, config)
-        last_message = final_state["messages"][-1]
-        
-        content = ""
-        if isinstance(last_message, AIMessage):
-            content = last_message.content
-
-        return ChatMessage(role="assistant", content=content)
-
-@router.get("/chat/{patient_id}", response_model=ChatHistoryResponse)
-def get_history_endpoint(patient_id: int, current_patient: CurrentPatient):
+def last_checkpoint_id(db: Session, thread_id: str) -> Optional[str]:
     """
-    Retorna o histórico de mensagens para uma determinada thread (paciente).
+    Id do checkpoint mais recente da thread (os ids crescem com o tempo), sem
+    carregar o estado. None se ainda não houver checkpoint.
+    """
+    try:
+        with db.begin_nested():
+            return db.scalar(
+                text("SELECT max(checkpoint_id) FROM checkpoints WHERE thread_id = :thread_id AND checkpoint_ns = ''"),
+                {"thread_id": thread_id},
+            )
+    except ProgrammingError:
+        # tabelas do checkpointer ainda não criadas (nenhuma consulta executada)
+        return None
+
+@router.get("/chat/{thread_id}", response_model=ChatHistoryResponse, response_class=ORJSONResponse)
+def get_history_endpoint(
+    thread_id: str,
+    current_patient: CurrentPrincipal,
+    db: DbSession,
+    if_none_match: Annotated[Optional[str], Header()] = None,
+):
     """
+    Retorna o histórico de mensagens para uma determinada thread (consulta).
 
-    if current_patient.id != patient_id:
-        raise HTTPException(
-            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
-        )
+    O ETag é o id do último checkpoint: com `If-None-Match` igual, responde
+    304 sem carregar nem serializar o histórico.
+    """
+    thread = get_patient_thread(db, thread_id, current_patient.id)
 
-    config = {"configurable": {"thread_id": str(patient_id)}}
-    
     db_url = os.getenv("DATABASE_URL")
     if not db_url:
         return ChatHistoryResponse(messages=[])
+
+    checkpoint_id = last_checkpoint_id(db, thread.id)
+    etag = f'W/"{checkpoint_id}"' if checkpoint_id else None
+    if etag and matches_if_none_match(if_none_match, etag):
+        return not_modified(etag)
     try:
-        with PostgresSaver.from_conn_string(db_url) as checkpointer:
-            thread_state = checkpointer.get(config)
-            messages = []
-            if thread_state and 'channel_values' in thread_state and 'messages' in thread_state['channel_values']:
-                raw_messages = thread_state['channel_values']['messages']
-                for msg in raw_messages:
-                    if isinstance(msg, dict):
-                       msg_obj = BaseMessage(**msg)
-                    else:
-                       msg_obj = msg
-                       
-                    if isinstance(msg_obj, HumanMessage):
-                        messages.append(ChatMessage(role="user", content=msg_obj.content))
-                    elif isinstance(msg_obj, AIMessage) and msg_obj.content:
-                        messages.append(ChatMessage(role="assistant", content=msg_obj.content))
-            
-            return ChatHistoryResponse(messages=messages)
+        from src import agent
+
+        messages = [history_message(role, content) for role, content in agent.load_history(thread.id)]
+        # já no formato de ChatHistoryResponse, sem revalidar centenas de mensagens
+        response = ORJSONResponse({"messages": messages})
+        if etag:
+            set_validators(response, etag)
+        return response
     except Exception as e:
-        print(f"Error fetching history for thread {patient_id}: {e}")
+        print(f"Error fetching history for thread {thread_id}: {e}")
         return ChatHistoryResponse(messages=[])
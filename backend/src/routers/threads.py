@@ -0,0 +1,59 @@
+from http import HTTPStatus
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from src.database import get_db
+from src.models import ConversationThread
+from src.schemas.thread import Thread as ThreadSchema
+from src.schemas.thread import ThreadCreate, ThreadList
+from src.security import Principal, get_token_principal
+
+router = APIRouter(prefix='/threads', tags=['threads'])
+
+DbSession = Annotated[Session, Depends(get_db)]
+CurrentPrincipal = Annotated[Principal, Depends(get_token_principal)]
+
+
+def get_patient_thread(db: Session, thread_id: str, patient_id: int) -> ConversationThread:
+    """
+    Load a conversation thread, making sure it belongs to the given patient.
+    """
+    thread = db.get(ConversationThread, str(thread_id))
+    if not thread:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Thread not found")
+
+    if thread.patient_id != patient_id:
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
+        )
+    return thread
+
+
+@router.post('/', response_model=ThreadSchema, status_code=201)
+def create_thread(thread_data: ThreadCreate, db: DbSession, current_patient: CurrentPrincipal):
+    """
+    Open a new consultation thread for the authenticated patient.
+    """
+    thread = ConversationThread(patient_id=current_patient.id, title=thread_data.title)
+    db.add(thread)
+    db.commit()
+    db.refresh(thread)
+    return thread
+
+
+@router.get('/', response_model=ThreadList)
+def list_threads(db: DbSession, current_patient: CurrentPrincipal):
+    """
+    List the consultation threads of the authenticated patient, most recent first.
+    """
+    threads = db.scalars(
+        select(ConversationThread)
+        .where(ConversationThread.patient_id == current_patient.id)
+        .order_by(
+            ConversationThread.last_message_date.desc().nulls_last(),
+            ConversationThread.creation_date.desc(),
+        )
+    ).all()
+    return {'threads': threads}
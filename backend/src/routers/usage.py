@@ -0,0 +1,43 @@
+from datetime import date, timedelta
+from http import HTTPStatus
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from src import usage
+from src.database import get_db
+from src.schemas.usage import UsageResponse
+from src.security import Principal, get_token_principal
+
+router = APIRouter(prefix='/usage', tags=['usage'])
+
+DbSession = Annotated[Session, Depends(get_db)]
+CurrentPrincipal = Annotated[Principal, Depends(get_token_principal)]
+
+@router.get('/{patient_id}', response_model=UsageResponse)
+def get_patient_usage(
+    patient_id: int,
+    db: DbSession,
+    current_patient: CurrentPrincipal,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+):
+    """
+    Return the daily token usage of a patient, by default for the last 30 days.
+    """
+    if current_patient.id != patient_id:
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
+        )
+
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+
+    # make sure recently recorded usage is visible to the caller
+    usage.usage_writer.flush()
+
+    return UsageResponse(
+        patient_id=patient_id,
+        daily_quota=usage.DAILY_TOKEN_QUOTA,
+        days=usage.get_usage_history(db, patient_id, start, end),
+    )
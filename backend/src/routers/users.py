@@ -1,100 +1,302 @@
+import os
 from http import HTTPStatus
-from typing import Annotated, List
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
-from sqlalchemy.orm import Session
-from src.database import get_db
-from src.models import Patient
+from fastapi import (APIRouter, Depends, Header, HTTPException, Query, Request,
+                     Response)
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import (get_async_db, get_async_read_db, is_replica,
+                          remember_write)
+from src.etags import (digest_etag, matches_if_none_match, not_modified,
+                       parse_if_match, patient_etag, set_validators,
+                       version_etag)
+from src.medical_record_patch import compile_record_patch
+from src.medical_record_query import compile_record_filters
+from src.models import ConversationThread, Patient, TokenUsage
+from src.pagination import decode_cursor, set_next_cursor
+from src.passwords import hash_password
+from src.principal_cache import principal_cache
 from src.schemas.patient import Patient as PatientSchema
 from src.schemas.patient import PatientCreate as PatientCreateSchema
-from src.security import get_current_user, get_password_hash
+from src.schemas.patient import (PatientListItem, PatientPatch, PatientQuery,
+                                 PatientSnapshot)
+from src.security import Principal, get_current_principal, get_current_user
+from src.sharding import (claim_email, is_sharded, remove_from_directory,
+                          shard_bind, update_directory_email)
 
 router = APIRouter()
 
-DbSession = Annotated[Session, Depends(get_db)] # inherits database session
-CurrentPatient = Annotated[Patient, Depends(get_current_user)] # Verify if the user is logged in
+PATIENTS_MAX_PAGE_SIZE = int(os.environ.get('PATIENTS_MAX_PAGE_SIZE', '100'))
 
-@router.post("/patients/", response_model=PatientSchema, status_code=201)
-def create_patient(patient_data: PatientCreateSchema, db: DbSession):
+DbSession = Annotated[AsyncSession, Depends(get_async_db)] # inherits database session
+ReadDbSession = Annotated[AsyncSession, Depends(get_async_read_db)] # read replica when configured, read-only routes
+CurrentPatient = Annotated[PatientSnapshot, Depends(get_current_user)] # Verify if the user is logged in, loads the full record (read-only)
+CurrentPrincipal = Annotated[Principal, Depends(get_current_principal)] # Verify if the user is logged in, id and email only
+IfNoneMatch = Annotated[Optional[str], Header()]
+
+def select_patients(fields: Optional[str]):
     """
-    Create a new patient record, including their associated medical history.
+    select(Patient), or only the columns of a comma separated `fields`
+    projection (the id is always included, it drives the pagination).
     """
+    if not fields:
+        return select(Patient)
 
-    email_already_exists = db.scalar(
-        select(Patient)
-            .where(Patient.email == patient_data.email)
-    )
-
-    if email_already_exists :
+    names = ['id'] + [name for name in dict.fromkeys(fields.split(',')) if name and name != 'id']
+    unknown = [name for name in names if name not in PatientListItem.model_fields]
+    if unknown:
         raise HTTPException(
-            status_code=HTTPStatus.BAD_REQUEST,
-            detail="A patient with this email already exists."
+            status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+            detail=f"Unknown fields: {', '.join(unknown)}"
         )
+    return select(*(getattr(Patient, name) for name in names))
 
-    # Create the main Patient object
-    new_patient = Patient(
-        full_name=patient_data.full_name,
-        password=get_password_hash(patient_data.password), # encrypt password
-        email=patient_data.email,
-        birthdate=patient_data.birthdate,
-        biological_sex=patient_data.biological_sex,
-        weight=patient_data.weight,
-        ancestry=patient_data.ancestry,
-        medical_record=patient_data.medical_record.model_dump(mode='json')
-    )
+def patient_id(patient) -> int:
+    return patient['id'] if isinstance(patient, dict) else patient.id
+
+LIST_ITEM_FIELDS = tuple(PatientListItem.model_fields)
+
+def list_item(patient) -> dict:
+    """
+    A listed patient as PatientListItem would dump it, without running
+    pydantic over it: every column was validated on its way in (create,
+    update, patch, import), it only needs the password left out.
+    """
+    item = dict(patient) if isinstance(patient, dict) else {
+        name: getattr(patient, name) for name in LIST_ITEM_FIELDS
+    }
+    if 'birthdate' in item:
+        item['birthdate'] = item['birthdate'].date() # a date in the API schema
+    return item
+
+def _page_etag(fields, versions) -> str:
+    return digest_etag([fields] + [f'{patient_id}:{version}' for patient_id, version in versions])
+
+async def fetch_patients_page(db, stmt, fields, cursor, limit, request, conditional=False, if_none_match=None):
+    """
+    Runs `stmt` as one keyset page on `id`, setting the next cursor headers.
+
+    A `conditional` page gets an ETag digesting its ids and versions. With
+    `If-None-Match` they are read first, without the medical record, so a
+    match gets a 304 at that point; otherwise they come with the page.
+    """
+    limit = min(limit, PATIENTS_MAX_PAGE_SIZE)
+    stmt = stmt.order_by(Patient.id).limit(limit)
+    if cursor:
+        stmt = stmt.where(Patient.id > decode_cursor(cursor))
+
+    etag = None
+    if conditional and if_none_match is not None:
+        versions = (await db.execute(stmt.with_only_columns(Patient.id, Patient.version))).all()
+        # every shard returns its own first page
+        etag = _page_etag(fields, sorted(versions)[:limit])
+        if matches_if_none_match(if_none_match, etag):
+            return not_modified(etag)
+
+    # the digest needs the versions of a projection that left them out
+    extra_version = conditional and etag is None and fields and 'version' not in fields.split(',')
+    if extra_version:
+        stmt = stmt.add_columns(Patient.version)
+
+    if fields:
+        patients = [dict(row._mapping) for row in await db.execute(stmt)]
+    else:
+        patients = (await db.scalars(stmt)).all()
+    if is_sharded(db):
+        # every shard returns its own first page
+        patients = sorted(patients, key=patient_id)[:limit]
+    last_id = patient_id(patients[-1]) if patients else None
+
+    if conditional and etag is None:
+        etag = _page_etag(fields, [
+            (patient['id'], patient.pop('version') if extra_version else patient['version'])
+            if isinstance(patient, dict) else (patient.id, patient.version)
+            for patient in patients
+        ])
+
+    # orjson straight from the rows, response_model only documents the route
+    listing = ORJSONResponse([list_item(patient) for patient in patients])
+    if etag:
+        set_validators(listing, etag)
+    if len(patients) == limit:
+        set_next_cursor(request, listing, last_id)
+    return listing
+
+@router.post("/patients/", response_model=PatientSchema, status_code=201)
+async def create_patient(patient_data: PatientCreateSchema, db: DbSession):
+    """
+    Create a new patient record, including their associated medical history.
+
+    Email uniqueness is enforced by the unique index on lower(email): the
+    insert is skipped on conflict, without a separate lookup beforehand.
+    With sharded patients the directory enforces it across shards.
+    """
+    values = {}
+    if is_sharded(db):
+        # the directory keeps emails unique across shards and hands out the id
+        values['id'] = await claim_email(db, patient_data.email)
+        if values['id'] is None:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail="A patient with this email already exists."
+            )
 
     try:
-        db.add(new_patient)
-        db.commit()
-        db.refresh(new_patient)
+        new_patient = await db.scalar(
+            insert(Patient)
+            .values(
+                **values,
+                full_name=patient_data.full_name,
+                password=await hash_password(patient_data.password), # encrypt password
+                email=patient_data.email,
+                birthdate=patient_data.birthdate,
+                biological_sex=patient_data.biological_sex,
+                weight=patient_data.weight,
+                ancestry=patient_data.ancestry,
+                medical_record=patient_data.medical_record.model_dump(mode='json')
+            )
+            .on_conflict_do_nothing(index_elements=[func.lower(Patient.email)])
+            .returning(Patient),
+            bind_arguments=shard_bind(db, values.get('id')),
+        )
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while creating the patient: {e}"
         )
 
+    if new_patient is None:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="A patient with this email already exists."
+        )
+
     return new_patient
 
 @router.get("/patients/me", response_model=PatientSchema, status_code=200)
-def get_users_me(current_patient: CurrentPatient):
+async def get_users_me(current_patient: CurrentPatient, response: Response, if_none_match: IfNoneMatch = None):
     """
     Route to validate User token and respond Patient data.
 
     Fetch the patient data for the currently authenticated user.
     The `CurrentPatient` dependency handles all the token validation.
+    Answers 304 when `If-None-Match` holds the current ETag.
     """
+    etag = patient_etag(current_patient.id, current_patient.version)
+    if matches_if_none_match(if_none_match, etag):
+        return not_modified(etag, Vary='Authorization')
+
+    set_validators(response, etag)
+    response.headers['Vary'] = 'Authorization'
     return current_patient
 
-@router.get("/patients/", response_model=List[PatientSchema], status_code=200)
-def get_all_patients(db: DbSession, skip: int = 0, limit: int = 100):
+@router.get(
+    "/patients/",
+    response_model=List[PatientListItem],
+    response_class=ORJSONResponse,
+    response_model_exclude_unset=True,
+    status_code=200,
+)
+async def get_all_patients(
+    db: ReadDbSession,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    fields: Optional[str] = None,
+    skip: int = Query(0, ge=0, deprecated=True),
+    if_none_match: IfNoneMatch = None,
+):
     """
-    Retrieve a list of all patients with pagination.
+    Retrieve a list of all patients with keyset pagination on `id`.
+
+    Pass the `X-Next-Cursor` response header back as `cursor` to fetch the
+    next page, it is absent on the last page. `fields` is a comma separated
+    projection (e.g. `fields=id,full_name,email`); leaving `medical_record`
+    out skips loading the JSONB column entirely. `skip` is kept for older
+    clients and is slow on deep pages. Pages carry an ETag, `If-None-Match`
+    answers 304 while the page is unchanged.
+    """
+    stmt = select_patients(fields)
+    if not cursor and skip:
+        stmt = stmt.offset(skip)
+
+    return await fetch_patients_page(
+        db, stmt, fields, cursor, limit, request, conditional=True, if_none_match=if_none_match
+    )
+
+@router.post(
+    "/patients/query",
+    response_model=List[PatientListItem],
+    response_class=ORJSONResponse,
+    response_model_exclude_unset=True,
+    status_code=200,
+)
+async def query_patients(
+    query: PatientQuery,
+    db: ReadDbSession,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    fields: Optional[str] = None,
+):
     """
-    patients = db.scalars(
-        select(Patient).offset(skip).limit(limit)
-    ).all()
-    return patients
+    Find patients whose medical record matches every filter, e.g. patients on
+    a given medication with a given allergy.
+
+    Filters compile to JSONB containment (`@>`) and jsonpath (`@?`) operators.
+    Only `eq` filters use the GIN index on `medical_record`, the other
+    operators are checked row by row: combine them with an `eq` filter on
+    large tables. Pagination and `fields` work as in the patient listing.
+    """
+    stmt = select_patients(fields).where(*compile_record_filters(query.filters))
+    return await fetch_patients_page(db, stmt, fields, cursor, limit, request)
 
 @router.get("/patients/{patient_id}", response_model=Patient, status_code=200)
-def get_patient(patient_id: int, db: DbSession):
+async def get_patient(
+    patient_id: int,
+    db: ReadDbSession,
+    primary: DbSession,
+    response: Response,
+    if_none_match: IfNoneMatch = None,
+):
     """
     Retrieve a single patient by their ID.
+
+    The ETag is the row version (as for PUT and PATCH); `If-None-Match` with
+    the current one answers 304 after reading only that column.
     """
-    patient = db.get(Patient, patient_id)
+    if if_none_match is not None:
+        version_stmt = select(Patient.version).where(Patient.id == patient_id)
+        version = await db.scalar(version_stmt)
+        if version is None and is_replica(db):
+            version = await primary.scalar(version_stmt)
+        if version is not None and matches_if_none_match(if_none_match, version_etag(version)):
+            return not_modified(version_etag(version))
+
+    patient = await db.get(Patient, patient_id)
+    if not patient and is_replica(db):
+        # may have been created after the replica's last replayed transaction
+        patient = await primary.get(Patient, patient_id)
     if not patient:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Patient not found")
-        
+
+    set_validators(response, version_etag(patient.version))
     return patient
 
 
 @router.put("/patients/{patient_id}", response_model=PatientSchema, status_code=200)
-def update_patient(
+async def update_patient(
         patient_id: int, 
         patient_data: PatientCreateSchema, 
         db: DbSession,
-        current_patient: CurrentPatient
+        current_patient: CurrentPrincipal,
+        response: Response,
 ):
     """
     Update an existing patient's record by their ID.
@@ -106,46 +308,126 @@ def update_patient(
             status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
         )
 
-    patient = db.scalar(
-        select(Patient).where(Patient.id == patient_id)
-    )
+    # Update all fields from the input data in a single UPDATE ... RETURNING,
+    # an email taken by another patient violates the lower(email) unique index
+    try:
+        patient = await db.scalar(
+            update(Patient)
+            .where(Patient.id == patient_id)
+            .values(
+                full_name=patient_data.full_name,
+                password=await hash_password(patient_data.password),
+                email=patient_data.email,
+                birthdate=patient_data.birthdate,
+                biological_sex=patient_data.biological_sex,
+                weight=patient_data.weight,
+                ancestry=patient_data.ancestry,
+                medical_record=patient_data.medical_record.model_dump(mode='json'),
+                version=Patient.version + 1,
+            )
+            .returning(Patient)
+            .execution_options(populate_existing=True)
+        )
+        if patient:
+            await update_directory_email(db, patient_id, patient_data.email)
+            await principal_cache.publish_invalidation(db, current_patient.email)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="A patient with this email already exists."
+        )
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"An error occurred while updating the patient: {e}"
+        )
 
     if not patient:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Patient not found")
 
-    if patient_data.email != patient.email:
-        email_already_exists = db.scalar(
-            select(Patient).where(Patient.email == patient_data.email)
+    await remember_write(db, response)
+    response.headers['ETag'] = version_etag(patient.version)
+    return patient
+
+@router.patch("/patients/{patient_id}", response_model=PatientSchema, status_code=200)
+async def patch_patient(
+        patient_id: int,
+        patch: PatientPatch,
+        db: DbSession,
+        current_patient: CurrentPrincipal,
+        response: Response,
+        if_match: Optional[str] = Header(None),
+):
+    """
+    Partially update a patient: only the fields sent are written.
+
+    `medical_record_ops` edit the medical record in place (e.g. append one
+    medication) with jsonb_set/jsonb_insert, without sending the whole
+    record. Send the `ETag` of the last read as `If-Match` to fail with 412
+    instead of overwriting a concurrent update.
+    """
+    if current_patient.id != patient_id:
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
         )
-        if email_already_exists:
-            raise HTTPException(
-                status_code=400,
-                detail="A patient with this email already exists."
-            )
 
-    # Update all fields from the input data
-    patient.full_name = patient_data.full_name
-    patient.password = patient_data.password
-    patient.email = patient_data.email
-    patient.birthdate = patient_data.birthdate
-    patient.biological_sex = patient_data.biological_sex
-    patient.weight = patient_data.weight
-    patient.ancestry = patient_data.ancestry
-    patient.medical_record = patient_data.medical_record.model_dump(mode='json')
+    expected_version = parse_if_match(if_match)
+    values = patch.model_dump(exclude_unset=True, exclude={'password', 'medical_record', 'medical_record_ops'})
+    conditions = [Patient.id == patient_id]
+    if patch.password is not None:
+        values['password'] = await hash_password(patch.password)
+    if patch.medical_record is not None:
+        values['medical_record'] = patch.medical_record.model_dump(mode='json')
+    if patch.medical_record_ops:
+        values['medical_record'], record_conditions = compile_record_patch(patch.medical_record_ops)
+        conditions.extend(record_conditions)
+    if expected_version is not None:
+        conditions.append(Patient.version == expected_version)
 
     try:
-        db.commit()
-        db.refresh(patient)
-    except Exception as e:
-        db.rollback()
+        patient = await db.scalar(
+            update(Patient)
+            .where(*conditions)
+            .values(**values, version=Patient.version + 1)
+            .returning(Patient)
+            .execution_options(populate_existing=True)
+        )
+        if patient and patch.email is not None:
+            await update_directory_email(db, patient_id, patch.email)
+        if patient:
+            await principal_cache.publish_invalidation(db, current_patient.email)
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
         raise HTTPException(
-            status_code=500,
-            detail=f"An error occurred while updating the patient: {e}"
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="A patient with this email already exists."
         )
+
+    if not patient:
+        # tell apart why no row matched
+        version = await db.scalar(select(Patient.version).where(Patient.id == patient_id))
+        if version is None:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Patient not found")
+        if expected_version is not None and version != expected_version:
+            raise HTTPException(
+                status_code=HTTPStatus.PRECONDITION_FAILED,
+                detail="The patient was modified by another request, reload it and retry"
+            )
+        raise HTTPException(
+            status_code=HTTPStatus.CONFLICT,
+            detail="A medical_record_ops path points to an entry that does not exist"
+        )
+
+    await remember_write(db, response)
+    response.headers['ETag'] = version_etag(patient.version)
     return patient
 
 @router.delete("/patients/{patient_id}", response_model=PatientSchema, status_code=200)
-def delete_patient(patient_id: int, db: DbSession, current_patient: CurrentPatient):
+async def delete_patient(patient_id: int, db: DbSession, current_patient: CurrentPrincipal, response: Response):
     """
     Delete a patient record by their ID.
     """
@@ -156,19 +438,26 @@ def delete_patient(patient_id: int, db: DbSession, current_patient: CurrentPatie
             status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
         )
 
-    patient = db.get(Patient, patient_id)
+    patient = await db.get(Patient, patient_id)
     if not patient:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Patient not found")
 
     try:
-        db.delete(patient)
-        db.commit()
+        await db.delete(patient)
+        if is_sharded(db):
+            # init_shards dropped the cascading foreign keys of the main database
+            await db.execute(delete(ConversationThread).where(ConversationThread.patient_id == patient_id))
+            await db.execute(delete(TokenUsage).where(TokenUsage.patient_id == patient_id))
+        await remove_from_directory(db, patient_id)
+        await principal_cache.publish_invalidation(db, current_patient.email)
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"An error occurred while deleting the patient: {e}"
         )
 
+    await remember_write(db, response)
     # Return the deleted object as confirmation
     return patient
@@ -0,0 +1,12 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+
+class ProfilingStatus(BaseModel):
+    sample_rate: float
+    listening: bool
+    profiles: List[str]
@@ -4,9 +4,13 @@ from pydantic import BaseModel
 
 
 class ChatRequest(BaseModel):
-    thread_id: int
+    thread_id: str
     message: str
     patient_record: dict
+    # legacy clients send the numeric patient id as thread id
+    model_config = {
+        "coerce_numbers_to_str": True
+    }
 
 class ChatMessage(BaseModel):
     role: str
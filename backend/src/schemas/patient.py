@@ -1,8 +1,8 @@
 from datetime import date
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Literal, Optional
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, TypeAdapter, model_validator
 
 
 class BiologicalSexEnum(str, Enum):
@@ -66,6 +66,138 @@ class PatientCreate(PatientBase):
 
 class Patient(PatientBase):
     id: int
+    version: int
     model_config = {
         "from_attributes": True
     }
+
+class PatientSnapshot(Patient):
+    """Patient as cached by authentication: validated once, shared read-only by requests."""
+    model_config = {
+        "from_attributes": True,
+        "frozen": True,
+    }
+
+class PatientListItem(BaseModel):
+    """
+    Patient as returned by listings. Fields left out by a `fields=` projection
+    are omitted from the response instead of being returned as null.
+    """
+    id: int
+    full_name: Optional[str] = None
+    email: Optional[EmailStr] = None
+    birthdate: Optional[date] = None
+    biological_sex: Optional[BiologicalSexEnum] = None
+    weight: Optional[float] = None
+    ancestry: Optional[AncestryEnum] = None
+    medical_record: Optional[MedicalRecordSchema] = None
+    version: Optional[int] = None
+    model_config = {
+        "from_attributes": True
+    }
+
+# --- Medical Record Query Schemas ---
+RECORD_SECTIONS = {
+    'conditions': Condition,
+    'allergies': Allergy,
+    'medications': Medication,
+    'injuries': Injury,
+    'family_histories': FamilyHistory,
+}
+
+class RecordFilter(BaseModel):
+    """
+    Matches patients with at least one entry of `section` satisfying the filter.
+
+    - eq: exact value (JSONB containment)
+    - contains: case-insensitive substring
+    - gte / lte: inclusive bounds, ISO dates compare chronologically
+    """
+    section: Literal['conditions', 'allergies', 'medications', 'injuries', 'family_histories']
+    field: str
+    op: Literal['eq', 'contains', 'gte', 'lte'] = 'eq'
+    value: str = Field(..., min_length=1, max_length=200)
+
+    @model_validator(mode='after')
+    def check_field(self):
+        if self.field not in RECORD_SECTIONS[self.section].model_fields:
+            raise ValueError(f"'{self.field}' is not a field of {self.section}")
+        return self
+
+class PatientQuery(BaseModel):
+    filters: List[RecordFilter] = Field(..., min_length=1, max_length=20)
+
+# --- Partial Update Schemas ---
+class RecordOperation(BaseModel):
+    """
+    A JSON-Patch-style operation on the medical record.
+
+    - add `/<section>/-` appends an entry, `/<section>/<index>` inserts before index
+    - replace `/<section>/<index>`, `/<section>/<index>/<field>` or `/free_user_text`
+    - remove `/<section>/<index>`
+    """
+    op: Literal['add', 'replace', 'remove']
+    path: str = Field(..., pattern=r'^/', max_length=100)
+    value: Any = None
+
+    @property
+    def segments(self) -> List[str]:
+        return self.path[1:].split('/')
+
+    @model_validator(mode='after')
+    def check_path(self):
+        segments = self.segments
+        if segments == ['free_user_text'] and self.op != 'remove':
+            self.value = TypeAdapter(str).validate_python(self.value)
+            return self
+
+        if not 2 <= len(segments) <= 3 or segments[0] not in RECORD_SECTIONS:
+            raise ValueError(f"Unsupported path '{self.path}'")
+        model = RECORD_SECTIONS[segments[0]]
+        index = segments[1]
+
+        if len(segments) == 3:
+            if self.op != 'replace' or not index.isdigit() or segments[2] not in model.model_fields:
+                raise ValueError(f"Unsupported path '{self.path}' for {self.op}")
+            adapter = TypeAdapter(model.model_fields[segments[2]].annotation)
+            self.value = adapter.dump_python(adapter.validate_python(self.value), mode='json')
+        elif not (index.isdigit() or (index == '-' and self.op == 'add')):
+            raise ValueError(f"Unsupported path '{self.path}' for {self.op}")
+        elif self.op != 'remove':
+            self.value = model.model_validate(self.value).model_dump(mode='json')
+        return self
+
+class PatientPatch(BaseModel):
+    """
+    Partial update: only the fields sent are changed. `medical_record`
+    replaces the whole record, `medical_record_ops` edits it in place.
+    """
+    full_name: Optional[str] = Field(None, min_length=2)
+    email: Optional[EmailStr] = None
+    birthdate: Optional[date] = None
+    biological_sex: Optional[BiologicalSexEnum] = None
+    weight: Optional[float] = Field(None, gt=0)
+    ancestry: Optional[AncestryEnum] = None
+    password: Optional[str] = Field(None, min_length=8)
+    medical_record: Optional[MedicalRecordSchema] = None
+    medical_record_ops: List[RecordOperation] = Field(default_factory=list, max_length=20)
+
+    @model_validator(mode='after')
+    def check_fields(self):
+        nulls = [name for name in self.model_fields_set if getattr(self, name) is None]
+        if nulls:
+            raise ValueError(f"Fields cannot be null: {', '.join(sorted(nulls))}")
+        if self.medical_record is not None and self.medical_record_ops:
+            raise ValueError("Send either medical_record or medical_record_ops, not both")
+        return self
+
+# --- Bulk Import Schemas ---
+class ImportRowError(BaseModel):
+    line: int
+    errors: List[str]
+
+class ImportReport(BaseModel):
+    received: int
+    imported: int
+    failed: int
+    errors: List[ImportRowError] = Field(..., description="First failed lines, capped by IMPORT_MAX_REPORTED_ERRORS")
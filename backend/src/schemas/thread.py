@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class ThreadCreate(BaseModel):
+    title: str = Field('Nova consulta', min_length=1, max_length=120)
+
+class Thread(BaseModel):
+    id: str
+    title: str
+    message_count: int
+    creation_date: datetime
+    last_message_date: Optional[datetime]
+    model_config = {
+        "from_attributes": True
+    }
+
+class ThreadList(BaseModel):
+    threads: List[Thread]
@@ -0,0 +1,19 @@
+from datetime import date
+from typing import List
+
+from pydantic import BaseModel
+
+
+class DailyUsage(BaseModel):
+    usage_date: date
+    prompt_tokens: int
+    completion_tokens: int
+    llm_calls: int
+    model_config = {
+        "from_attributes": True
+    }
+
+class UsageResponse(BaseModel):
+    patient_id: int
+    daily_quota: int
+    days: List[DailyUsage]
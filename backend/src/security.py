@@ -1,68 +1,230 @@
+import hashlib
+import hmac
 import os
+import secrets
+import uuid
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from http import HTTPStatus
+from typing import Optional
 from zoneinfo import ZoneInfo
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, Header, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from jwt import DecodeError, decode, encode
-from pwdlib import PasswordHash
+from jwt import InvalidTokenError, decode, encode
 from sqlalchemy import select
-from sqlalchemy.orm import Session
-from src.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import get_async_db, get_async_read_db, is_replica
 from src.models import Patient
+from src.passwords import get_password_hash, verify_password # noqa: F401
+from src.principal_cache import principal_cache
+from src.revocation import revocation_list
+from src.schemas.patient import PatientSnapshot
+from src.sharding import patient_email_filter
 
 SECRET_KEY = os.environ["JWT_SECRET_KEY"]
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# access tokens are trusted without a database lookup, keep them short-lived
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
 ALGORITHM="HS256"
+ACCESS = 'access'
+REFRESH = 'refresh'
+# shared secret for operator routes (bulk import/export), disabled when unset
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN")
 
-pwd_context = PasswordHash.recommended()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/token')
 
-def create_access_token(data: dict):
+def create_access_token(data: dict, token_type: str = ACCESS):
     to_encode = data.copy()
-    expire = datetime.now(tz=ZoneInfo('UTC')) + timedelta(
-        minutes=ACCESS_TOKEN_EXPIRE_MINUTES
+    expire = datetime.now(tz=ZoneInfo('UTC')) + (
+        timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES) if token_type == ACCESS
+        else timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     )
-    to_encode.update({'exp': expire})
+    # the jti identifies the token for revocation
+    to_encode.update({'exp': expire, 'type': token_type, 'jti': uuid.uuid4().hex})
     encoded_jwt = encode(
         to_encode, SECRET_KEY, algorithm=ALGORITHM
     )
     return encoded_jwt
 
 
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
+def token_claims(patient: Patient) -> dict:
+    """What a token says about its patient: email, id and record version."""
+    return {'sub': patient.email, 'pid': patient.id, 'ver': patient.version}
 
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+def credentials_claim(patient: Patient) -> str:
+    """
+    Fingerprint of the stored password hash, carried by refresh tokens: a
+    password change (or a rehash with new cost parameters) retires them.
+    Keyed with the JWT secret, the token does not reveal anything about the hash.
+    """
+    return hmac.new(SECRET_KEY.encode(), patient.password.encode(), hashlib.sha256).hexdigest()[:32]
 
 
-def get_current_user(
-    session: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme),
-):
-    credentials_exception = HTTPException(
+def issue_tokens(patient: Patient) -> dict:
+    """A short-lived access token and the refresh token renewing it."""
+    claims = token_claims(patient)
+    return {
+        'access_token': create_access_token(claims),
+        'refresh_token': create_access_token(
+            {**claims, 'cred': credentials_claim(patient)}, token_type=REFRESH
+        ),
+        'token_type': 'bearer',
+        'expires_in': ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
+
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated patient, as much as authorization checks need."""
+    id: int
+    email: str
+    # record version when the token was issued, None when loaded from the database
+    version: Optional[int] = None
+
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=HTTPStatus.UNAUTHORIZED,
         detail='Could not validate credentials',
         headers={'WWW-Authenticate': 'Bearer'},
     )
 
+
+def decode_token(token: str, token_type: str = ACCESS) -> dict:
+    """
+    Validates the token signature, expiry and type, returning its claims.
+    Tokens issued before the type claim existed are access tokens.
+    """
     try:
         payload = decode(
             token, SECRET_KEY, algorithms=[ALGORITHM]
         )
-        subject_email: str = payload.get('sub')
-        if not subject_email:
-            raise credentials_exception
-    except DecodeError:
-        raise credentials_exception
-
-    patient = session.scalar(
-        select(Patient).where(Patient.email == subject_email)
+    except InvalidTokenError:
+        raise credentials_exception()
+
+    if not payload.get('sub') or payload.get('type', ACCESS) != token_type:
+        raise credentials_exception()
+    return payload
+
+
+async def ensure_not_revoked(claims: dict, primary: AsyncSession):
+    """
+    Rejects revoked tokens: a lookup in this worker's copy of the revocation
+    list, `primary` is only queried while that copy is out of sync.
+    """
+    jti = claims.get('jti')
+    if jti and await revocation_list.is_revoked(primary, jti):
+        raise credentials_exception()
+
+
+async def decode_valid_token(token: str, primary: AsyncSession, token_type: str = ACCESS) -> dict:
+    """`decode_token` followed by the revocation check."""
+    claims = decode_token(token, token_type)
+    await ensure_not_revoked(claims, primary)
+    return claims
+
+
+async def _find_subject(stmt, session: AsyncSession, primary: AsyncSession):
+    """
+    Runs the lookup on the read session, retrying on the primary when a
+    replica misses (an account created a moment ago may not be there yet).
+    """
+    row = (await session.execute(stmt)).first()
+    if row is None and is_replica(session):
+        row = (await primary.execute(stmt)).first()
+    return row
+
+
+async def get_current_principal(
+    session: AsyncSession = Depends(get_async_read_db),
+    primary: AsyncSession = Depends(get_async_db),
+    token: str = Depends(oauth2_scheme),
+) -> Principal:
+    """
+    Lightweight authentication: loads only the patient id and email, never
+    the medical_record JSONB. Use it on routes that only compare ids.
+    """
+    subject_email = (await decode_valid_token(token, primary))['sub']
+    principal = principal_cache.get('principal', subject_email)
+    if principal is not None:
+        return principal
+
+    generation = principal_cache.generation()
+    row = await _find_subject(
+        select(Patient.id, Patient.email)
+        .where(*await patient_email_filter(primary, subject_email)),
+        session, primary,
+    )
+    if not row:
+        raise credentials_exception()
+
+    principal = Principal(id=row.id, email=row.email)
+    principal_cache.put('principal', subject_email, principal, generation)
+    return principal
+
+
+async def get_token_principal(
+    session: AsyncSession = Depends(get_async_read_db),
+    primary: AsyncSession = Depends(get_async_db),
+    token: str = Depends(oauth2_scheme),
+) -> Principal:
+    """
+    Authentication from the verified token claims alone, no database access.
+    Only for checks that compare the patient id: a patient deleted or
+    renamed after the token was issued keeps it valid until it expires.
+
+    Tokens without the id claim fall back to `get_current_principal` (the
+    sessions above only take a connection in that case).
+    """
+    claims = await decode_valid_token(token, primary)
+    patient_id = claims.get('pid')
+    if not isinstance(patient_id, int):
+        return await get_current_principal(session, primary, token)
+    return Principal(id=patient_id, email=claims['sub'], version=claims.get('ver'))
+
+
+async def get_current_user(
+    session: AsyncSession = Depends(get_async_read_db),
+    primary: AsyncSession = Depends(get_async_db),
+    token: str = Depends(oauth2_scheme),
+) -> PatientSnapshot:
+    """
+    Full authentication: loads the whole Patient row, including the medical
+    record. Only routes that return or use the record should opt in to it.
+
+    Read from a replica, except right after the client's own writes (see
+    `remember_write`). The row is returned, and cached for the next requests,
+    as a frozen PatientSnapshot: no request can change what another one sees.
+    """
+    subject_email = (await decode_valid_token(token, primary))['sub']
+    patient = principal_cache.get('patient', subject_email)
+    if patient is not None:
+        return patient
+
+    generation = principal_cache.generation()
+    row = await _find_subject(
+        select(Patient).where(*await patient_email_filter(primary, subject_email)),
+        session, primary,
     )
-    if not patient:
-        raise credentials_exception
+    if not row:
+        raise credentials_exception()
 
+    patient = PatientSnapshot.model_validate(row.Patient)
+    principal_cache.put('patient', subject_email, patient, generation)
     return patient
+
+
+def require_admin_token(x_admin_token: str = Header(None)):
+    """
+    Guards operator routes (bulk import and export) with the `X-Admin-Token`
+    header. The routes answer 404 while ADMIN_API_TOKEN is not configured.
+    """
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Not Found")
+
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="Not enough permissions"
+        )
@@ -0,0 +1,418 @@
+"""
+Optional sharding of patient storage across several PostgreSQL databases.
+
+Patients are spread over SHARD_BUCKETS virtual buckets (`id % SHARD_BUCKETS`,
+ids come from one global sequence so buckets fill evenly) and a shard map
+assigns every bucket to a shard DSN. Resharding moves whole buckets, the
+bucket of a patient never changes. The main database keeps every other
+table, plus `patient_directory` (email -> id) for logins.
+
+Sharding is enabled by pointing PATIENT_SHARD_MAP to a map file, created
+and changed with this CLI (from the backend directory). Pause writes while
+`init` or `reshard` runs, then deploy the new map:
+    python -m src.sharding init --map shards.json DSN [DSN ...]
+    python -m src.sharding reshard --map shards.json --output new.json DSN [DSN ...]
+
+`init` leaves the main database's patients in place and drops the main
+tables' foreign keys to them. Once the sharded deployment is verified,
+`purge-main` checks every row against its shard copy and deletes them:
+    python -m src.sharding purge-main --map shards.json
+"""
+import argparse
+import json
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    async_sessionmaker, create_async_engine)
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import (BinaryExpression, BindParameter,
+                                     BooleanClauseList)
+from src.models import Patient, PatientDirectory
+
+SHARD_BUCKETS = 1024
+MAIN = 'main'
+COPY_BATCH_SIZE = 1000
+PATIENT_FOREIGN_KEYS = [
+    ('threads', 'threads_patient_id_fkey'),
+    ('token_usage', 'token_usage_patient_id_fkey'),
+]
+
+
+class ShardMap:
+    """Shard DSNs and the shard index owning every bucket."""
+
+    def __init__(self, shards: List[str], buckets: List[int]):
+        if len(buckets) != SHARD_BUCKETS:
+            raise ValueError(f"A shard map has {SHARD_BUCKETS} buckets, got {len(buckets)}")
+        self.shards = shards
+        self.buckets = buckets
+
+    @classmethod
+    def even(cls, shards: List[str]) -> 'ShardMap':
+        return cls(shards, [bucket % len(shards) for bucket in range(SHARD_BUCKETS)])
+
+    @classmethod
+    def load(cls, path: str) -> 'ShardMap':
+        with open(path) as file:
+            data = json.load(file)
+        return cls(data['shards'], data['buckets'])
+
+    def dump(self, path: str):
+        with open(path, 'w') as file:
+            json.dump({'shards': self.shards, 'buckets': self.buckets}, file)
+
+    @staticmethod
+    def shard_id(index: int) -> str:
+        return f'shard_{index}'
+
+    def shard_for_id(self, patient_id: int) -> str:
+        return self.shard_id(self.buckets[patient_id % SHARD_BUCKETS])
+
+    def shard_ids(self) -> List[str]:
+        return [self.shard_id(index) for index in range(len(self.shards))]
+
+    def rebalanced(self, shards: List[str]) -> 'ShardMap':
+        """
+        Map onto `shards` moving as few buckets as possible: shards keep
+        their buckets up to an even share, the rest go to the emptiest shards.
+        """
+        base, extra = divmod(SHARD_BUCKETS, len(shards))
+        quotas = {dsn: base + (index < extra) for index, dsn in enumerate(shards)}
+        owners = [self.shards[index] for index in self.buckets]
+        counts = Counter()
+        buckets = [None] * SHARD_BUCKETS
+        for bucket, owner in enumerate(owners):
+            if owner in quotas and counts[owner] < quotas[owner]:
+                buckets[bucket] = shards.index(owner)
+                counts[owner] += 1
+        for bucket, index in enumerate(buckets):
+            if index is None:
+                target = max(shards, key=lambda dsn: quotas[dsn] - counts[dsn])
+                buckets[bucket] = shards.index(target)
+                counts[target] += 1
+        return ShardMap(shards, buckets)
+
+
+def shard_engines(shard_map: ShardMap, **engine_options) -> Dict[str, Engine]:
+    """Sync (psycopg2) engines of every shard, for the bulk import and export."""
+    return {
+        shard_map.shard_id(index): create_engine(dsn, **engine_options)
+        for index, dsn in enumerate(shard_map.shards)
+    }
+
+
+def is_sharded(session: AsyncSession) -> bool:
+    return session.info.get('sharded', False)
+
+
+def _patient_ids(orm_context) -> set:
+    """Patient ids pinned by top-level `Patient.id == value` conditions."""
+    where = getattr(orm_context.statement, 'whereclause', None)
+    if where is None:
+        return set()
+    clauses = where.clauses if isinstance(where, BooleanClauseList) and where.operator is operators.and_ else [where]
+    parameters = orm_context.parameters if isinstance(orm_context.parameters, dict) else {}
+
+    patient_ids = set()
+    for clause in clauses:
+        if (
+            isinstance(clause, BinaryExpression)
+            and clause.operator is operators.eq
+            and getattr(clause.left, 'table', None) is Patient.__table__
+            and clause.left.name == 'id'
+            and isinstance(clause.right, BindParameter)
+        ):
+            # primary key loads pass the value as a parameter
+            value = parameters.get(clause.right.key, clause.right.effective_value)
+            if value is None:
+                return set()
+            patient_ids.add(value)
+    return patient_ids
+
+
+def sharded_sessionmaker(main_engine: AsyncEngine, shard_map: ShardMap,
+                         shard_engines: Optional[Dict[str, AsyncEngine]] = None, **engine_options):
+    """
+    AsyncSession factory sending Patient statements to their shard (every
+    shard when the statement does not pin a `Patient.id`) and everything
+    else to the main database.
+    """
+    if shard_engines is None:
+        shard_engines = {
+            shard_map.shard_id(index): create_async_engine(
+                make_url(dsn).set(drivername='postgresql+asyncpg'), **engine_options
+            )
+            for index, dsn in enumerate(shard_map.shards)
+        }
+    shards = {MAIN: main_engine.sync_engine}
+    shards.update({shard_id: engine.sync_engine for shard_id, engine in shard_engines.items()})
+
+    def shard_chooser(mapper, instance, clause=None):
+        if mapper is not None and mapper.class_ is Patient:
+            return shard_map.shard_for_id(instance.id)
+        return MAIN
+
+    def identity_chooser(mapper, primary_key, **kwargs):
+        if mapper.class_ is Patient:
+            return [shard_map.shard_for_id(primary_key[0])]
+        return [MAIN]
+
+    def execute_chooser(orm_context):
+        mapper = orm_context.bind_mapper
+        if mapper is None or mapper.class_ is not Patient:
+            return [MAIN]
+        patient_ids = _patient_ids(orm_context)
+        if patient_ids:
+            return sorted({shard_map.shard_for_id(patient_id) for patient_id in patient_ids})
+        return shard_map.shard_ids()
+
+    return async_sessionmaker(
+        sync_session_class=ShardedSession,
+        shards=shards,
+        shard_chooser=shard_chooser,
+        identity_chooser=identity_chooser,
+        execute_chooser=execute_chooser,
+        autoflush=False,
+        expire_on_commit=False,
+        info={'sharded': True, 'shard_map': shard_map},
+    )
+
+
+def shard_bind(session: AsyncSession, patient_id: int) -> dict:
+    """bind_arguments placing a Core INSERT of `patient_id` on its shard."""
+    if not is_sharded(session):
+        return {}
+    return {'shard_id': session.info['shard_map'].shard_for_id(patient_id)}
+
+
+async def patient_email_filter(session: AsyncSession, email: str) -> list:
+    """
+    Conditions finding a patient by email. On a sharded session the email
+    is resolved through the directory first, so only one shard is queried.
+    """
+    email = email.lower()
+    conditions = [func.lower(Patient.email) == email]
+    if is_sharded(session):
+        patient_id = await session.scalar(
+            select(PatientDirectory.patient_id).where(PatientDirectory.email == email)
+        )
+        conditions.insert(0, Patient.id == (patient_id if patient_id is not None else -1))
+    return conditions
+
+
+async def claim_email(session: AsyncSession, email: str) -> Optional[int]:
+    """Reserves the email in the directory, returning a new patient id (None if taken)."""
+    return await session.scalar(
+        insert(PatientDirectory)
+        .values(email=email.lower())
+        .on_conflict_do_nothing(index_elements=[PatientDirectory.email])
+        .returning(PatientDirectory.patient_id)
+    )
+
+
+async def update_directory_email(session: AsyncSession, patient_id: int, email: str):
+    """Follows an email change, a taken email raises IntegrityError."""
+    if is_sharded(session):
+        await session.execute(
+            update(PatientDirectory)
+            .where(PatientDirectory.patient_id == patient_id)
+            .values(email=email.lower())
+        )
+
+
+async def remove_from_directory(session: AsyncSession, patient_id: int):
+    if is_sharded(session):
+        await session.execute(
+            delete(PatientDirectory).where(PatientDirectory.patient_id == patient_id)
+        )
+
+
+# --- resharding ---
+
+def _copy_patients(source, target, condition) -> int:
+    """Copies the patients matching `condition`, keeping their ids."""
+    table = Patient.__table__
+    copied = 0
+    last_id = 0
+    with source.connect() as reader:
+        while True:
+            rows = reader.execute(
+                select(table).where(condition, table.c.id > last_id)
+                .order_by(table.c.id).limit(COPY_BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                return copied
+            with target.begin() as writer:
+                writer.execute(
+                    insert(table).values([dict(row) for row in rows])
+                    .on_conflict_do_nothing(index_elements=[table.c.id])
+                )
+            copied += len(rows)
+            last_id = rows[-1]['id']
+
+
+def _create_patient_tables(shards: List[str]):
+    for dsn in shards:
+        engine = create_engine(dsn)
+        Patient.__table__.create(engine, checkfirst=True)
+        engine.dispose()
+
+
+def drop_patient_foreign_keys(connection):
+    """
+    Drops the main database's foreign keys to patients: once sharded, new
+    patients only exist on their shard. delete_patient removes their threads
+    and usage itself in sharded mode.
+    """
+    for table, constraint in PATIENT_FOREIGN_KEYS:
+        connection.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}'))
+
+
+def init_shards(main_url: str, shards: List[str]) -> ShardMap:
+    """
+    Creates the patients table on every shard, copies the main database's
+    patients onto them and registers them in the directory. The main
+    database's rows are left in place, `purge_main` removes them once the
+    copy is verified.
+    """
+    _create_patient_tables(shards)
+    shard_map = ShardMap.even(shards)
+    main = create_engine(main_url)
+    table = Patient.__table__
+
+    for index, dsn in enumerate(shards):
+        buckets = [bucket for bucket, owner in enumerate(shard_map.buckets) if owner == index]
+        target = create_engine(dsn)
+        copied = _copy_patients(main, target, (table.c.id % SHARD_BUCKETS).in_(buckets))
+        target.dispose()
+        print(f"{dsn}: {copied} patients")
+
+    with main.begin() as connection:
+        connection.execute(
+            insert(PatientDirectory).from_select(
+                ['email', 'patient_id'], select(func.lower(table.c.email), table.c.id)
+            ).on_conflict_do_nothing()
+        )
+        connection.execute(select(func.setval(
+            'patient_id_seq', select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery(), False
+        )))
+        drop_patient_foreign_keys(connection)
+    main.dispose()
+    return shard_map
+
+
+def unverified_patients(main_url: str, shard_map: ShardMap) -> List[int]:
+    """Ids of the main database's patients missing, or different, on their shard."""
+    main = create_engine(main_url)
+    engines = shard_engines(shard_map)
+    table = Patient.__table__
+    unverified = []
+    last_id = 0
+    with main.connect() as reader:
+        while True:
+            rows = reader.execute(
+                select(table).where(table.c.id > last_id).order_by(table.c.id).limit(COPY_BATCH_SIZE)
+            ).mappings().all()
+            if not rows:
+                break
+            by_shard = defaultdict(list)
+            for row in rows:
+                by_shard[shard_map.shard_for_id(row['id'])].append(dict(row))
+            for shard_id, expected in by_shard.items():
+                with engines[shard_id].connect() as connection:
+                    copies = {
+                        row['id']: dict(row) for row in connection.execute(
+                            select(table).where(table.c.id.in_([row['id'] for row in expected]))
+                        ).mappings()
+                    }
+                unverified.extend(row['id'] for row in expected if copies.get(row['id']) != row)
+            last_id = rows[-1]['id']
+    for engine in engines.values():
+        engine.dispose()
+    main.dispose()
+    return unverified
+
+
+def purge_main(main_url: str, shard_map: ShardMap) -> int:
+    """
+    Deletes the main database's patients after checking every one of them
+    was copied unchanged onto its shard. Refuses to delete anything otherwise.
+    """
+    unverified = unverified_patients(main_url, shard_map)
+    if unverified:
+        raise RuntimeError(
+            f"{len(unverified)} patients are missing or differ on their shard "
+            f"(first ids: {unverified[:10]}), nothing was purged"
+        )
+    main = create_engine(main_url)
+    with main.begin() as connection:
+        # the cascade would take the patients' threads and usage with them
+        drop_patient_foreign_keys(connection)
+        purged = connection.execute(Patient.__table__.delete()).rowcount
+    main.dispose()
+    return purged
+
+
+def reshard(shard_map: ShardMap, shards: List[str], keep_source: bool = False) -> ShardMap:
+    """Copies the buckets changing owner to their new shard, then drops them from the old one."""
+    _create_patient_tables(shards)
+    new_map = shard_map.rebalanced(shards)
+    table = Patient.__table__
+
+    moves = defaultdict(list)
+    for bucket, (old, new) in enumerate(zip(shard_map.buckets, new_map.buckets)):
+        if shard_map.shards[old] != new_map.shards[new]:
+            moves[(shard_map.shards[old], new_map.shards[new])].append(bucket)
+
+    for (source_dsn, target_dsn), buckets in moves.items():
+        source, target = create_engine(source_dsn), create_engine(target_dsn)
+        condition = (table.c.id % SHARD_BUCKETS).in_(buckets)
+        copied = _copy_patients(source, target, condition)
+        if not keep_source:
+            with source.begin() as connection:
+                connection.execute(table.delete().where(condition))
+        source.dispose()
+        target.dispose()
+        print(f"{source_dsn} -> {target_dsn}: {len(buckets)} buckets, {copied} patients")
+
+    return new_map
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    init = commands.add_parser('init', help="shard the patients of the main database")
+    init.add_argument('--map', required=True, help="shard map file to write")
+    init.add_argument('shards', nargs='+', help="shard DSNs")
+
+    move = commands.add_parser('reshard', help="move buckets onto a new list of shards")
+    move.add_argument('--map', required=True, help="current shard map")
+    move.add_argument('--output', required=True, help="new shard map file to write")
+    move.add_argument('--keep-source', action='store_true', help="do not delete moved rows")
+    move.add_argument('shards', nargs='+', help="shard DSNs, existing and new")
+
+    purge = commands.add_parser('purge-main', help="delete the main database's patients once verified on the shards")
+    purge.add_argument('--map', required=True, help="current shard map")
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        from src.database import DATABASE_URL
+        init_shards(DATABASE_URL, args.shards).dump(args.map)
+    elif args.command == 'purge-main':
+        from src.database import DATABASE_URL
+        try:
+            print(f"main: {purge_main(DATABASE_URL, ShardMap.load(args.map))} patients purged")
+        except RuntimeError as e:
+            parser.exit(1, f"{e}\n")
+    else:
+        reshard(ShardMap.load(args.map), args.shards, args.keep_source).dump(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+from datetime import date
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+from src.database import SessionLocal
+from src.models import TokenUsage
+
+logger = logging.getLogger(__name__)
+
+# 0 disables the quota
+DAILY_TOKEN_QUOTA = int(os.environ.get('DAILY_TOKEN_QUOTA', '0'))
+USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', '2.0'))
+USAGE_MAX_BATCH = int(os.environ.get('USAGE_MAX_BATCH', '500'))
+# failed flushes an aggregate survives (database down) before it is dropped
+USAGE_MAX_RETRIES = int(os.environ.get('USAGE_MAX_RETRIES', '5'))
+
+
+def _upsert(pending: dict):
+    """One INSERT ... ON CONFLICT adding the aggregates to the stored totals."""
+    stmt = insert(TokenUsage).values([
+        {
+            'patient_id': patient_id,
+            'usage_date': day,
+            'prompt_tokens': prompt,
+            'completion_tokens': completion,
+            'llm_calls': calls,
+        }
+        for (patient_id, day), (prompt, completion, calls) in pending.items()
+    ])
+    return stmt.on_conflict_do_update(
+        index_elements=[TokenUsage.patient_id, TokenUsage.usage_date],
+        set_={
+            'prompt_tokens': TokenUsage.prompt_tokens + stmt.excluded.prompt_tokens,
+            'completion_tokens': TokenUsage.completion_tokens + stmt.excluded.completion_tokens,
+            'llm_calls': TokenUsage.llm_calls + stmt.excluded.llm_calls,
+        },
+    )
+
+
+class UsageWriter:
+    """
+    Aggregates token usage in memory per (patient, day) and writes it to the
+    `token_usage` table from a background thread, so recording usage never
+    adds a database round-trip to the chat request itself.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        flush_interval: float = USAGE_FLUSH_INTERVAL,
+        max_batch: int = USAGE_MAX_BATCH,
+        max_retries: int = USAGE_MAX_RETRIES,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self._pending = defaultdict(lambda: [0, 0, 0])
+        self._failures = Counter()
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, patient_id: int, prompt_tokens: int, completion_tokens: int):
+        """Queues the usage of one LLM call, starting the writer thread if needed."""
+        key = (patient_id, date.today())
+        with self._lock:
+            totals = self._pending[key]
+            totals[0] += prompt_tokens
+            totals[1] += completion_tokens
+            totals[2] += 1
+            self._pending_events += 1
+            if self._pending_events >= self.max_batch:
+                self._wakeup.set()
+        self.start()
+
+    def pending_tokens(self, patient_id: int, day: date) -> int:
+        """Tokens recorded for the patient on `day` that are not flushed yet."""
+        with self._lock:
+            totals = self._pending.get((patient_id, day))
+            return totals[0] + totals[1] if totals else 0
+
+    def flush(self):
+        """
+        Writes every pending aggregate with a single upsert statement. When a
+        row is refused (constraint or value error) the rows are written one
+        by one and the refused ones dropped; when the database is unreachable
+        the batch is kept for the next flush, at most `max_retries` times.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(lambda: [0, 0, 0])
+            self._pending_events = 0
+        if not pending:
+            return
+
+        session = self.session_factory()
+        try:
+            try:
+                session.execute(_upsert(pending))
+            except (IntegrityError, DataError):
+                session.rollback()
+                for key, totals in pending.items():
+                    try:
+                        with session.begin_nested():
+                            session.execute(_upsert({key: totals}))
+                    except (IntegrityError, DataError) as e:
+                        logger.error('Dropping the token usage of patient %s on %s: %s', *key, e.orig)
+            session.commit()
+        except Exception:
+            session.rollback()
+            logger.exception('Could not write token usage, keeping it for the next flush')
+            self._requeue(pending)
+        else:
+            with self._lock:
+                for key in pending:
+                    self._failures.pop(key, None)
+        finally:
+            session.close()
+
+    def _requeue(self, pending: dict):
+        with self._lock:
+            for key, (prompt, completion, calls) in pending.items():
+                self._failures[key] += 1
+                if self._failures[key] > self.max_retries:
+                    del self._failures[key]
+                    logger.error(
+                        'Dropping the token usage of patient %s on %s after %d failed flushes',
+                        *key, self.max_retries + 1,
+                    )
+                    continue
+                totals = self._pending[key]
+                totals[0] += prompt
+                totals[1] += completion
+                totals[2] += calls
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='usage-writer', daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stops the writer thread and flushes whatever is still pending."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+
+usage_writer = UsageWriter()
+atexit.register(usage_writer.stop)
+
+
+def get_daily_usage(session: Session, patient_id: int, day: date) -> int:
+    """Total tokens used by the patient on `day`, including unflushed usage."""
+    usage = session.get(TokenUsage, (patient_id, day))
+    stored = usage.prompt_tokens + usage.completion_tokens if usage else 0
+    return stored + usage_writer.pending_tokens(patient_id, day)
+
+
+def quota_exceeded(session: Session, patient_id: int) -> bool:
+    if not DAILY_TOKEN_QUOTA:
+        return False
+    return get_daily_usage(session, patient_id, date.today()) >= DAILY_TOKEN_QUOTA
+
+
+def get_usage_history(session: Session, patient_id: int, start: date, end: date):
+    return session.scalars(
+        select(TokenUsage)
+        .where(
+            TokenUsage.patient_id == patient_id,
+            TokenUsage.usage_date >= start,
+            TokenUsage.usage_date <= end,
+        )
+        .order_by(TokenUsage.usage_date)
+    ).all()
@@ -4,13 +4,16 @@ from datetime import datetime
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import NullPool, StaticPool
 from sqlalchemy_utils import create_database, database_exists
-from src.database import get_db
+from src import lifecycle
+from src.database import get_async_db, get_db, get_session_factory
 from src.main import app
 from src.models import Patient, table_registry
+from src.principal_cache import principal_cache
 from src.security import get_password_hash
 
 db_user = os.environ.get('POSTGRES_USER', 'postgres')
@@ -20,6 +23,7 @@ db_port = os.environ.get('DB_PORT', '5432')
 db_name = 'medical_analysis_tests'
 
 DATABASE_URL = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
 
 engine = create_engine(DATABASE_URL,poolclass=StaticPool)
 
@@ -31,6 +35,13 @@ if not database_exists(engine.url):
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# every test starts its own TestClient, warming the pools each time is wasted
+lifecycle.STARTUP_WARMUP = False
+
+# NullPool: the TestClient event loop changes between tests, never reuse connections
+async_engine = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 @pytest.fixture
 def session():
     table_registry.metadata.create_all(engine) # create all the tables for the test
@@ -48,8 +59,16 @@ def client(session):
     def get_session_override():
         return session
 
+    async def get_async_session_override():
+        async with AsyncSessionLocal() as async_session:
+            yield async_session
+
+    # tables are recreated for every test, ids and emails repeat
+    principal_cache.clear()
     with TestClient(app) as client:
         app.dependency_overrides[get_db] = get_session_override
+        app.dependency_overrides[get_async_db] = get_async_session_override
+        app.dependency_overrides[get_session_factory] = lambda: SessionLocal
         yield client
 
     app.dependency_overrides.clear()
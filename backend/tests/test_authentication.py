@@ -1,5 +1,11 @@
 from http import HTTPStatus
 
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from src import passwords
+from src.passwords import HashingPool, build_context
+from src.security import REFRESH, create_access_token, decode_token
+
 
 def test_get_token(client, patient):
     response = client.post(
@@ -10,3 +16,135 @@ def test_get_token(client, patient):
     assert response.status_code == HTTPStatus.OK
     assert 'access_token' in token
     assert 'token_type' in token
+    claims = decode_token(token['access_token'])
+    assert claims['pid'] == patient.id
+    assert claims['ver'] == patient.version
+
+
+def test_get_token_email_case_insensitive(client, patient):
+    response = client.post(
+        '/auth/token',
+        data={'username': patient.email.upper(), 'password': patient.clean_password},
+    )
+    assert response.status_code == HTTPStatus.OK
+
+
+def _capture_statements(client, token, url):
+    statements = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    try:
+        response = client.get(url, headers={'Authorization': f'Bearer {token}'})
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+
+    assert response.status_code == HTTPStatus.OK
+    return statements
+
+
+def test_principal_routes_trust_token_claims(client, token):
+    """
+    Tests that id-only routes authenticate from the token without reading patients.
+    """
+    statements = _capture_statements(client, token, '/threads/')
+    assert not any('FROM patients' in statement for statement in statements)
+
+
+def test_principal_routes_skip_medical_record(client, patient):
+    """
+    Tests that tokens without the id claim fall back to an id-only lookup.
+    """
+    token = create_access_token(data={'sub': patient.email})
+    statements = _capture_statements(client, token, '/threads/')
+    assert any('FROM patients' in statement for statement in statements)
+    assert not any('medical_record' in statement for statement in statements)
+
+
+def test_login_rehashes_outdated_hash(client, session, patient):
+    """
+    Tests that a hash made with other cost parameters is replaced at login.
+    """
+    patient.password = build_context(time_cost=1, memory_cost=8192, parallelism=1).hash(patient.clean_password)
+    session.commit()
+
+    response = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    session.refresh(patient)
+    assert f'm={passwords.ARGON2_MEMORY_COST},t={passwords.ARGON2_TIME_COST}' in patient.password
+    assert passwords.verify_password(patient.clean_password, patient.password)
+
+
+def test_login_shed_when_hashing_pool_is_full(client, patient, monkeypatch):
+    monkeypatch.setattr(passwords, 'hashing_pool', HashingPool(workers=0, max_pending=0))
+
+    response = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    )
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_refresh_token(client, patient):
+    tokens = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    ).json()
+
+    response = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+
+    assert response.status_code == HTTPStatus.OK
+    refreshed = response.json()
+    assert decode_token(refreshed['access_token'])['pid'] == patient.id
+    assert decode_token(refreshed['refresh_token'], token_type=REFRESH)['pid'] == patient.id
+
+
+def test_refresh_token_rejected_as_access_token(client, patient):
+    tokens = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    ).json()
+
+    response = client.get('/threads/', headers={'Authorization': f"Bearer {tokens['refresh_token']}"})
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+    response = client.post('/auth/refresh', json={'refresh_token': tokens['access_token']})
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_refresh_token_retired_by_email_change(client, session, patient):
+    tokens = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    ).json()
+    patient.email = 'other.email@example.com'
+    session.commit()
+
+    response = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_refresh_token_retired_by_password_change(client, patient, patient_json):
+    tokens = client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    ).json()
+    response = client.put(
+        f'/patients/{patient.id}',
+        json={**patient_json, 'email': patient.email, 'password': 'anotherPassword456!'},
+        headers={'Authorization': f"Bearer {tokens['access_token']}"},
+    )
+    assert response.status_code == HTTPStatus.OK
+
+    response = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
@@ -0,0 +1,83 @@
+import csv
+import io
+import json
+from http import HTTPStatus
+
+import pyarrow.parquet as pq
+import pytest
+from src import bulk_export, security
+from src.models import Patient
+
+
+@pytest.fixture
+def patients(session, patient, patient_json):
+    """Five patients, exported in batches of two."""
+    for n in range(4):
+        session.add(Patient(
+            full_name=f"Paciente {n}",
+            password="hash",
+            email=f"paciente{n}@example.com",
+            birthdate=patient.birthdate,
+            biological_sex="Male",
+            weight=80 + n,
+            ancestry="Asian",
+            medical_record=patient_json["medical_record"],
+        ))
+    session.commit()
+    return [patient]
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(security, 'ADMIN_API_TOKEN', 'admin-secret')
+    monkeypatch.setattr(bulk_export, 'EXPORT_BATCH_SIZE', 2)
+    return {'X-Admin-Token': 'admin-secret'}
+
+
+def test_export_ndjson(client, patients, admin, patient_json):
+    """
+    Tests that the NDJSON export has every patient, in id order, without passwords.
+    """
+    response = client.get('/patients/export', headers=admin)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row['email'] for row in rows][:2] == ['maria.clara10@example.com', 'paciente0@example.com']
+    assert len(rows) == 5
+    assert 'password' not in rows[0]
+    assert rows[0]['birthdate'] == '1990-05-15'
+    assert rows[0]['medical_record'] == patient_json['medical_record']
+
+
+def test_export_flattened_csv(client, patients, admin, patient_json):
+    """
+    Tests that a flattened CSV export has one column per medical record section.
+    """
+    response = client.get('/patients/export', params={'format': 'csv', 'flatten': True}, headers=admin)
+
+    assert response.status_code == HTTPStatus.OK
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 5
+    assert 'medical_record' not in rows[0]
+    assert json.loads(rows[0]['medical_record.allergies']) == patient_json['medical_record']['allergies']
+    assert rows[0]['medical_record.free_user_text'] == ''
+
+
+def test_export_parquet_row_groups(client, patients, admin):
+    """
+    Tests that the Parquet export is readable and written one row group per batch.
+    """
+    response = client.get('/patients/export', params={'format': 'parquet'}, headers=admin)
+
+    assert response.status_code == HTTPStatus.OK
+    parquet = pq.ParquetFile(io.BytesIO(response.content))
+    assert parquet.metadata.num_rows == 5
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.column('weight').to_pylist() == [65.5, 80, 81, 82, 83]
+
+
+def test_export_requires_admin_token(client):
+    response = client.get('/patients/export')
+    assert response.status_code == HTTPStatus.NOT_FOUND
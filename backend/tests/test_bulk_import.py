@@ -0,0 +1,82 @@
+import json
+from http import HTTPStatus
+
+from sqlalchemy import func, select
+from src import bulk_import, security
+from src.bulk_import import PatientImporter
+from src.models import Patient
+
+
+def _ndjson(*rows):
+    return '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows) + '\n'
+
+
+def _with_email(patient_json, email):
+    return {**patient_json, 'email': email}
+
+
+def test_import_requires_admin_token(client, monkeypatch):
+    """
+    Tests that the import route is hidden without ADMIN_API_TOKEN and refuses wrong tokens.
+    """
+    response = client.post('/patients/import', content='')
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+    monkeypatch.setattr(security, 'ADMIN_API_TOKEN', 'admin-secret')
+    response = client.post('/patients/import', content='', headers={'X-Admin-Token': 'wrong'})
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_import_reports_rows_per_line(client, session, patient, patient_json, monkeypatch):
+    """
+    Tests that valid rows are imported across chunks while invalid rows, repeated
+    emails and emails already registered are reported with their line numbers.
+    """
+    monkeypatch.setattr(security, 'ADMIN_API_TOKEN', 'admin-secret')
+    monkeypatch.setattr(bulk_import, 'IMPORT_HASH_WORKERS', 0)
+    monkeypatch.setattr(bulk_import, 'IMPORT_CHUNK_SIZE', 2)
+
+    body = _ndjson(
+        _with_email(patient_json, 'ana@example.com'),
+        _with_email(patient_json, 'bruno@example.com'),
+        '{"full_name": "x"',
+        _with_email(patient_json, 'ANA@example.com'),
+        '',
+        _with_email(patient_json, 'Maria.Clara10@example.com'),
+        {**_with_email(patient_json, 'carla@example.com'), 'weight': -1},
+        _with_email(patient_json, 'daniel@example.com'),
+    )
+    response = client.post(
+        '/patients/import',
+        content=body,
+        headers={'X-Admin-Token': 'admin-secret', 'Content-Type': 'application/x-ndjson'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    report = response.json()
+    assert report['received'] == 7
+    assert report['imported'] == 3
+    assert report['failed'] == 4
+    errors = {error['line']: error['errors'] for error in report['errors']}
+    assert sorted(errors) == [3, 4, 6, 7]
+    assert errors[4] == [bulk_import.EMAIL_EXISTS]
+    assert errors[6] == [bulk_import.EMAIL_EXISTS]
+    assert errors[7][0].startswith('weight:')
+
+    assert session.scalar(select(func.count()).select_from(Patient)) == 4
+    imported = session.scalar(select(Patient).where(Patient.email == 'daniel@example.com'))
+    assert imported.medical_record == patient_json['medical_record']
+    assert security.verify_password(patient_json['password'], imported.password)
+
+
+def test_importer_hashes_in_process_pool(session, patient_json):
+    """
+    Tests that passwords hashed by the worker processes verify in this process.
+    """
+    lines = [(n, json.dumps(_with_email(patient_json, f'user{n}@example.com'))) for n in range(1, 4)]
+    with PatientImporter(session, hash_workers=2) as importer:
+        importer.import_chunk(lines)
+
+    assert importer.report() == {'received': 3, 'imported': 3, 'failed': 0, 'errors': []}
+    stored = session.scalar(select(Patient.password).where(Patient.email == 'user2@example.com'))
+    assert security.verify_password(patient_json['password'], stored)
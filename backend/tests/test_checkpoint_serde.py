@@ -0,0 +1,38 @@
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from src.checkpoint_serde import ZstdSerializer
+
+
+def _messages(turns):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"Sinto dor de cabeça há {i} dias e febre alta à noite."))
+        messages.append(AIMessage(content="Entendo. A dor piora com a luz ou com barulho? " * 5))
+    return messages
+
+
+def test_roundtrip_compresses_large_values():
+    serde = ZstdSerializer()
+    messages = _messages(20)
+
+    type_, data = serde.dumps_typed(messages)
+
+    assert type_ == 'msgpack+zstd'
+    assert len(data) < len(JsonPlusSerializer().dumps_typed(messages)[1])
+    assert serde.loads_typed((type_, data)) == messages
+
+
+def test_small_values_are_not_compressed():
+    serde = ZstdSerializer(min_bytes=1024)
+    assert serde.dumps_typed({'question_count': 3})[0] == 'msgpack'
+    assert serde.dumps_typed(None) == ('null', b'')
+
+
+def test_reads_blobs_written_by_default_serializer():
+    """
+    Tests that checkpoints stored before enabling compression are still readable.
+    """
+    messages = _messages(5)
+    legacy_blob = JsonPlusSerializer().dumps_typed(messages)
+
+    assert ZstdSerializer().loads_typed(legacy_blob) == messages
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from src import http_client
+from src.http_client import PooledHTTPAdapter
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def _reply(self, body: dict):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(0.02)
+        with cls.lock:
+            cls.in_flight -= 1
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._reply({'ok': True})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self._reply({'query': 'febre', 'results': [], 'response_time': 0.1})
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    StubHandler.max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    http_client.metrics.reset()
+    http_client.dns_cache.clear()
+    yield f'http://localhost:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused(stub_server):
+    for _ in range(5):
+        assert http_client.outbound_session.get(stub_server).json() == {'ok': True}
+
+    counters = http_client.connection_metrics()['localhost']
+    assert counters['requests'] == 5
+    assert counters['connections_opened'] == 1
+    assert counters['dns_lookups'] == 1
+
+
+def test_concurrency_is_capped_per_host(stub_server):
+    session = requests.Session()
+    session.mount('http://', PooledHTTPAdapter(max_per_host=2))
+
+    threads = [threading.Thread(target=session.get, args=(stub_server,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert StubHandler.max_in_flight <= 2
+    assert http_client.connection_metrics()['localhost']['requests'] == 8
+
+
+def test_tavily_uses_outbound_pool(stub_server):
+    from langchain_tavily import TavilySearch
+    from src.agent import PooledTavilySearchAPIWrapper
+
+    search = TavilySearch(
+        max_results=5,
+        api_wrapper=PooledTavilySearchAPIWrapper(tavily_api_key='test', api_base_url=stub_server),
+    )
+
+    search.invoke({'query': 'febre'})
+    search.invoke({'query': 'dor de cabeça'})
+
+    counters = http_client.connection_metrics()['localhost']
+    assert counters['requests'] == 2
+    assert counters['connections_opened'] == 1
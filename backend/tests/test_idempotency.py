@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+from http import HTTPStatus
+
+from src import idempotency
+from src.idempotency import request_fingerprint
+from src.models import ConversationThread, IdempotencyKey
+
+
+def _thread(session, patient):
+    thread = ConversationThread(patient_id=patient.id)
+    session.add(thread)
+    session.commit()
+    return thread
+
+
+def _post(client, token, thread_id, message, key):
+    return client.post(
+        '/chat/',
+        json={'thread_id': thread_id, 'message': message, 'patient_record': {}},
+        headers={'Authorization': f'Bearer {token}', 'Idempotency-Key': key},
+    )
+
+
+def test_retry_replays_completed_response(client, session, patient, token):
+    """
+    Tests that a retry with a completed key gets the stored answer without running the agent.
+    """
+    thread = _thread(session, patient)
+    session.add(IdempotencyKey(
+        thread_id=thread.id,
+        key='retry-1',
+        request_hash=request_fingerprint(thread.id, 'Estou com febre'),
+        expires_at=datetime.now() + timedelta(hours=1),
+        status='completed',
+        response={'role': 'assistant', 'content': 'Há quanto tempo?'},
+    ))
+    session.commit()
+
+    response = _post(client, token, thread.id, 'Estou com febre', 'retry-1')
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {'role': 'assistant', 'content': 'Há quanto tempo?'}
+
+
+def test_key_reused_with_different_message(client, session, patient, token):
+    thread = _thread(session, patient)
+    session.add(IdempotencyKey(
+        thread_id=thread.id,
+        key='retry-2',
+        request_hash=request_fingerprint(thread.id, 'Estou com febre'),
+        expires_at=datetime.now() + timedelta(hours=1),
+        status='completed',
+        response={'role': 'assistant', 'content': 'Há quanto tempo?'},
+    ))
+    session.commit()
+
+    response = _post(client, token, thread.id, 'Outra mensagem', 'retry-2')
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_retry_while_request_in_progress(client, session, patient, token, monkeypatch):
+    """
+    Tests that a retry waits for the in-flight request and gives up with 409.
+    """
+    monkeypatch.setattr(idempotency, 'IDEMPOTENCY_WAIT_SECONDS', 0)
+    thread = _thread(session, patient)
+    session.add(IdempotencyKey(
+        thread_id=thread.id,
+        key='retry-3',
+        request_hash=request_fingerprint(thread.id, 'Estou com febre'),
+        expires_at=datetime.now() + timedelta(minutes=5),
+    ))
+    session.commit()
+
+    response = _post(client, token, thread.id, 'Estou com febre', 'retry-3')
+
+    assert response.status_code == HTTPStatus.CONFLICT
+
+
+def test_failed_request_releases_key(client, session, patient, token, monkeypatch):
+    """
+    Tests that a claimed key is released when the turn fails, so the client can retry.
+    """
+    monkeypatch.setattr('src.usage.DAILY_TOKEN_QUOTA', 1)
+    monkeypatch.setattr('src.usage.get_daily_usage', lambda *args: 1)
+    thread = _thread(session, patient)
+
+    response = _post(client, token, thread.id, 'Estou com febre', 'retry-4')
+
+    assert response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    assert session.get(IdempotencyKey, (thread.id, 'retry-4')) is None
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+from src import database, lifecycle
+
+
+def test_warm_up_and_shut_down(monkeypatch):
+    monkeypatch.setattr(lifecycle, 'PROVIDER_URLS', ())
+
+    async def cycle():
+        from src import agent
+
+        await lifecycle.warm_up()
+        warmed = (database.async_engine.pool.checkedin(), database.engine.pool.checkedin())
+        graph = agent._agent_graph
+        await lifecycle.shut_down()
+        return warmed, graph
+
+    (async_idle, sync_idle), graph = asyncio.run(cycle())
+
+    from src import agent
+
+    assert async_idle == sync_idle == database.DB_POOL_SIZE
+    assert graph is not None
+    assert agent._agent_graph is None
+    assert database.engine.pool.checkedin() == 0
+
+
+def test_warm_up_fits_the_connection_budget(monkeypatch):
+    monkeypatch.setattr(lifecycle, 'DB_CONNECTION_BUDGET', 90)
+    monkeypatch.setattr(lifecycle, 'WEB_CONCURRENCY', 8)
+    # 11 connections per worker: 3 LISTEN, 1 checkpointer, 3 for each engine
+    assert lifecycle._budget_warmup_connections() == 3
+
+
+def _imported_after(code: str, **env) -> set:
+    script = f'import sys\n{code}\nprint(" ".join(sys.modules))'
+    result = subprocess.run(
+        [sys.executable, '-c', script],
+        env={**os.environ, **env},
+        cwd=os.path.dirname(os.path.dirname(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(result.stdout.split())
+
+
+def test_app_import_does_not_load_agent_stack():
+    modules = _imported_after('import src.main')
+
+    assert 'src.agent' not in modules
+    assert not {name for name in modules if name.startswith(('langchain', 'langgraph'))}
+
+
+def test_crud_only_app_has_no_chat_routes():
+    modules = _imported_after(
+        'import src.main\n'
+        'assert not [r for r in src.main.app.routes if r.path.startswith("/chat")]\n'
+        'assert any(r.path == "/patients/" for r in src.main.app.routes)',
+        MOUNT_AGENT_ROUTES='false',
+    )
+
+    assert 'src.agent' not in modules
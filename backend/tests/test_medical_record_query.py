@@ -0,0 +1,92 @@
+from http import HTTPStatus
+
+from psycopg2.extras import Json
+from sqlalchemy import select, text
+from src.medical_record_query import compile_record_filters
+from src.models import Patient
+from src.schemas.patient import RecordFilter
+
+
+def _query(client, *filters, **params):
+    return client.post('/patients/query', json={'filters': list(filters)}, params=params)
+
+
+def test_query_medication_and_allergy(client, patient):
+    """
+    Tests the cohort "patients on Metformin with a Penicillin allergy".
+    """
+    response = _query(
+        client,
+        {'section': 'medications', 'field': 'medication_name', 'value': 'Metformin'},
+        {'section': 'allergies', 'field': 'substance', 'value': 'Penicillin'},
+        fields='email',
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [{'id': patient.id, 'email': patient.email}]
+
+
+def test_query_without_matches(client, patient):
+    response = _query(
+        client,
+        {'section': 'medications', 'field': 'medication_name', 'value': 'Metformin'},
+        {'section': 'allergies', 'field': 'substance', 'value': 'Latex'},
+    )
+    assert response.json() == []
+
+
+def test_query_path_operators(client, patient):
+    response = _query(
+        client,
+        {'section': 'conditions', 'field': 'condition_name', 'op': 'contains', 'value': 'diabetes'},
+        {'section': 'conditions', 'field': 'diagnosis_date', 'op': 'gte', 'value': '2023-01-01'},
+        {'section': 'medications', 'field': 'dosage', 'op': 'contains', 'value': '90mcg/act'},
+    )
+    assert [p['id'] for p in response.json()] == [patient.id]
+
+    response = _query(
+        client,
+        {'section': 'conditions', 'field': 'diagnosis_date', 'op': 'lte', 'value': '2000-01-01'},
+    )
+    assert response.json() == []
+
+
+def test_query_unknown_field(client):
+    response = _query(client, {'section': 'allergies', 'field': 'medication_name', 'value': 'x'})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def _plan(session, record_filter: RecordFilter) -> str:
+    compiled = (
+        select(Patient.id)
+        .where(*compile_record_filters([record_filter]))
+        .compile(dialect=session.get_bind().dialect)
+    )
+    params = {
+        name: Json(value) if isinstance(value, dict) else value
+        for name, value in compiled.params.items()
+    }
+    return '\n'.join(session.connection().exec_driver_sql(f'EXPLAIN {compiled}', params).scalars())
+
+
+def test_query_plan_uses_gin_index_for_equality(session, patient):
+    """
+    Tests that, with sequential scans allowed, equality filters are looked up
+    in the jsonb_path_ops index while the other operators cannot use it.
+    """
+    session.execute(text("""
+        INSERT INTO patients (full_name, password, email, birthdate, biological_sex, weight, ancestry, medical_record)
+        SELECT full_name, password, 'p' || n || '@example.com', birthdate, biological_sex, weight, ancestry,
+               jsonb_set(medical_record, '{medications,0,medication_name}', to_jsonb('Drug ' || n))
+        FROM patients, generate_series(1, 20000) AS n
+    """))
+    session.execute(text('ANALYZE patients'))
+
+    equality = _plan(session, RecordFilter(section='medications', field='medication_name', value='Metformin'))
+    assert 'Index Scan on ix_patients_medical_record_gin' in equality
+    assert 'Index Cond: (medical_record @>' in equality
+
+    for op, value in (('contains', 'metf'), ('gte', '2023-01-01'), ('lte', '2000-01-01')):
+        field = 'medication_name' if op == 'contains' else 'treatment_start_date'
+        plan = _plan(session, RecordFilter(section='medications', field=field, op=op, value=value))
+        assert 'ix_patients_medical_record_gin' not in plan, op
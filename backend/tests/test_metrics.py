@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+from http import HTTPStatus
+
+from langchain_core.messages import AIMessage
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine
+from src import database, metrics
+
+from tests.conftest import DATABASE_URL
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(__file__))
+
+
+def _samples(text: str) -> dict:
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+def test_metrics_endpoint(client, patient_json):
+    client.post('/patients/', json=patient_json)
+    token = client.post(
+        '/auth/token',
+        data={'username': patient_json['email'], 'password': patient_json['password']},
+    ).json()['access_token']
+    client.get('/threads/', headers={'Authorization': f'Bearer {token}'})
+    client.get('/no-such-route')
+
+    response = client.get('/metrics')
+    samples = _samples(response.text)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['content-type'].startswith('text/plain')
+    request_count = ('http_request_duration_seconds_count',
+                     (('method', 'GET'), ('route', '/threads/'), ('status', '200')))
+    assert samples[request_count] >= 1
+    unmatched = ('http_request_duration_seconds_count',
+                 (('method', 'GET'), ('route', 'unmatched'), ('status', '404')))
+    assert samples[unmatched] >= 1
+    assert samples[('password_hash_duration_seconds_count', (('function', 'get_password_hash'),))] >= 1
+    assert samples[('password_hash_duration_seconds_count', (('function', 'verify_and_update'),))] >= 1
+    assert samples[('db_pool_size', (('pool', 'primary'),))] == database.DB_POOL_SIZE
+    assert ('db_pool_checked_out', (('pool', 'primary_async'),)) in samples
+
+
+def test_pool_metrics():
+    engine = create_engine(DATABASE_URL, pool_size=2)
+    metrics.instrument_engine(engine, 'test_pool')
+    try:
+        first, second, third = engine.connect(), engine.connect(), engine.connect()
+        checked_out = REGISTRY.get_sample_value('db_pool_checked_out', {'pool': 'test_pool'})
+        overflow = REGISTRY.get_sample_value('db_pool_overflow', {'pool': 'test_pool'})
+        for connection in (first, second, third):
+            connection.close()
+    finally:
+        engine.dispose()
+
+    assert (checked_out, overflow) == (3, 1)
+    assert REGISTRY.get_sample_value('db_pool_checked_out', {'pool': 'test_pool'}) == 0
+    assert REGISTRY.get_sample_value('db_pool_overflow', {'pool': 'test_pool'}) == 0
+    assert REGISTRY.get_sample_value('db_pool_acquire_seconds_count', {'pool': 'test_pool'}) == 3
+
+
+def test_agent_response_metrics():
+    def value(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    before = (value('agent_tool_calls_total', tool='tavily_search'), value('agent_tokens_total', kind='output'))
+
+    metrics.observe_llm_response(AIMessage(
+        content='',
+        tool_calls=[{'name': 'tavily_search', 'args': {'query': 'enxaqueca'}, 'id': 'call-1'}],
+        usage_metadata={'input_tokens': 120, 'output_tokens': 30, 'total_tokens': 150},
+    ))
+
+    after = (value('agent_tool_calls_total', tool='tavily_search'), value('agent_tokens_total', kind='output'))
+    assert after == (before[0] + 1, before[1] + 30)
+
+
+def _run(code: str, multiproc_dir) -> str:
+    return subprocess.run(
+        [sys.executable, '-c', f'from src import metrics\n{code}'],
+        env={**os.environ, 'PROMETHEUS_MULTIPROC_DIR': str(multiproc_dir)},
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+def test_workers_are_aggregated(tmp_path):
+    worker = (
+        "metrics.REQUEST_DURATION.labels('GET', '/threads/', '200').observe(0.05)\n"
+        "metrics.DB_POOL_SIZE.labels('primary').set(5)\n"
+    )
+    _run(worker, tmp_path)
+    # this one shuts down: its gauges leave the sum, its counts stay
+    _run(worker + 'metrics.mark_worker_dead()', tmp_path)
+
+    samples = _samples(_run("print(metrics.render().decode())", tmp_path))
+
+    count = ('http_request_duration_seconds_count',
+             (('method', 'GET'), ('route', '/threads/'), ('status', '200')))
+    assert samples[count] == 2
+    assert samples[('db_pool_size', (('pool', 'primary'),))] == 5
@@ -1,4 +1,5 @@
 import json
+import re
 from datetime import date, datetime
 from http import HTTPStatus
 
@@ -179,3 +180,172 @@ def test_delete_patient_not_found(client,token):
     response = client.delete('/patients/999', headers={'Authorization': f'Bearer {token}'})
 
     assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_create_patient_email_exists_ignoring_case(client, patient, patient_json):
+    """
+    Tests that the lower(email) unique index rejects emails differing only in case.
+    """
+    patient_json['email'] = patient.email.upper()
+    response = client.post('/patients/', json=patient_json)
+
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json() == {'detail': 'A patient with this email already exists.'}
+
+
+def test_get_all_patients_keyset_pagination(client, patient_json):
+    """
+    Tests walking the listing page by page with the opaque next cursor.
+    """
+    for i in range(3):
+        patient_json['email'] = f'patient{i}@example.com'
+        client.post('/patients/', json=patient_json)
+
+    first_page = client.get('/patients/', params={'limit': 2})
+    assert [p['email'] for p in first_page.json()] == ['patient0@example.com', 'patient1@example.com']
+    cursor = first_page.headers['X-Next-Cursor']
+
+    last_page = client.get('/patients/', params={'limit': 2, 'cursor': cursor})
+    assert [p['email'] for p in last_page.json()] == ['patient2@example.com']
+    assert 'X-Next-Cursor' not in last_page.headers
+
+
+def test_get_all_patients_projection(client, patient):
+    response = client.get('/patients/', params={'fields': 'full_name,email'})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == [{'id': patient.id, 'full_name': patient.full_name, 'email': patient.email}]
+
+
+def test_get_all_patients_unknown_field(client):
+    response = client.get('/patients/', params={'fields': 'password'})
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_get_all_patients_invalid_cursor(client):
+    response = client.get('/patients/', params={'cursor': 'not-a-cursor'})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_patch_patient_record_operations(client, patient, token):
+    """
+    Tests a partial update editing medical record lists in place.
+    """
+    response = client.patch(
+        f'/patients/{patient.id}',
+        json={
+            'weight': 70,
+            'medical_record_ops': [
+                {'op': 'add', 'path': '/medications/-', 'value': {
+                    'medication_name': 'Losartan', 'dosage': '50mg',
+                    'frequency': 'Once daily', 'treatment_start_date': '2024-03-01',
+                }},
+                {'op': 'replace', 'path': '/medications/0/dosage', 'value': '850mg'},
+                {'op': 'remove', 'path': '/allergies/0'},
+                {'op': 'replace', 'path': '/free_user_text', 'value': 'Dor de cabeça frequente'},
+            ],
+        },
+        headers={'Authorization': f'Bearer {token}', 'If-Match': '"1"'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers['ETag'] == 'W/"2"'
+    data = response.json()
+    assert data['weight'] == 70
+    assert data['full_name'] == patient.full_name
+    assert data['version'] == 2
+    record = data['medical_record']
+    assert [m['medication_name'] for m in record['medications']] == ['Metformin', 'Albuterol Inhaler', 'Losartan']
+    assert record['medications'][0]['dosage'] == '850mg'
+    assert record['allergies'] == []
+    assert record['free_user_text'] == 'Dor de cabeça frequente'
+
+
+def test_patch_patient_stale_version(client, patient, token):
+    """
+    Tests that If-Match with an outdated version is refused without writing.
+    """
+    headers = {'Authorization': f'Bearer {token}'}
+    client.patch(f'/patients/{patient.id}', json={'weight': 70}, headers=headers)
+
+    response = client.patch(
+        f'/patients/{patient.id}', json={'weight': 71}, headers={**headers, 'If-Match': '"1"'}
+    )
+
+    assert response.status_code == HTTPStatus.PRECONDITION_FAILED
+    assert client.get(f'/patients/{patient.id}').json()['weight'] == 70
+
+
+def test_patch_patient_missing_entry(client, patient, token):
+    response = client.patch(
+        f'/patients/{patient.id}',
+        json={'medical_record_ops': [{'op': 'remove', 'path': '/allergies/5'}]},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.CONFLICT
+
+
+@pytest.mark.parametrize('operation', [
+    {'op': 'remove', 'path': '/free_user_text'},
+    {'op': 'replace', 'path': '/medications/-', 'value': {}},
+    {'op': 'add', 'path': '/medications/-', 'value': {'medication_name': 'Losartan'}},
+    {'op': 'replace', 'path': '/medications/0/unknown', 'value': 'x'},
+    {'op': 'replace', 'path': '/password', 'value': 'x'},
+])
+def test_patch_patient_invalid_operation(client, patient, token, operation):
+    response = client.patch(
+        f'/patients/{patient.id}',
+        json={'medical_record_ops': [operation]},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.parametrize('url', ['/patients/me', '/patients/{id}', '/patients/'])
+def test_conditional_get(client, patient, token, url):
+    """
+    Tests that the heavy read routes answer 304 to their current ETag, and
+    200 again once the patient changes.
+    """
+    url = url.format(id=patient.id)
+    headers = {'Authorization': f'Bearer {token}'}
+    first = client.get(url, headers=headers)
+    etag = first.headers['ETag']
+
+    cached = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert cached.status_code == HTTPStatus.NOT_MODIFIED
+    assert cached.content == b''
+    assert cached.headers['ETag'] == etag
+
+    client.patch(f'/patients/{patient.id}', json={'weight': 70}, headers=headers)
+    changed = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert changed.status_code == HTTPStatus.OK
+    assert changed.headers['ETag'] != etag
+
+
+def _query_count(response) -> int:
+    return int(re.search(r'(\d+) queries', response.headers['server-timing']).group(1))
+
+
+def test_conditional_listing_reads_versions_once(client, patient):
+    """
+    Tests that the id/version probe only runs for requests with If-None-Match,
+    and that a projection without `version` gets the same ETag without it.
+    """
+    plain = client.get('/patients/', params={'fields': 'email'})
+    probed = client.get('/patients/', params={'fields': 'email'}, headers={'If-None-Match': 'W/"other"'})
+
+    assert _query_count(probed) == _query_count(plain) + 1
+    assert plain.json() == [{'id': patient.id, 'email': patient.email}]
+    assert plain.headers['ETag'] == probed.headers['ETag']
+    assert plain.headers['ETag'].startswith('W/"')
+    cached = client.get('/patients/', params={'fields': 'email'}, headers={'If-None-Match': plain.headers['ETag']})
+    assert cached.status_code == HTTPStatus.NOT_MODIFIED
+
+
+def test_large_responses_are_compressed(client, patient):
+    response = client.get('/patients/', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+
+    response = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
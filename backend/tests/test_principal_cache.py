@@ -0,0 +1,86 @@
+import asyncio
+import time
+from http import HTTPStatus
+
+import pytest
+from pydantic import ValidationError
+from src.principal_cache import PrincipalCache, principal_cache
+
+from tests.conftest import DATABASE_URL, AsyncSessionLocal
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def listening_cache():
+    principal_cache.start()
+    _wait_for(lambda: principal_cache.stats()['listening'])
+    principal_cache.clear()
+    return principal_cache
+
+
+def test_me_served_from_cache_until_update(client, patient, token, listening_cache):
+    """
+    Tests that repeated /patients/me calls hit the cache and an update invalidates it.
+    """
+    headers = {'Authorization': f'Bearer {token}'}
+    before = listening_cache.stats()
+
+    client.get('/patients/me', headers=headers)
+    client.get('/patients/me', headers=headers)
+    stats = listening_cache.stats()
+    assert stats['misses'] - before['misses'] == 1
+    assert stats['hits'] - before['hits'] == 1
+
+    response = client.patch(f'/patients/{patient.id}', json={'weight': 70}, headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    assert client.get('/patients/me', headers=headers).json()['weight'] == 70
+
+    cached = listening_cache.get('patient', patient.email)
+    with pytest.raises(ValidationError):
+        cached.weight = 1
+
+
+def test_invalidation_reaches_other_workers(listening_cache):
+    """
+    Tests that a committed invalidation is delivered to another worker's cache.
+    """
+    other_worker = PrincipalCache(ttl=60, database_url=DATABASE_URL)
+    other_worker.start()
+    try:
+        _wait_for(lambda: other_worker.stats()['listening'])
+        other_worker.put('principal', 'ana@example.com', 'cached', other_worker.generation())
+        assert other_worker.get('principal', 'ana@example.com') == 'cached'
+
+        async def publish():
+            async with AsyncSessionLocal() as session:
+                await listening_cache.publish_invalidation(session, 'Ana@example.com')
+                await session.commit()
+
+        asyncio.run(publish())
+        _wait_for(lambda: other_worker.get('principal', 'ana@example.com') is None)
+    finally:
+        other_worker.stop()
+
+
+def test_lookup_racing_an_invalidation_is_not_cached(listening_cache):
+    generation = listening_cache.generation()
+    listening_cache.invalidate('ana@example.com')
+    listening_cache.put('principal', 'ana@example.com', 'stale', generation)
+
+    assert listening_cache.get('principal', 'ana@example.com') is None
+
+
+def test_lru_eviction():
+    cache = PrincipalCache(ttl=60, max_size=2)
+    cache._listening.set()
+    for subject in ('a', 'b', 'c'):
+        cache.put('principal', subject, subject, cache.generation())
+
+    assert cache._entries.keys() == {('principal', 'b'), ('principal', 'c')}
+    assert cache.stats()['evictions'] == 1
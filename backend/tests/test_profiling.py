@@ -0,0 +1,106 @@
+import re
+import time
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import select
+from src import profiling, security
+from src.profiling import ProfilingSwitch, SamplingProfile
+from src.routers import threads
+
+from tests.conftest import DATABASE_URL
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+def _server_timing(response) -> dict:
+    return {
+        metric.split(';')[0]: float(re.search(r'dur=([\d.]+)', metric).group(1))
+        for metric in response.headers['server-timing'].split(', ')
+    }
+
+
+@pytest.fixture
+def admin(monkeypatch, tmp_path):
+    monkeypatch.setattr(security, 'ADMIN_API_TOKEN', 'admin-secret')
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'PROFILE_INTERVAL', 0.001)
+    return {'X-Admin-Token': 'admin-secret'}
+
+
+@pytest.fixture
+def slow_list_threads(monkeypatch):
+    def slow_select(*entities):
+        time.sleep(0.1)
+        return select(*entities)
+
+    monkeypatch.setattr(threads, 'select', slow_select)
+
+
+def test_server_timing(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.get('/threads/', headers=headers)
+    timings = _server_timing(response)
+
+    assert response.status_code == HTTPStatus.OK
+    assert {'db', 'handler', 'serialize', 'app'} <= timings.keys()
+    # dependencies (authentication) may query before the handler runs
+    assert timings['app'] >= max(timings['handler'], timings['db'])
+    assert 'queries"' in response.headers['server-timing']
+    assert 'x-profile-id' not in response.headers
+    # async routes on the asyncpg engine are timed too
+    assert 'db' in _server_timing(client.get('/patients/me', headers=headers))
+
+
+def test_marked_request_is_profiled(client, token, admin, slow_list_threads):
+    headers = {'Authorization': f'Bearer {token}', 'X-Profile': '1'}
+
+    assert 'x-profile-id' not in client.get('/threads/', headers=headers).headers
+    response = client.get('/threads/', headers={**headers, **admin})
+    name = response.headers['x-profile-id']
+    profile = client.get(f'/admin/profiles/{name}', headers=admin)
+
+    assert profile.status_code == HTTPStatus.OK
+    stacks = profile.text.splitlines()
+    assert all(re.match(r'^\S.* \d+$', stack) for stack in stacks)
+    # samples from the threadpool thread running the endpoint
+    assert any(
+        stack.startswith('threadpool;') and 'list_threads' in stack and 'slow_select' in stack
+        for stack in stacks
+    )
+    assert client.get('/admin/profiling', headers=admin).json()['profiles'] == [name]
+    assert client.get('/admin/profiles/..%2Fsecrets.folded', headers=admin).status_code == HTTPStatus.NOT_FOUND
+
+
+def test_sample_rate_switch_reaches_other_workers(client, token, admin):
+    other_worker = ProfilingSwitch(database_url=DATABASE_URL)
+    other_worker.start()
+    try:
+        _wait_for(lambda: other_worker.listening)
+
+        response = client.put('/admin/profiling', json={'sample_rate': 1}, headers=admin)
+        _wait_for(lambda: other_worker.sample_rate == 1)
+        profiled = client.get('/threads/', headers={'Authorization': f'Bearer {token}'})
+        client.put('/admin/profiling', json={'sample_rate': 0}, headers=admin)
+        _wait_for(lambda: other_worker.sample_rate == 0)
+    finally:
+        other_worker.stop()
+
+    assert response.json()['sample_rate'] == 1
+    assert 'x-profile-id' in profiled.headers
+    assert client.put('/admin/profiling', json={'sample_rate': 2}, headers=admin).status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_KEEP', 2)
+
+    for millis in (1000, 3000, 2000, 4000):
+        SamplingProfile(f'{millis}-1-get-threads.folded').save(str(tmp_path))
+
+    assert profiling.list_profiles(str(tmp_path)) == ['4000-1-get-threads.folded', '3000-1-get-threads.folded']
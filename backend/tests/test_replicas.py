@@ -0,0 +1,103 @@
+import asyncio
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy_utils import create_database, database_exists
+from src import database
+from src.database import ReplicaRouter
+from src.models import Patient, table_registry
+
+from tests.conftest import ASYNC_DATABASE_URL, DATABASE_URL
+
+# an empty database stands in for a replica that has not caught up yet
+REPLICA_URL = DATABASE_URL + '_replica'
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    sync_engine = create_engine(REPLICA_URL, poolclass=NullPool)
+    if not database_exists(sync_engine.url):
+        create_database(sync_engine.url)
+    table_registry.metadata.create_all(sync_engine)
+
+    engine = create_async_engine(ASYNC_DATABASE_URL + '_replica', poolclass=NullPool)
+    monkeypatch.setattr(database, 'replica_router', ReplicaRouter([engine]))
+    yield engine
+
+    table_registry.metadata.drop_all(sync_engine)
+    sync_engine.dispose()
+
+
+def test_reads_are_routed_to_replica(client, patient, replica):
+    """
+    Tests that listings read from the replica while a lookup missing on the
+    replica falls back to the primary.
+    """
+    assert client.get('/patients/').json() == []
+
+    response = client.get(f'/patients/{patient.id}')
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['email'] == patient.email
+
+
+def test_token_of_new_patient_works_before_replication(client, patient, token, replica):
+    """
+    Tests that authentication falls back to the primary for an account the replica lacks.
+    """
+    response = client.get('/patients/me', headers={'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()['id'] == patient.id
+
+
+def test_client_reads_its_writes(client, session, patient, token, replica, patient_json):
+    """
+    Tests that after an update the client reads from the primary (any worker
+    can tell from the returned WAL position) until the replica replays it.
+    """
+    stale = session.execute(select(Patient.__table__).where(Patient.id == patient.id)).mappings().one()
+    replica_engine = create_engine(REPLICA_URL, poolclass=NullPool)
+    with replica_engine.begin() as connection:
+        connection.execute(insert(Patient.__table__).values(**stale))
+    replica_engine.dispose()
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = client.put(
+        f'/patients/{patient.id}',
+        json={**patient_json, 'email': patient.email, 'full_name': 'Maria Clara Souza'},
+        headers=headers,
+    )
+    assert response.status_code == HTTPStatus.OK
+    lsn = response.headers[database.READ_AFTER_HEADER]
+    assert client.cookies[database.READ_AFTER_COOKIE].strip('"') == lsn
+
+    assert client.get(f'/patients/{patient.id}').json()['full_name'] == 'Maria Clara Souza'
+    assert client.get('/patients/me', headers=headers).json()['full_name'] == 'Maria Clara Souza'
+    not_modified = client.get(f'/patients/{patient.id}', headers={'If-None-Match': '"1"'})
+    assert not_modified.status_code == HTTPStatus.OK
+
+    client.cookies.clear()
+    # the empty "replica" never replays anything: the header alone is enough too
+    fresh = client.get(f'/patients/{patient.id}', headers={database.READ_AFTER_HEADER: lsn})
+    assert fresh.json()['full_name'] == 'Maria Clara Souza'
+    assert client.get(f'/patients/{patient.id}').json()['full_name'] == 'Maria Clara'
+
+
+def test_router_skips_unhealthy_replicas():
+    """
+    Tests the round-robin only hands out replicas passing the health check.
+    """
+    healthy = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    down = create_async_engine(ASYNC_DATABASE_URL.replace(':5432/', ':1/'), poolclass=NullPool)
+    router = ReplicaRouter([healthy, down])
+
+    async def picks():
+        return [await router.pick() for _ in range(4)]
+
+    assert asyncio.run(picks()) == [healthy] * 4
+
+    router.mark_down(healthy)
+    assert asyncio.run(router.pick()) is None
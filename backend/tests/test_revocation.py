@@ -0,0 +1,91 @@
+import time
+from http import HTTPStatus
+
+from sqlalchemy import select
+from src.models import RevokedToken
+from src.revocation import RevocationList, revocation_list
+from src.security import decode_token
+
+from tests.conftest import DATABASE_URL
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.05)
+
+
+def _login(client, patient):
+    return client.post(
+        '/auth/token',
+        data={'username': patient.email, 'password': patient.clean_password},
+    ).json()
+
+
+def test_logout_revokes_tokens(client, session, patient):
+    tokens = _login(client, patient)
+    headers = {'Authorization': f"Bearer {tokens['access_token']}"}
+    assert client.get('/threads/', headers=headers).status_code == HTTPStatus.OK
+
+    response = client.post('/auth/logout', headers=headers, json={'refresh_token': tokens['refresh_token']})
+
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert client.get('/threads/', headers=headers).status_code == HTTPStatus.UNAUTHORIZED
+    assert client.get('/patients/me', headers=headers).status_code == HTTPStatus.UNAUTHORIZED
+    response = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert len(session.scalars(select(RevokedToken)).all()) == 2
+
+
+def test_refresh_token_is_single_use(client, patient):
+    tokens = _login(client, patient)
+
+    first = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    second = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+
+    assert first.status_code == HTTPStatus.OK
+    assert second.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_concurrent_refresh_gets_one_token_pair(client, patient, monkeypatch):
+    """
+    Tests that a refresh which passed the revocation check before another
+    exchange of the same token committed is still refused.
+    """
+    tokens = _login(client, patient)
+
+    async def not_revoked_yet(session, jti):
+        return False
+
+    monkeypatch.setattr(revocation_list, 'is_revoked', not_revoked_yet)
+    first = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+    second = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+
+    assert first.status_code == HTTPStatus.OK
+    assert second.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_revocation_reaches_other_workers(client, patient):
+    """
+    Tests that another worker's in-memory list learns of a logout through NOTIFY.
+    """
+    other_worker = RevocationList(database_url=DATABASE_URL)
+    other_worker.start()
+    try:
+        _wait_for(lambda: other_worker.listening)
+        tokens = _login(client, patient)
+        jti = decode_token(tokens['access_token'])['jti']
+
+        client.post('/auth/logout', headers={'Authorization': f"Bearer {tokens['access_token']}"})
+
+        _wait_for(lambda: jti in other_worker._revoked)
+        # a worker starting afterwards loads it from the table
+        late_worker = RevocationList(database_url=DATABASE_URL)
+        late_worker.start()
+        try:
+            _wait_for(lambda: jti in late_worker._revoked)
+        finally:
+            late_worker.stop()
+    finally:
+        other_worker.stop()
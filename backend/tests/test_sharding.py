@@ -0,0 +1,254 @@
+import json
+from http import HTTPStatus
+
+import pytest
+from sqlalchemy import create_engine, inspect, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlalchemy_utils import create_database, database_exists
+from src import bulk_export, bulk_import, security
+from src.database import get_async_db, get_shard_map
+from src.main import app
+from src.models import ConversationThread, Patient, PatientDirectory
+from src.sharding import (ShardMap, drop_patient_foreign_keys, init_shards,
+                          purge_main, reshard, sharded_sessionmaker)
+
+from tests.conftest import ASYNC_DATABASE_URL, DATABASE_URL
+
+SHARD_URLS = [f'{DATABASE_URL}_shard_{index}' for index in range(3)]
+
+
+def _patient_ids(url):
+    engine = create_engine(url, poolclass=NullPool)
+    with engine.connect() as connection:
+        ids = connection.scalars(select(Patient.id).order_by(Patient.id)).all()
+    engine.dispose()
+    return ids
+
+
+@pytest.fixture
+def shard_urls():
+    for url in SHARD_URLS:
+        engine = create_engine(url, poolclass=NullPool)
+        if not database_exists(engine.url):
+            create_database(engine.url)
+        Patient.__table__.drop(engine, checkfirst=True)
+        Patient.__table__.create(engine)
+        engine.dispose()
+    return SHARD_URLS
+
+
+def _use_shards(shard_map):
+    main = create_async_engine(ASYNC_DATABASE_URL, poolclass=NullPool)
+    sessions = sharded_sessionmaker(main, shard_map, poolclass=NullPool)
+
+    async def get_sharded_session():
+        async with sessions() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = get_sharded_session
+    app.dependency_overrides[get_shard_map] = lambda: shard_map
+
+
+@pytest.fixture
+def sharded_client(client, session, shard_urls):
+    """Patients on two shards, everything else in the test database."""
+    drop_patient_foreign_keys(session.connection())
+    session.commit()
+    _use_shards(ShardMap.even(shard_urls[:2]))
+    return client
+
+
+def _create(client, patient_json, email):
+    response = client.post('/patients/', json={**patient_json, 'email': email})
+    assert response.status_code == HTTPStatus.CREATED
+    return response.json()['id']
+
+
+def test_patients_spread_over_shards(sharded_client, session, shard_urls, patient_json):
+    """
+    Tests that ids come from the directory and rows land on the shard of their bucket.
+    """
+    ids = [_create(sharded_client, patient_json, f'p{n}@example.com') for n in range(3)]
+
+    assert ids == [1, 2, 3]
+    assert _patient_ids(shard_urls[0]) == [2]
+    assert _patient_ids(shard_urls[1]) == [1, 3]
+    assert session.scalars(select(Patient.id)).all() == []
+    assert session.scalar(select(PatientDirectory.patient_id).where(PatientDirectory.email == 'p1@example.com')) == 2
+
+    response = sharded_client.post('/patients/', json={**patient_json, 'email': 'P1@example.com'})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_sharded_login_and_listing(sharded_client, patient_json):
+    """
+    Tests login through the directory and a listing merged across shards.
+    """
+    for n in range(3):
+        _create(sharded_client, patient_json, f'p{n}@example.com')
+
+    token = sharded_client.post(
+        '/auth/token', data={'username': 'P2@example.com', 'password': patient_json['password']}
+    ).json()['access_token']
+    me = sharded_client.get('/patients/me', headers={'Authorization': f'Bearer {token}'})
+    assert me.json()['id'] == 3
+
+    first = sharded_client.get('/patients/', params={'limit': 2})
+    assert [p['id'] for p in first.json()] == [1, 2]
+    last = sharded_client.get('/patients/', params={'limit': 2, 'cursor': first.headers['X-Next-Cursor']})
+    assert [p['id'] for p in last.json()] == [3]
+    assert sharded_client.get('/patients/2').json()['email'] == 'p1@example.com'
+
+
+def test_sharded_email_change_and_delete(sharded_client, session, patient_json):
+    """
+    Tests that the directory follows email changes and deletions.
+    """
+    patient_id = _create(sharded_client, patient_json, 'old@example.com')
+    _create(sharded_client, patient_json, 'taken@example.com')
+    token = sharded_client.post(
+        '/auth/token', data={'username': 'old@example.com', 'password': patient_json['password']}
+    ).json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    taken = sharded_client.patch(f'/patients/{patient_id}', json={'email': 'Taken@example.com'}, headers=headers)
+    assert taken.status_code == HTTPStatus.BAD_REQUEST
+
+    response = sharded_client.patch(f'/patients/{patient_id}', json={'email': 'new@example.com'}, headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    directory = session.scalars(select(PatientDirectory.email).order_by(PatientDirectory.patient_id)).all()
+    assert directory == ['new@example.com', 'taken@example.com']
+
+    token = sharded_client.post(
+        '/auth/token', data={'username': 'new@example.com', 'password': patient_json['password']}
+    ).json()['access_token']
+    response = sharded_client.delete(f'/patients/{patient_id}', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == HTTPStatus.OK
+    assert session.scalars(select(PatientDirectory.email)).all() == ['taken@example.com']
+
+
+def test_init_copies_patients_to_shards(session, patient, shard_urls):
+    """
+    Tests that init copies the patients onto their shard and registers them,
+    keeping the main database's rows and dropping its foreign keys to them.
+    """
+    patient_id = patient.id
+    session.commit()  # init alters the tables the session has read
+    init_shards(DATABASE_URL, shard_urls[:2])
+
+    assert _patient_ids(shard_urls[patient_id % 2]) == [patient_id]
+    assert session.scalars(select(Patient.id)).all() == [patient_id]
+    assert session.scalar(select(PatientDirectory.patient_id)) == patient_id
+    assert inspect(session.connection()).get_foreign_keys('threads') == []
+
+
+def test_purge_main_only_after_verifying_the_copy(session, patient, shard_urls):
+    """
+    Tests that purge-main refuses while a shard copy differs, then deletes
+    the main database's patients without taking their threads along.
+    """
+    patient_id, full_name = patient.id, patient.full_name
+    session.commit()
+    shard_map = init_shards(DATABASE_URL, shard_urls[:2])
+    session.add(ConversationThread(patient_id=patient_id))
+    session.commit()
+    shard = create_engine(shard_urls[patient_id % 2], poolclass=NullPool)
+    with shard.begin() as connection:
+        connection.execute(update(Patient).values(full_name='Changed'))
+
+    with pytest.raises(RuntimeError):
+        purge_main(DATABASE_URL, shard_map)
+    assert session.scalars(select(Patient.id)).all() == [patient_id]
+    session.commit()
+
+    with shard.begin() as connection:
+        connection.execute(update(Patient).values(full_name=full_name))
+    shard.dispose()
+
+    assert purge_main(DATABASE_URL, shard_map) == 1
+    assert session.scalars(select(Patient.id)).all() == []
+    assert session.scalars(select(ConversationThread.patient_id)).all() == [patient_id]
+
+
+def test_rebalanced_map_moves_few_buckets():
+    """
+    Tests that adding a shard only moves its even share of buckets.
+    """
+    old_map = ShardMap.even(['a', 'b'])
+    new_map = old_map.rebalanced(['a', 'b', 'c'])
+
+    assert [new_map.buckets.count(index) for index in range(3)] == [342, 341, 341]
+    assert sum(old != new for old, new in zip(old_map.buckets, new_map.buckets)) == 341
+
+
+def test_reshard_moves_buckets(sharded_client, shard_urls, patient_json):
+    """
+    Tests that replacing a shard copies its buckets to the new one and every
+    patient stays reachable with the new map.
+    """
+    ids = [_create(sharded_client, patient_json, f'p{n}@example.com') for n in range(5)]
+    old_map = ShardMap.even(shard_urls[:2])
+
+    new_map = reshard(old_map, shard_urls[1:])
+
+    assert _patient_ids(shard_urls[0]) == []
+    assert _patient_ids(shard_urls[1]) == [1, 3, 5]
+    assert _patient_ids(shard_urls[2]) == [2, 4]
+
+    _use_shards(new_map)
+    assert [p['id'] for p in sharded_client.get('/patients/').json()] == ids
+    assert sharded_client.get('/patients/4').json()['email'] == 'p3@example.com'
+
+
+def test_sharded_patient_threads(sharded_client, session, patient_json):
+    """
+    Tests that the main database's threads accept patients living on a shard
+    and are removed with the patient.
+    """
+    patient_id = _create(sharded_client, patient_json, 'p0@example.com')
+    token = sharded_client.post(
+        '/auth/token', data={'username': 'p0@example.com', 'password': patient_json['password']}
+    ).json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    response = sharded_client.post('/threads/', json={}, headers=headers)
+    assert response.status_code == HTTPStatus.CREATED
+    assert session.scalars(select(ConversationThread.patient_id)).all() == [patient_id]
+
+    sharded_client.delete(f'/patients/{patient_id}', headers=headers)
+    session.expire_all()
+    assert session.scalars(select(ConversationThread.id)).all() == []
+
+
+def test_sharded_bulk_import_and_export(sharded_client, session, shard_urls, patient_json, monkeypatch):
+    """
+    Tests that imported patients get their ids from the directory and land
+    on their shard, and that the export merges the shards back in id order.
+    """
+    monkeypatch.setattr(security, 'ADMIN_API_TOKEN', 'admin-secret')
+    monkeypatch.setattr(bulk_import, 'IMPORT_HASH_WORKERS', 0)
+    monkeypatch.setattr(bulk_export, 'EXPORT_BATCH_SIZE', 2)
+    admin = {'X-Admin-Token': 'admin-secret'}
+    _create(sharded_client, patient_json, 'p0@example.com')
+
+    body = ''.join(
+        json.dumps({**patient_json, 'email': email}) + '\n'
+        for email in ('p1@example.com', 'P0@example.com', 'p2@example.com', 'p3@example.com')
+    )
+    report = sharded_client.post('/patients/import', content=body, headers=admin).json()
+
+    assert (report['imported'], report['failed']) == (3, 1)
+    assert report['errors'][0]['line'] == 2
+    assert session.scalars(select(Patient.id)).all() == []
+    assert _patient_ids(shard_urls[0]) == [2, 4]
+    # the refused claim still drew an id from the sequence
+    assert _patient_ids(shard_urls[1]) == [1, 5]
+    directory = session.scalars(select(PatientDirectory.email).order_by(PatientDirectory.patient_id)).all()
+    assert directory == ['p0@example.com', 'p1@example.com', 'p2@example.com', 'p3@example.com']
+
+    response = sharded_client.get('/patients/export', headers=admin)
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    assert [(p['id'], p['email']) for p in exported] == [
+        (1, 'p0@example.com'), (2, 'p1@example.com'), (4, 'p2@example.com'), (5, 'p3@example.com'),
+    ]
@@ -0,0 +1,61 @@
+from http import HTTPStatus
+
+from src.models import ConversationThread
+from src.routers import medical_agent
+
+
+def test_create_and_list_threads(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    first = client.post('/threads/', json={}, headers=headers)
+    second = client.post('/threads/', json={'title': 'Dor de cabeça'}, headers=headers)
+
+    assert first.status_code == HTTPStatus.CREATED
+    assert second.json()['title'] == 'Dor de cabeça'
+    assert second.json()['message_count'] == 0
+
+    response = client.get('/threads/', headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    ids = [thread['id'] for thread in response.json()['threads']]
+    assert ids == [second.json()['id'], first.json()['id']]
+
+
+def test_chat_on_thread_of_another_patient(client, session, patient, token, patient_json):
+    """
+    Tests that a patient cannot post into a thread owned by someone else.
+    """
+    patient_json['email'] = 'other.patient@example.com'
+    other_id = client.post('/patients/', json=patient_json).json()['id']
+    thread = ConversationThread(patient_id=other_id)
+    session.add(thread)
+    session.commit()
+
+    response = client.post(
+        '/chat/',
+        json={'thread_id': thread.id, 'message': 'Olá', 'patient_record': {}},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.FORBIDDEN
+
+
+def test_chat_on_unknown_thread(client, token):
+    response = client.post(
+        '/chat/',
+        json={'thread_id': 'missing', 'message': 'Olá', 'patient_record': {}},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.NOT_FOUND
+
+
+def test_chat_on_full_thread(client, session, patient, token, monkeypatch):
+    monkeypatch.setattr(medical_agent, 'MAX_THREAD_MESSAGES', 10)
+    thread = ConversationThread(patient_id=patient.id, message_count=10)
+    session.add(thread)
+    session.commit()
+
+    response = client.post(
+        '/chat/',
+        json={'thread_id': thread.id, 'message': 'Olá', 'patient_record': {}},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.CONFLICT
@@ -42,6 +42,7 @@ def login_form():
                     st.success("Logged in successfully!")
                     st.session_state["logged_in"] = True
                     st.session_state["token"] = token_data['access_token']
+                    st.session_state["refresh_token"] = token_data['refresh_token']
                     st.switch_page("./pages/chat.py")
 
                 elif response.status_code == HTTPStatus.UNAUTHORIZED:
@@ -1,4 +1,5 @@
 import os
+import uuid
 from time import sleep
 
 import requests
@@ -13,6 +14,8 @@ from utils import (
 
 # --- Configuration ---
 BACKEND_URL = os.environ["BACKEND_URL"]
+CHAT_TIMEOUT_SECONDS = 120
+CHAT_RETRIES = 2
 
 st.set_page_config(page_title="Assistente Médico", page_icon="🩺")
 create_header(header_text="")
@@ -21,6 +24,8 @@ st.markdown("**Lembre-se: este assistente não substitui um médico verdadeiro.*
 # --- Authentication Handling ---
 if st.session_state.get("token"):
     local_storage_set("token", st.session_state.get("token"))
+    if st.session_state.get("refresh_token"):
+        local_storage_set("refresh_token", st.session_state.get("refresh_token"))
 else:
     st.session_state["token"] = local_storage_get("token", "token-get")
 
@@ -29,11 +34,33 @@ st.toast("Autenticação Validada", icon="✅")
 
 # --- API Communication Functions ---
 
-def get_chat_history(patient_id: int, token: str):
+def get_threads(token: str):
+    """Fetches the consultation threads of the patient, most recent first."""
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = requests.get(f"{BACKEND_URL}/threads/", headers=headers)
+        response.raise_for_status()
+        return response.json().get("threads", [])
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error fetching consultations: {e}")
+        return []
+
+def create_thread(token: str):
+    """Opens a new consultation thread in the backend."""
+    headers = {"Authorization": f"Bearer {token}"}
+    try:
+        response = requests.post(f"{BACKEND_URL}/threads/", headers=headers, json={})
+        response.raise_for_status()
+        return response.json()
+    except requests.exceptions.RequestException as e:
+        st.error(f"Error creating consultation: {e}")
+        return None
+
+def get_chat_history(thread_id: str, token: str):
     """Fetches the chat history from the backend."""  
     headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.get(f"{BACKEND_URL}/chat/{patient_id}", headers=headers)
+        response = requests.get(f"{BACKEND_URL}/chat/{thread_id}", headers=headers)
         response.raise_for_status() 
         return response.json().get("messages", [])
     except requests.exceptions.RequestException as e:
@@ -41,15 +68,28 @@ def get_chat_history(patient_id: int, token: str):
         return []
 
 def post_chat_message(thread_id: str, message: str, patient_record: dict, token: str):
-    """Sends a new message to the backend and gets the assistant's response."""
-    headers = {"Authorization": f"Bearer {token}"}
+    """
+    Sends a new message to the backend and gets the assistant's response.
+
+    Timeouts are retried with the same Idempotency-Key, so the backend replays
+    (or waits for) the original answer instead of running the agent twice.
+    """
+    headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": uuid.uuid4().hex}
     payload = {
         "thread_id": thread_id,
         "message": message,
         "patient_record": patient_record
     }
     try:
-        response = requests.post(f"{BACKEND_URL}/chat/", headers=headers, json=payload)
+        for attempt in range(CHAT_RETRIES + 1):
+            try:
+                response = requests.post(
+                    f"{BACKEND_URL}/chat/", headers=headers, json=payload, timeout=CHAT_TIMEOUT_SECONDS
+                )
+                break
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                if attempt == CHAT_RETRIES:
+                    raise
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -62,22 +102,49 @@ with st.sidebar:
     st.header("Ficha Médica do Paciente")
     st.json(st.session_state.patient_data)
     st.info(" A inteligência artificial tem acesso a essa informação e ela será considerada nas análises ")
+
+    if st.button(label="Nova consulta", icon="➕"):
+        new_thread = create_thread(st.session_state["token"])
+        if new_thread:
+            st.session_state.thread_id = new_thread["id"]
+            st.session_state.messages = []
+            st.session_state.history_loaded = True
+            st.rerun()
     
     if st.button(label="Sair da aplicação",icon="➡️",type="primary"):
         st.toast("Saindo da Aplicação... ", icon="➡️")
 
+        # revokes the tokens on the backend, a copy left in the browser is useless
+        try:
+            requests.post(
+                f"{BACKEND_URL}/auth/logout",
+                headers={"Authorization": f"Bearer {st.session_state['token']}"},
+                json={"refresh_token": st.session_state.get("refresh_token")},
+            )
+        except requests.exceptions.ConnectionError:
+            pass
+
         st.session_state.messages =  []
         st.session_state.history_loaded = False
+        st.session_state.thread_id = None
         local_storage_remove("token")
+        local_storage_remove("refresh_token")
 
         sleep(1)
 
         st.switch_page("./app.py")
 
 # --- State Initialization ---
+if not st.session_state.get("thread_id"):
+    threads = get_threads(st.session_state["token"])
+    thread = threads[0] if threads else create_thread(st.session_state["token"])
+    if not thread:
+        st.stop()
+    st.session_state.thread_id = thread["id"]
+    st.session_state.history_loaded = False
+
 if not st.session_state.get("history_loaded"):
-    patient_id = st.session_state.patient_data["id"]
-    st.session_state.messages = get_chat_history(patient_id, st.session_state["token"])
+    st.session_state.messages = get_chat_history(st.session_state.thread_id, st.session_state["token"])
     st.session_state.history_loaded = True
 
 # Display existing chat messages
@@ -96,7 +163,7 @@ if prompt := st.chat_input("Descreva seu sintoma aqui..."):
         st.error("Token de autenticação não encontrado, por favor, logue-se novamente")
         st.stop()
         
-    thread_id = str(st.session_state.patient_data["id"])
+    thread_id = st.session_state.thread_id
     
     with st.spinner("O assistente está pensando..."):
         assistant_response = post_chat_message(
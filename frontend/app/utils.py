@@ -32,6 +32,26 @@ def local_storage_set(key, value):
 def local_storage_remove(key):
     st_javascript(f"localStorage.removeItem('{key}');")
 
+def refresh_session():
+    """
+    Trades the stored refresh token for a new token pair (access tokens are
+    short-lived). Returns the new access token, or None if the session is over.
+    """
+    refresh_token = local_storage_get("refresh_token", "refresh-token-get")
+    if not refresh_token:
+        return None
+
+    response = requests.post(f"{BACKEND_URL}/auth/refresh", json={"refresh_token": refresh_token})
+    if response.status_code != 200:
+        local_storage_remove("refresh_token")
+        return None
+
+    token_data = response.json()
+    st.session_state["token"] = token_data["access_token"]
+    local_storage_set("token", token_data["access_token"])
+    local_storage_set("refresh_token", token_data["refresh_token"])
+    return token_data["access_token"]
+
 def validate_token():
     """
     Checks for a token in session state and validates it against the backend /patients/me endpoint.
@@ -39,7 +59,8 @@ def validate_token():
     - If no token exists locally, redirects to login.
     - If a token exists, it sends it to the backend for validation.
     - If valid (200 OK), it stores the user data in the session and allows the page to load.
-    - If invalid (401 Unauthorized), it clears the local token and redirects to login.
+    - If unchanged (304 Not Modified), the user data already in the session is kept.
+    - If invalid (401 Unauthorized), it tries the refresh token once, then clears the local token and redirects to login.
     - If the server is unreachable, it shows a connection error.
     """
     token = local_storage_get("token", "token-validate")
@@ -53,10 +74,23 @@ def validate_token():
 
     # If a token exists, validate it with the backend
     headers = {"Authorization": f"Bearer {token}"}
+    # every rerun validates again: the data we already hold only needs revalidating
+    if st.session_state.get("patient_data") and st.session_state.get("patient_etag"):
+        headers["If-None-Match"] = st.session_state["patient_etag"]
     try:
         response = requests.get(f"{BACKEND_URL}/patients/me", headers=headers)
+        if response.status_code == 401:
+            token = refresh_session()
+            if token:
+                headers["Authorization"] = f"Bearer {token}"
+                response = requests.get(f"{BACKEND_URL}/patients/me", headers=headers)
+
+        if response.status_code == 304:
+            return
+
         if response.status_code == 200:
             st.session_state["patient_data"] = response.json()
+            st.session_state["patient_etag"] = response.headers.get("ETag")
             return
 
         else: